@@ -1,44 +1,145 @@
-import math
-from globals import media_info_table_columns
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Literal
+
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 import sqlite3
 
+import media_info_query
+import media_info_search
+import semantic_query
+from db_pool import ReadOnlyConnectionPool, enable_wal
+from globals import media_info_table_columns
+from import_media_info_from_dump_file_into_db import create_media_info_table
+
+try:
+    # torch, transformers and faiss are only needed for /semantic/
+    import media_info_semantic
+except ImportError:
+    media_info_semantic = None
+
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 db_path = "D:/MakeMKV/media_info/media_info.db"
+# Catalogue written by import_media_info_into_db_, typed columns back the structured /query/ endpoint
+catalogue_db_path = "D:/MakeMKV/media_info/media_info_new.db"
 items_per_page = 10  # Define the number of items per page
+db_pool_size = 8  # Number of read-only connections, also the number of queries running at once
+# Vector index built by semantics_search_poc.py over the catalogue embeddings
+semantic_index_file = "D:/MakeMKV/media_info/media_info_faiss_index.bin"
+semantic_model = "bert-base-uncased"  # Model name in the model cache directory, or a local model directory
+semantic_candidates = 50  # Rows taken from each ranking before the hybrid mode fuses them
 
+db_pool = None
+catalogue_db_pool = None
+db_executor = None
+semantic_search = None
+encode_executor = None
 
-# Function to search media_info.db
-def search_media_info(query, page):
+
+@app.on_event("startup")
+def open_database():
+    global db_pool, catalogue_db_pool, db_executor
+    # Writable setup first: WAL so the importer doesn't block readers, and a current full-text index since the dump
+    # importer replaces the media_info table
+    enable_wal(db_path)
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    # Calculate the offset based on the current page and items per page
-    offset = (page - 1) * items_per_page
-
-    # Construct the WHERE clause dynamically to search all columns
-    where_clause = " OR ".join([f"{col} LIKE ?" for col in media_info_table_columns])
-
-    # Execute SQL query to search with pagination
-    cursor.execute(
-        f"SELECT * FROM (SELECT *, ROW_NUMBER() OVER () AS row_num FROM media_info WHERE {where_clause}) AS temp "
-        f"WHERE row_num BETWEEN ? AND ?",
-        (['%' + query + '%'] * len(media_info_table_columns) + [offset + 1, offset + items_per_page]))
-    rows = cursor.fetchall()
-    # Count total rows to calculate total pages
-    cursor.execute(f"SELECT COUNT(*) FROM media_info WHERE {where_clause}", (['%' + query + '%'] * len(media_info_table_columns)))
-    total_rows = cursor.fetchone()[0]
-    # Calculate total pages
-    total_pages = math.ceil(total_rows / items_per_page)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'media_info'").fetchone():
+        # Nothing imported yet, an empty table keeps /search/ answering with no results until the first import
+        print(f'Table media_info not found in {db_path}, creating an empty one')
+        with conn:
+            create_media_info_table(conn.cursor(), 'media_info')
+    media_info_search.ensure_fts_index(conn)
     conn.close()
-    return rows, total_pages
+    enable_wal(catalogue_db_path)
+    conn = sqlite3.connect(catalogue_db_path)
+    media_info_query.ensure_query_indexes(conn)
+    conn.close()
+    db_pool = ReadOnlyConnectionPool(db_path, db_pool_size)
+    catalogue_db_pool = ReadOnlyConnectionPool(catalogue_db_path, db_pool_size)
+    db_executor = ThreadPoolExecutor(max_workers=db_pool_size, thread_name_prefix='db')
+
+
+@app.on_event("startup")
+def load_semantic_search():
+    global semantic_search, encode_executor
+    # Model and index are loaded once, /semantic/ answers 503 when either is unavailable
+    if media_info_semantic is None:
+        print("Semantic search disabled, torch/transformers/faiss are not installed")
+        return
+    try:
+        semantic_search = media_info_semantic.SemanticSearch(semantic_index_file, semantic_model)
+    except (OSError, ValueError) as e:
+        print(f"Semantic search disabled: {e}")
+        return
+    # torch already uses every core for one batch, a single thread keeps encodes from competing with each other
+    encode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='encode')
+
+
+@app.on_event("shutdown")
+def close_database():
+    # A failed startup leaves any of these unset
+    for executor in (encode_executor, db_executor):
+        if executor is not None:
+            executor.shutdown()
+    for pool in (db_pool, catalogue_db_pool):
+        if pool is not None:
+            pool.close()
+
+
+async def run_db_query(func, *args):
+    # SQLite calls block, so run them on the database threads instead of the event loop
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(func, *args))
+
+
+# Function to search media_info.db
+def search_media_info(query, page):
+    with db_pool.connection() as conn:
+        rows, total_pages = media_info_search.search_media_info(conn, query, page, items_per_page)
+    return [media_info_search.format_media_info_row(row) for row in rows], total_pages
+
+
+def search_media_info_keyset(query, after=None, before=None):
+    with db_pool.connection() as conn:
+        rows, next_cursor, prev_cursor, total_rows = media_info_search.search_media_info_keyset(
+            conn, query, items_per_page, after, before)
+    return [media_info_search.format_media_info_row(row) for row in rows], next_cursor, prev_cursor, total_rows
+
+
+def query_media_info(filters, limit, offset, sort):
+    with catalogue_db_pool.connection() as conn:
+        return media_info_query.query_media_info(conn, filters, limit, offset, sort)
+
+
+def lookup_semantic_rows(results):
+    with catalogue_db_pool.connection() as conn:
+        return media_info_semantic.lookup_result_rows(conn, results)
+
+
+def search_text_candidates(query, limit):
+    # Best full-text matches of the dump database as dicts with their id and volume, in rank order
+    with db_pool.connection() as conn:
+        rows, _ = media_info_search.search_media_info(conn, query, 1, limit, extra_columns=('id', 'volume'))
+    return [dict(zip(media_info_table_columns, media_info_search.format_media_info_row(row)),
+                 id=row[-2], volume=row[-1]) for row in rows]
+
+
+def lookup_catalogue_keys(volume_names):
+    with catalogue_db_pool.connection() as conn:
+        return semantic_query.catalogue_keys_by_name(conn, volume_names)
+
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
 
 
 @app.get("/", response_class=HTMLResponse)
 async def search_form(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
 
 
 @app.get("/static/css/style.css")
@@ -47,16 +148,95 @@ async def styles():
 
 
 @app.get("/search/", response_class=HTMLResponse)
-async def search_results(request: Request, query: str, page: int = 1):
-    search_results, total_pages = search_media_info(query, page)
-    return templates.TemplateResponse("search_results.html",
-                                      {"request": request,
-                                       "query": query,
+async def search_results(request: Request, query: str, page: int = 1, mode: str = "page",
+                         after: int = None, before: int = None):
+    if mode == "keyset" or after is not None or before is not None:
+        # Cursor paging on id, deep pages cost the same as the first one
+        search_results, next_cursor, prev_cursor, total_rows = await run_db_query(search_media_info_keyset, query,
+                                                                                   after, before)
+        return templates.TemplateResponse(request, "search_results.html",
+                                          {"query": query,
+                                           "search_results": search_results,
+                                           "mode": "keyset",
+                                           "next_cursor": next_cursor,
+                                           "prev_cursor": prev_cursor,
+                                           "total_rows": total_rows})
+
+    search_results, total_pages = await run_db_query(search_media_info, query, page)
+    return templates.TemplateResponse(request, "search_results.html",
+                                      {"query": query,
                                        "search_results": search_results,
+                                       "mode": "page",
                                        "total_pages": total_pages,
                                        "current_page": page})
 
 
+@app.get("/query/")
+async def query_results(hdr_format: str = None, mastering_display_color_primaries: str = None,
+                        min_max_mdl: int = None, max_max_mdl: int = None,
+                        min_max_cll: int = None, max_max_cll: int = None,
+                        min_max_fall: int = None, max_max_fall: int = None,
+                        min_frame_rate: float = None, max_frame_rate: float = None,
+                        min_file_size: int = None, max_file_size: int = None,
+                        min_video_bit_rate: int = None, max_video_bit_rate: int = None,
+                        sort: str = None, limit: int = 50, offset: int = 0):
+    # Structured search, e.g. /query/?hdr_format=Dolby Vision&min_max_cll=1000&mastering_display_color_primaries=Display P3
+    # returns the matching rows together with facet counts over the whole result set
+    filters = {"hdr_format": hdr_format,
+               "mastering_display_color_primaries": mastering_display_color_primaries,
+               "min_max_mdl": min_max_mdl, "max_max_mdl": max_max_mdl,
+               "min_max_cll": min_max_cll, "max_max_cll": max_max_cll,
+               "min_max_fall": min_max_fall, "max_max_fall": max_max_fall,
+               "min_frame_rate": min_frame_rate, "max_frame_rate": max_frame_rate,
+               "min_file_size": min_file_size, "max_file_size": max_file_size,
+               "min_video_bit_rate": min_video_bit_rate, "max_video_bit_rate": max_video_bit_rate}
+    return await run_db_query(query_media_info, filters, min(limit, 500), offset, sort)
+
+
+@app.get("/semantic/")
+async def semantic_results(query: str, k: int = 10, mode: Literal["semantic", "hybrid"] = "semantic"):
+    # Nearest catalogue rows to the query embedding. mode=hybrid fuses them with the full-text ranking of the dump
+    # database by reciprocal rank, a dump row matches the catalogue row of the same volume and unique file name. Per
+    # stage timings are returned in the body and in a Server-Timing header.
+    if semantic_search is None:
+        return JSONResponse({"detail": "Semantic search is not available"}, status_code=503)
+    k = max(1, min(k, 100))
+    candidates = max(k, semantic_candidates) if mode == "hybrid" else k
+    timings = {}
+    request_start = time.perf_counter()
+
+    query_embedding = semantic_search.embedding_cache.get(query)
+    cached = query_embedding is not None
+    if not cached:
+        start = time.perf_counter()
+        query_embedding = await asyncio.get_running_loop().run_in_executor(encode_executor, semantic_search.encode,
+                                                                           query)
+        timings["encode"] = elapsed_ms(start)
+        semantic_search.embedding_cache.put(query, query_embedding)
+    start = time.perf_counter()
+    results = await run_db_query(semantic_search.search, query_embedding, candidates)
+    timings["search"] = elapsed_ms(start)
+
+    start = time.perf_counter()
+    semantic_rows = await run_db_query(lookup_semantic_rows, results)
+    timings["lookup"] = elapsed_ms(start)
+
+    if mode == "hybrid":
+        start = time.perf_counter()
+        text_rows = await run_db_query(search_text_candidates, query, candidates)
+        catalogue_keys = await run_db_query(lookup_catalogue_keys, [(row["volume"], row["title"]) for row in text_rows])
+        timings["text"] = elapsed_ms(start)
+        rows = semantic_query.hybrid_rows(semantic_rows, text_rows, catalogue_keys, k)
+    else:
+        rows = semantic_rows[:k]
+    timings["total"] = elapsed_ms(request_start)
+
+    server_timing = ", ".join(f"{name};dur={duration}" for name, duration in timings.items())
+    return JSONResponse({"query": query, "mode": mode, "k": k, "cached": cached, "results": rows,
+                         "timings_ms": timings, "cache": semantic_search.embedding_cache.stats()},
+                        headers={"Server-Timing": server_timing})
+
+
 if __name__ == "__main__":
     import uvicorn
 
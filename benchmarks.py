@@ -0,0 +1,980 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def create_synthetic_corpus(directory, file_count, file_size):
+    # Random payload files with an .mkv suffix spread over a few sub directories like a real drive
+    for i in range(file_count):
+        sub_dir = Path(directory, f'Title_{i % 10}')
+        sub_dir.mkdir(parents=True, exist_ok=True)
+        with open(Path(sub_dir, f'Title_{i}_4K.mkv'), 'wb') as file:
+            file.write(os.urandom(file_size))
+
+
+def benchmark_scan(file_count=200, file_size=1024 * 1024, worker_counts=(1, 2, 4, 8)):
+    from import_media_info_into_db_ import discover_media_files, iter_media_info
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        create_synthetic_corpus(corpus_dir, file_count, file_size)
+        baseline = None
+        for workers in worker_counts:
+            results, elapsed = timed(lambda: list(iter_media_info(discover_media_files(corpus_dir), workers)))
+            if baseline is None:
+                baseline = results
+            elif results != baseline:
+                raise AssertionError(f'Scan with {workers} workers differs from the serial scan')
+            print(f'workers={workers:<2} files={file_count} elapsed={elapsed:.2f}s '
+                  f'throughput={file_count / elapsed:.1f} files/s')
+
+
+def legacy_bulk_save_or_update(session, media_info_list, file_names):
+    # The per-row update loop bulk_save_or_update used before the set-based upsert, kept for comparison
+    from import_media_info_into_db_ import MediaInfoModel, upsert_columns
+
+    volume = media_info_list[0].volume
+    existing_files = {file[0] for file in session.query(MediaInfoModel.relative_path).filter(
+        MediaInfoModel.volume == volume, MediaInfoModel.relative_path.in_(file_names)).all()}
+    insert_list = []
+    for media_info in media_info_list:
+        if media_info.relative_path not in existing_files:
+            insert_list.append(media_info)
+            continue
+        existing = session.query(MediaInfoModel).filter(
+            MediaInfoModel.volume == media_info.volume,
+            MediaInfoModel.relative_path == media_info.relative_path
+        ).first()
+        for column in upsert_columns:
+            setattr(existing, column, getattr(media_info, column))
+    if insert_list:
+        session.bulk_save_objects(insert_list)
+    session.commit()
+
+
+def synthetic_media_info_models(row_count, volume='WD8A_10TB'):
+    from import_media_info_into_db_ import MediaInfoModel
+
+    return [MediaInfoModel(volume=volume, file_name=f'Title_{i}_4K.mkv', relative_path=f'Movies/Title_{i}_4K.mkv',
+                           duration=8_000_000 + i,
+                           file_size=60_000_000_000 + i, video_format='HEVC', video_bit_rate=70_000_000 + i,
+                           frame_rate=23.976, hdr_format='SMPTE ST 2086', max_mdl=1000, max_fall=400, max_cll=1000,
+                           full_json='{}') for i in range(row_count)]
+
+
+def benchmark_upsert(row_count=50_000, batch_size=100):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from import_media_info_into_db_ import Base, bulk_save_or_update, upgrade_schema
+
+    def report(name, latencies):
+        latencies = sorted(latencies)
+        total = sum(latencies)
+        print(f'{name:<8} rows={row_count} batches={len(latencies)} total={total:.2f}s '
+              f'mean={total / len(latencies) * 1000:.2f}ms p99={latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms')
+
+    for name in ('legacy', 'upsert'):
+        with tempfile.TemporaryDirectory() as db_dir:
+            engine = create_engine(f'sqlite:///{Path(db_dir, "media_info.db").as_posix()}')
+            Base.metadata.create_all(engine)
+            upgrade_schema(engine)
+            session = sessionmaker(bind=engine)()
+            # First import fills the table, the timed re-import then hits an existing row for every file
+            for models in (synthetic_media_info_models(row_count), synthetic_media_info_models(row_count)):
+                latencies = []
+                for i in range(0, row_count, batch_size):
+                    batch = models[i:i + batch_size]
+                    start = time.perf_counter()
+                    if name == 'legacy':
+                        legacy_bulk_save_or_update(session, batch, {model.relative_path for model in batch})
+                    else:
+                        bulk_save_or_update(session, batch)
+                    latencies.append(time.perf_counter() - start)
+            report(name, latencies)
+            session.close()
+            engine.dispose()
+
+
+def synthetic_mediainfo_output(i):
+    # Shape of `mediainfo --Output=JSON` for a UHD remux: general, HEVC video, a few audio and subtitle tracks
+    return {'creatingLibrary': {'name': 'MediaInfoLib', 'version': '24.01', 'url': 'https://mediaarea.net/MediaInfo'},
+            'media': {'@ref': f'F:\\Movies\\Title_{i}_4K.mkv', 'track': [
+                {'@type': 'General', 'UniqueID': str(99528040927093357896556819182693091232 + i),
+                 'VideoCount': '1', 'AudioCount': '3', 'TextCount': '2', 'Format': 'Matroska',
+                 'Format_Version': '4', 'FileSize': str(66_130_000_000 + i), 'Duration': f'{7263 + i % 3000}.104',
+                 'OverallBitRate_Mode': 'VBR', 'OverallBitRate': str(72_848_391 + i), 'FrameRate': '23.976',
+                 'FrameCount': '174139', 'IsStreamable': 'Yes', 'Title': f'Title {i}',
+                 'Encoded_Application': 'MakeMKV v1.17.5 win(x64-release)',
+                 'Encoded_Library': 'libmakemkv v1.17.5 (1.3.10/1.5.2) win(x64-release)'},
+                {'@type': 'Video', 'StreamOrder': '0', 'ID': '1', 'UniqueID': '1', 'Format': 'HEVC',
+                 'Format_Profile': 'Main 10', 'Format_Level': '5.1', 'Format_Tier': 'High', 'CodecID': 'V_MPEGH/ISO/HEVC',
+                 'Duration': '7263.088000000', 'BitRate': str(68_402_093 + i), 'Width': '3840', 'Height': '2160',
+                 'FrameRate_Mode': 'CFR', 'FrameRate': '23.976', 'ColorSpace': 'YUV', 'ChromaSubsampling': '4:2:0',
+                 'BitDepth': '10', 'HDR_Format': 'SMPTE ST 2086', 'HDR_Format_Compatibility': 'HDR10',
+                 'colour_primaries': 'BT.2020', 'transfer_characteristics': 'PQ', 'matrix_coefficients': 'BT.2020 non-constant',
+                 'MasteringDisplay_ColorPrimaries': ('Display P3', 'BT.2020')[i % 2],
+                 'MasteringDisplay_Luminance': ('min: 0.0001 cd/m2, max: 1000 cd/m2',
+                                                'min: 0.0050 cd/m2, max: 4000 cd/m2')[i % 2],
+                 'MaxCLL': f'{900 + i % 600} cd/m2', 'MaxFALL': f'{200 + i % 300} cd/m2'},
+                {'@type': 'Audio', 'StreamOrder': '1', 'ID': '2', 'Format': 'MLP FBA', 'Format_Commercial_IfAny': 'Dolby TrueHD with Dolby Atmos',
+                 'BitRate': '4398000', 'Channels': '8', 'SamplingRate': '48000', 'Language': 'en', 'Default': 'Yes'},
+                {'@type': 'Audio', 'StreamOrder': '2', 'ID': '3', 'Format': 'AC-3', 'BitRate': '640000', 'Channels': '6',
+                 'SamplingRate': '48000', 'Language': 'en', 'Default': 'No'},
+                {'@type': 'Audio', 'StreamOrder': '3', 'ID': '4', 'Format': 'DTS', 'BitRate': '1509000', 'Channels': '6',
+                 'SamplingRate': '48000', 'Language': 'fr', 'Default': 'No'},
+                {'@type': 'Text', 'StreamOrder': '4', 'ID': '5', 'Format': 'PGS', 'Language': 'en', 'Default': 'No'},
+                {'@type': 'Text', 'StreamOrder': '5', 'ID': '6', 'Format': 'PGS', 'Language': 'fr', 'Default': 'No'}]}}
+
+
+def benchmark_dump(line_count=100_000):
+    import ast
+
+    from mkv_info import open_media_info_dump, read_media_info_dump, write_media_info_dump_line, zstandard
+
+    def read_legacy_eval(file_path):
+        # What extract_and_write_media_info did before the JSON Lines reader
+        with open(file_path, 'r') as dump_file:
+            for line in dump_file:
+                yield eval(line.strip())
+
+    def read_legacy_literal_eval(file_path):
+        with open(file_path, 'r') as dump_file:
+            for line in dump_file:
+                yield ast.literal_eval(line.strip())
+
+    def consume(records):
+        count = 0
+        for _ in records:
+            count += 1
+        return count
+
+    with tempfile.TemporaryDirectory() as dump_dir:
+        legacy_path = Path(dump_dir, 'legacy.txt')
+        with open(legacy_path, 'w') as dump_file:
+            for i in range(line_count):
+                dump_file.write(str(synthetic_mediainfo_output(i)) + '\n')
+        json_paths = [Path(dump_dir, 'dump.txt'), Path(dump_dir, 'dump.txt.gz')]
+        if zstandard is not None:
+            json_paths.append(Path(dump_dir, 'dump.txt.zst'))
+        for json_path in json_paths:
+            with open_media_info_dump(json_path, 'w') as dump_file:
+                for i in range(line_count):
+                    write_media_info_dump_line(dump_file, synthetic_mediainfo_output(i))
+
+        runs = [('legacy repr, eval()', read_legacy_eval, legacy_path),
+                ('legacy repr, literal_eval()', read_legacy_literal_eval, legacy_path),
+                ('legacy repr, read_media_info_dump', read_media_info_dump, legacy_path)]
+        runs += [(f'json lines {json_path.name}, read_media_info_dump', read_media_info_dump, json_path)
+                 for json_path in json_paths]
+        for name, reader, file_path in runs:
+            count, elapsed = timed(consume, reader(file_path))
+            print(f'{name:<48} size={file_path.stat().st_size / 1024 / 1024:7.1f} MiB '
+                  f'lines={count} elapsed={elapsed:.2f}s throughput={count / elapsed:,.0f} lines/s')
+
+
+def synthetic_dump_rows(row_count):
+    # Rows shaped like the '#' delimited _final.txt files written by mkv_info
+    hdr_formats = ['SMPTE ST 2086', 'Dolby Vision, Version 1.0, dvhe.07.06, BL+EL+RPU / SMPTE ST 2086',
+                   'SMPTE ST 2094 App 4', None]
+    for i in range(row_count):
+        yield (f'Title_{i}_{("Heat", "Alien", "Dune", "Jaws")[i % 4]}_4K.mkv', f'0{i % 3 + 1}:{i % 60:02}:{i % 59:02}',
+               f'{50 + i % 30}.{i % 100:02} GB', f'{60 + i % 30}.{i % 100:02} Mbps', 'HEVC',
+               f'{50 + i % 30}.{i % 100:02} Mbps', ('23.976', '24.000', '25.000')[i % 3], hdr_formats[i % 4],
+               ('Display P3', 'BT.2020')[i % 2], 'min: 0.0001 cd/m2, max: 1000 cd/m2', 100 + i % 500, 500 + i % 3000)
+
+
+def create_dump_schema_db(db_file, row_count):
+    import sqlite3
+
+    from globals import media_info_table_columns, media_info_table_columns_def
+
+    conn = sqlite3.connect(db_file)
+    columns_schema = ', '.join([f"{col_name} {col_type}" for col_name, col_type in media_info_table_columns_def])
+    conn.execute(f'CREATE TABLE media_info (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns_schema})')
+    with conn:
+        conn.executemany(f'INSERT INTO media_info ({", ".join(media_info_table_columns)}) '
+                         f'VALUES ({", ".join("?" * len(media_info_table_columns))})', synthetic_dump_rows(row_count))
+    return conn
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def benchmark_search(row_counts=(10_000, 100_000, 1_000_000), repeat=20):
+    import math
+
+    from globals import media_info_table_columns
+    from media_info_search import ensure_fts_index, search_media_info
+
+    def legacy_search(conn, query, page, items_per_page):
+        # The ROW_NUMBER() OVER () + LIKE query app.search_media_info ran before the FTS5 index
+        offset = (page - 1) * items_per_page
+        where_clause = " OR ".join([f"{col} LIKE ?" for col in media_info_table_columns])
+        rows = conn.execute(
+            f"SELECT * FROM (SELECT *, ROW_NUMBER() OVER () AS row_num FROM media_info WHERE {where_clause}) AS temp "
+            f"WHERE row_num BETWEEN ? AND ?",
+            (['%' + query + '%'] * len(media_info_table_columns) + [offset + 1, offset + items_per_page])).fetchall()
+        total_rows = conn.execute(f"SELECT COUNT(*) FROM media_info WHERE {where_clause}",
+                                  ['%' + query + '%'] * len(media_info_table_columns)).fetchone()[0]
+        return rows, math.ceil(total_rows / items_per_page)
+
+    queries = ['Dolby Vision', 'Title_4242', 'dun', 'oldier']
+    for row_count in row_counts:
+        with tempfile.TemporaryDirectory() as db_dir:
+            conn = create_dump_schema_db(str(Path(db_dir, 'media_info.db')), row_count)
+            _, index_elapsed = timed(ensure_fts_index, conn)
+            print(f'rows={row_count:,} fts index build={index_elapsed:.2f}s')
+            for name, search in (('legacy', legacy_search), ('fts', search_media_info)):
+                for query in queries:
+                    latencies = []
+                    for _ in range(repeat):
+                        _, elapsed = timed(search, conn, query, 1, 10)
+                        latencies.append(elapsed)
+                    print(f'  {name:<7} query={query!r:<15} p50={percentile(latencies, 0.5) * 1000:8.2f}ms '
+                          f'p99={percentile(latencies, 0.99) * 1000:8.2f}ms')
+            conn.close()
+
+
+def load_test_search(base_url='http://localhost:8000', concurrency=16, request_count=1000,
+                     queries=('Dolby Vision', 'P3', 'Dune', 'HEVC 2160', 'oldier')):
+    # Drives concurrent /search/ requests against a running app (python app.py) and reports throughput and tail latency
+    import http.client
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.parse import urlencode, urlsplit
+
+    url = urlsplit(base_url)
+    local = threading.local()
+
+    def request(i):
+        # One keep-alive connection per client thread
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        start = time.perf_counter()
+        local.conn.request('GET', f'/search/?{urlencode({"query": queries[i % len(queries)], "page": 1 + i % 5})}')
+        response = local.conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f'/search/ returned HTTP {response.status}')
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies, elapsed = timed(lambda: list(executor.map(request, range(request_count))))
+    print(f'concurrency={concurrency} requests={request_count} elapsed={elapsed:.2f}s '
+          f'throughput={request_count / elapsed:.1f} req/s p50={percentile(latencies, 0.5) * 1000:.1f}ms '
+          f'p95={percentile(latencies, 0.95) * 1000:.1f}ms p99={percentile(latencies, 0.99) * 1000:.1f}ms '
+          f'max={max(latencies) * 1000:.1f}ms')
+
+
+def create_catalogue_db(db_file, row_count, volumes=('WD8A_10TB', 'WD2_5TB')):
+    # media_info table with the import_media_info_into_db_ columns plus the VW_4K_MEDIA_INFO view from notes.txt
+    import sqlite3
+
+    conn = sqlite3.connect(db_file)
+    conn.execute('''CREATE TABLE media_info (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, volume VARCHAR NOT NULL, file_name VARCHAR NOT NULL,
+        relative_path VARCHAR, duration INTEGER,
+        formatted_duration VARCHAR, file_size INTEGER, formatted_file_size VARCHAR, overall_bit_rate INTEGER,
+        formatted_overall_bit_rate VARCHAR, video_format VARCHAR, video_bit_rate INTEGER,
+        formatted_video_bit_rate VARCHAR, frame_rate FLOAT, hdr_format VARCHAR, color_primaries VARCHAR,
+        mastering_display_color_primaries VARCHAR, mastering_display_luminance VARCHAR, max_mdl INTEGER,
+        max_fall INTEGER, max_cll INTEGER, full_json TEXT NOT NULL)''')
+    conn.execute('CREATE UNIQUE INDEX ux_media_info_volume_relative_path ON media_info (volume, relative_path)')
+    conn.execute('CREATE INDEX ix_media_info_volume_file_name ON media_info (volume, file_name)')
+    conn.execute("CREATE VIEW VW_4K_MEDIA_INFO as SELECT * FROM MEDIA_INFO WHERE video_format='HEVC'")
+
+    def rows():
+        for i in range(row_count):
+            file_size = 50_000_000_000 + i * 1_000_003 % 30_000_000_000
+            title = f'Title_{i // len(volumes)}_4K'
+            yield (volumes[i % len(volumes)], f'{title}.mkv', f'Movies/{title}/{title}.mkv',
+                   7_263_104 + i % 3_000_000, '02:01:03', file_size, f'{file_size / 1024 ** 3:.2f} GB', 72_848_391,
+                   '72.85 Mbps', ('HEVC', 'HEVC', 'AVC')[i % 3], 68_402_093 + i % 1000, '68402.09 Kbps', 23.976,
+                   ('SMPTE ST 2086', 'Dolby Vision, Version 1.0, dvhe.07.06, BL+EL+RPU / SMPTE ST 2086', None)[i % 3],
+                   'BT.2020', ('Display P3', 'BT.2020')[i % 2],
+                   ('min: 0.0001 cd/m2, max: 1000 cd/m2', 'min: 0.0050 cd/m2, max: 4000 cd/m2')[i % 2],
+                   (1000, 4000)[i % 2], 200 + i % 300, 900 + i % 600 if i % 5 else None, '{}')
+
+    with conn:
+        conn.executemany('INSERT INTO media_info (volume, file_name, relative_path, duration, formatted_duration, '
+                         'file_size, formatted_file_size, overall_bit_rate, formatted_overall_bit_rate, video_format, '
+                         'video_bit_rate, formatted_video_bit_rate, frame_rate, hdr_format, color_primaries, '
+                         'mastering_display_color_primaries, mastering_display_luminance, max_mdl, max_fall, max_cll, '
+                         'full_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows())
+    return conn
+
+
+def benchmark_export(row_count=1_000_000, chunk_size=10_000):
+    import tracemalloc
+
+    from export_media_info_from_db import export_media_info, export_to_csv_1, export_to_csv_2, pq
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        db_file = str(Path(export_dir, 'media_info.db'))
+        create_catalogue_db(db_file, row_count).close()
+        runs = [('fetchall csv (export_to_csv_1)', lambda path: export_to_csv_1(db_file, 'VW_4K_MEDIA_INFO', path, '#'), 'csv'),
+                ('pandas csv (export_to_csv_2)', lambda path: export_to_csv_2(db_file, 'VW_4K_MEDIA_INFO', path, '#'), 'csv')]
+        for output_format in ('csv', 'jsonl', 'parquet'):
+            if output_format == 'parquet' and pq is None:
+                continue
+            runs.append((f'streaming {output_format}', lambda path, output_format=output_format: export_media_info(
+                db_file, 'VW_4K_MEDIA_INFO', path, output_format, '#', chunk_size), output_format))
+
+        for name, export, suffix in runs:
+            output_file = Path(export_dir, f'export.{suffix}')
+            # tracemalloc sees Python and NumPy allocations, which is where the catalogue is held in memory
+            tracemalloc.start()
+            _, elapsed = timed(export, str(output_file))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{name:<32} elapsed={elapsed:6.2f}s peak={peak / 1024 / 1024:8.1f} MiB '
+                  f'size={output_file.stat().st_size / 1024 / 1024:7.1f} MiB')
+            output_file.unlink()
+
+
+def write_synthetic_dump_files(directory, file_count, rows_per_file):
+    for file_index in range(file_count):
+        with open(Path(directory, f'WD{file_index}_10TB_final.txt'), 'w') as dump_file:
+            for row in synthetic_dump_rows(rows_per_file):
+                dump_file.write('#'.join(str(value) for value in row) + '\n')
+
+
+def benchmark_dump_import(file_count=20, rows_per_file=50_000, chunk_size=10_000, workers=None):
+    import sqlite3
+
+    import pandas as pd
+
+    from globals import media_info_table_columns
+    from import_media_info_from_dump_file_into_db import import_media_info_into_db, normalize_media_info_columns
+
+    def legacy_import(directory_path, db_path):
+        # python engine read of every file, one concat, then to_sql(if_exists='replace')
+        dataframes = []
+        for filename in sorted(os.listdir(directory_path)):
+            df = pd.read_csv(Path(directory_path, filename), delimiter='#', header=None, engine='python')
+            df.columns = media_info_table_columns
+            dataframes.append(df)
+        df = normalize_media_info_columns(pd.concat(dataframes, ignore_index=True))
+        conn = sqlite3.connect(db_path)
+        df.to_sql('media_info', conn, if_exists='replace', index=False)
+        conn.close()
+
+    with tempfile.TemporaryDirectory() as dump_dir, tempfile.TemporaryDirectory() as db_dir:
+        write_synthetic_dump_files(dump_dir, file_count, rows_per_file)
+        row_count = file_count * rows_per_file
+        _, elapsed = timed(legacy_import, dump_dir, str(Path(db_dir, 'legacy.db')))
+        print(f'legacy    rows={row_count} elapsed={elapsed:.2f}s throughput={row_count / elapsed:,.0f} rows/s')
+        _, elapsed = timed(import_media_info_into_db, dump_dir, '_final.txt', '#', str(Path(db_dir, 'chunked.db')),
+                           'media_info', chunk_size, workers)
+        print(f'chunked   rows={row_count} elapsed={elapsed:.2f}s throughput={row_count / elapsed:,.0f} rows/s')
+
+
+def legacy_copy_large_file(source_path, dest_path, buffer_size=1024 * 1024):
+    # The read/write loop find_diff.copy_large_file used before the zero-copy engine, kept for comparison
+    with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        while True:
+            buffer = src.read(buffer_size)
+            if not buffer:
+                break
+            dst.write(buffer)
+
+
+def benchmark_copy(file_count=4, file_size=256 * 1024 * 1024, worker_counts=(1, 4)):
+    import filecmp
+
+    from find_diff import copy_files
+
+    with tempfile.TemporaryDirectory(dir='.') as work_dir:
+        source_dir = Path(work_dir, 'source')
+        source_dir.mkdir()
+        files = [f'Title_{i}_4K.mkv' for i in range(file_count)]
+        for file in files:
+            with open(Path(source_dir, file), 'wb') as f:
+                for _ in range(file_size // (16 * 1024 * 1024)):
+                    f.write(os.urandom(16 * 1024 * 1024))
+        total_bytes = file_count * file_size
+
+        def report(label, elapsed):
+            print(f'{label:<24} files={file_count} elapsed={elapsed:.2f}s '
+                  f'throughput={total_bytes / elapsed / 1024 / 1024:.0f} MiB/s')
+
+        legacy_dir = Path(work_dir, 'legacy')
+        legacy_dir.mkdir()
+        _, elapsed = timed(lambda: [legacy_copy_large_file(Path(source_dir, file), Path(legacy_dir, file))
+                                    for file in files])
+        report('legacy read/write', elapsed)
+
+        for workers in worker_counts:
+            dest_dir = Path(work_dir, f'dest_{workers}')
+            _, elapsed = timed(copy_files, files, str(source_dir), str(dest_dir), workers)
+            report(f'zero-copy workers={workers}', elapsed)
+            for file in files:
+                if not filecmp.cmp(Path(source_dir, file), Path(dest_dir, file), shallow=False):
+                    raise AssertionError(f'{file} differs after copying with {workers} workers')
+
+        # Cut every copy in half, resuming has to copy only the missing half
+        dest_dir = Path(work_dir, f'dest_{worker_counts[0]}')
+        for file in files:
+            os.truncate(Path(dest_dir, file), file_size // 2)
+        _, elapsed = timed(copy_files, files, str(source_dir), str(dest_dir), worker_counts[0])
+        report('resume from half', elapsed)
+        for file in files:
+            if not filecmp.cmp(Path(source_dir, file), Path(dest_dir, file), shallow=False):
+                raise AssertionError(f'{file} differs after resuming')
+
+
+def benchmark_embeddings(model_name_or_path='bert-base-uncased', text_count=2_000, batch_sizes=(1, 16, 32, 64)):
+    # Needs the model available locally (see media_info_embeddings), the texts are built like the catalogue ones
+    import torch
+    from transformers import BertModel, BertTokenizer
+
+    from media_info_embeddings import EmbeddingModel, default_cache_dir, media_info_text
+
+    texts = [media_info_text((f'Title_{i}_4K.mkv', 'WD8A_10TB', '02:01:03', '46.57 GB', 'HEVC', 23.976,
+                              'SMPTE ST 2086', 'Display P3', 1000, 900 + i % 3000, 200 + i % 400))
+             for i in range(text_count)]
+
+    def legacy_encode(texts):
+        # convert_to_embeddings before the embedding subsystem: model loaded per call, one text at a time, autograd on
+        tokenizer = BertTokenizer.from_pretrained(model_name_or_path, cache_dir=default_cache_dir)
+        model = BertModel.from_pretrained(model_name_or_path, cache_dir=default_cache_dir)
+        embeddings = []
+        for text in texts:
+            inputs = tokenizer(text, return_tensors='pt', truncation=True, padding=True, max_length=512)
+            embeddings.append(model(**inputs).last_hidden_state.mean(dim=1).detach().numpy())
+        return embeddings
+
+    legacy_count = min(text_count, 200)
+    _, elapsed = timed(legacy_encode, texts[:legacy_count])
+    print(f'legacy         texts={legacy_count} elapsed={elapsed:.2f}s throughput={legacy_count / elapsed:.1f} emb/s')
+
+    model, elapsed = timed(EmbeddingModel, model_name_or_path)
+    print(f'model load     elapsed={elapsed:.2f}s threads={torch.get_num_threads()}')
+    for batch_size in batch_sizes:
+        _, elapsed = timed(model.encode, texts, batch_size)
+        print(f'batch_size={batch_size:<3} texts={text_count} elapsed={elapsed:.2f}s '
+              f'throughput={text_count / elapsed:.1f} emb/s')
+
+
+stub_mediainfo_script = """
+import json, os, sys, time
+file_path = sys.argv[-1]
+time.sleep(float(os.environ.get('STUB_MEDIAINFO_DELAY', '0.2')))
+if 'hang' in file_path:
+    time.sleep(60)
+if 'flaky' in file_path and not os.path.exists(file_path + '.tried'):
+    open(file_path + '.tried', 'w').close()
+    sys.exit('flaky failure')
+print(json.dumps({'media': {'@ref': file_path, 'track': [{'@type': 'General', 'FileSize': '1000'}]}}))
+"""
+
+
+def benchmark_mediainfo(file_count=40, delay=0.2, concurrency_levels=(1, 4, 8, 16)):
+    # A stub mediainfo that sleeps like process spawn plus disk seek, so the gain comes from overlapping runs only
+    import asyncio
+    import json
+    import sys
+
+    import mkv_info
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        stub_path = Path(work_dir, 'stub_mediainfo.py')
+        stub_path.write_text(stub_mediainfo_script)
+        cmd = [sys.executable, str(stub_path)]
+        os.environ['STUB_MEDIAINFO_DELAY'] = str(delay)
+        paths = [Path(work_dir, f'Title_{i}_4K.mkv') for i in range(file_count)]
+        for path in paths:
+            path.touch()
+
+        def serial_dump(dump_path):
+            with mkv_info.open_media_info_dump(dump_path, 'w') as dump_file:
+                for path in paths:
+                    mkv_info.write_media_info_dump_line(dump_file, json.loads(mkv_info.run_mediainfo(str(path), cmd)))
+
+        serial_path = Path(work_dir, 'serial.txt')
+        _, elapsed = timed(serial_dump, serial_path)
+        print(f'serial        files={file_count} elapsed={elapsed:.2f}s throughput={file_count / elapsed:.1f} files/s')
+        for concurrency in concurrency_levels:
+            dump_path = Path(work_dir, f'async_{concurrency}.txt')
+            _, elapsed = timed(asyncio.run, mkv_info.dump_media_info_async(paths, str(dump_path), None, concurrency,
+                                                                           cmd))
+            print(f'async c={concurrency:<3} files={file_count} elapsed={elapsed:.2f}s '
+                  f'throughput={file_count / elapsed:.1f} files/s')
+            if dump_path.read_bytes() != serial_path.read_bytes():
+                raise AssertionError(f'Dump with concurrency {concurrency} differs from the serial dump')
+
+        # One file hangs past the timeout, one fails on its first attempt and succeeds on the retry
+        flaky_paths = [Path(work_dir, 'flaky_4K.mkv'), Path(work_dir, 'hang_4K.mkv')]
+        for path in flaky_paths:
+            path.touch()
+        (file_count_dumped, error_list), elapsed = timed(
+            asyncio.run, mkv_info.dump_media_info_async(paths + flaky_paths, str(Path(work_dir, 'retry.txt')), None, 8,
+                                                        cmd, timeout=delay + 1, retries=1))
+        print(f'timeout/retry dumped={file_count_dumped} errors={[Path(path).name for path in error_list]} '
+              f'elapsed={elapsed:.2f}s')
+
+
+def synthetic_pymediainfo_data(i):
+    # Shape of pymediainfo's MediaInfo.to_data() for the same title, as import_media_info_into_db_ reads it
+    keys = {'Duration': 'duration', 'FileSize': 'file_size', 'OverallBitRate': 'overall_bit_rate', 'Format': 'format',
+            'BitRate': 'bit_rate', 'FrameRate': 'frame_rate', 'HDR_Format': 'hdr_format',
+            'colour_primaries': 'color_primaries', 'MasteringDisplay_ColorPrimaries': 'mastering_display_color_primaries',
+            'MasteringDisplay_Luminance': 'mastering_display_luminance', 'MaxFALL': 'maximum_frameaverage_light_level',
+            'MaxCLL': 'maximum_content_light_level', 'Format_Commercial_IfAny': 'commercial_name',
+            'Channels': 'channel_s', 'Language': 'language'}
+    numbers = {'duration', 'file_size', 'overall_bit_rate', 'bit_rate', 'channel_s'}
+    tracks = [{'track_type': track['@type'],
+               **{keys.get(key, key.lower()): int(float(value)) if keys.get(key) in numbers else value
+                  for key, value in track.items() if key != '@type'}}
+              for track in synthetic_mediainfo_output(i)['media']['track']]
+    return {'tracks': tracks, 'volume': 'WD8A_10TB'}
+
+
+def benchmark_tracks(file_count=100_000):
+    # Per-file extraction cost of the recorded mediainfo outputs, the _final.txt fields from the CLI JSON and the
+    # catalogue row from the pymediainfo data, next() per track type vs the single pass track records
+    import json
+
+    from globals import convert_bitrate_to_kbps, convert_bitrate_to_mbps, format_duration, format_file_size
+    from import_media_info_into_db_ import prepare_media_info
+    from mkv_info import extract_fields_from_media_info
+
+    def legacy_extract_fields(media_info):
+        media_details = {'Title': os.path.basename(media_info['media']['@ref'])}
+        general_track = next((track for track in media_info['media']['track'] if track['@type'] == 'General'), None)
+        if general_track:
+            duration = general_track.get('Duration')
+            media_details['Duration'] = format_duration(duration) if duration else None
+            file_size = general_track.get('FileSize')
+            media_details['File_size'] = format_file_size(int(file_size)) if file_size else None
+            media_details['OverallBitRate'] = convert_bitrate_to_mbps(general_track.get('OverallBitRate'))
+        video_track = next((track for track in media_info['media']['track'] if track['@type'] == 'Video'), None)
+        if video_track:
+            media_details['Video_Codec'] = video_track.get('Format')
+            if media_details['Video_Codec'] not in ['HEVC']:
+                return None
+            media_details['Video_Bit_Rate'] = convert_bitrate_to_mbps(video_track.get('BitRate'))
+            media_details['FrameRate'] = video_track.get('FrameRate')
+            media_details['HDR_Format'] = video_track.get('HDR_Format')
+            media_details['MasteringDisplay_ColorPrimaries'] = video_track.get('MasteringDisplay_ColorPrimaries')
+            media_details['MasteringDisplay_Luminance'] = video_track.get('MasteringDisplay_Luminance')
+            media_details['MaxFALL'] = str(video_track.get('MaxFALL')).replace('cd/m2', '').strip()
+            media_details['MaxCLL'] = str(video_track.get('MaxCLL')).replace('cd/m2', '').strip()
+        return media_details
+
+    def legacy_prepare_fields(media_info):
+        # The JSON round trip main and prepare_media_info did, then one scan per track type
+        media_info_json = json.dumps(media_info)
+        media_info = json.loads(media_info_json)
+        general_info = next((track for track in media_info['tracks'] if track['track_type'] == 'General'), {})
+        video_info = next((track for track in media_info['tracks'] if track['track_type'] == 'Video'), {})
+        return (format_duration(general_info.get('duration')), format_file_size(general_info.get('file_size')),
+                convert_bitrate_to_mbps(general_info.get('overall_bit_rate')), video_info.get('format'),
+                convert_bitrate_to_kbps(video_info.get('bit_rate')), video_info.get('hdr_format'),
+                video_info.get('maximum_content_light_level'), media_info_json)
+
+    def track_record_prepare_fields(media_info):
+        tracks = MediaTracks.from_pymediainfo(media_info)
+        general_info, video_info = tracks.general, tracks.video
+        return (format_duration(general_info.duration), format_file_size(general_info.file_size),
+                convert_bitrate_to_mbps(general_info.overall_bit_rate), video_info.format,
+                convert_bitrate_to_kbps(video_info.bit_rate), video_info.hdr_format, video_info.max_cll,
+                json.dumps(media_info))
+
+    from media_tracks import MediaTracks
+
+    outputs = [synthetic_mediainfo_output(i) for i in range(file_count)]
+    data = [synthetic_pymediainfo_data(i) for i in range(file_count)]
+
+    for name, func, items in (('legacy next() _final.txt fields', legacy_extract_fields, outputs),
+                              ('track records _final.txt fields', extract_fields_from_media_info, outputs),
+                              ('legacy next() + JSON round trip', legacy_prepare_fields, data),
+                              ('track records, one json.dumps', track_record_prepare_fields, data)):
+        results, elapsed = timed(lambda: [func(item) for item in items])
+        print(f'{name:<34} files={file_count} elapsed={elapsed:.2f}s per file={elapsed / file_count * 1e6:.1f}us')
+        if func is legacy_extract_fields:
+            expected_fields = results
+        elif func is extract_fields_from_media_info and results != expected_fields:
+            raise AssertionError('Track record extraction differs from the legacy _final.txt fields')
+        elif func is legacy_prepare_fields:
+            expected_fields = results
+        elif func is track_record_prepare_fields and results != expected_fields:
+            raise AssertionError('Track record catalogue fields differ from the legacy ones')
+
+    # The full catalogue row, SQLAlchemy model construction included, plus the audio/subtitle summary it now carries
+    _, elapsed = timed(lambda: [prepare_media_info(f'Title_{i}_4K.mkv', item) for i, item in enumerate(data)])
+    print(f'{"prepare_media_info":<34} files={file_count} elapsed={elapsed:.2f}s '
+          f'per file={elapsed / file_count * 1e6:.1f}us')
+    row = prepare_media_info('Title_0_4K.mkv', data[0])
+    print(f'audio={row.audio_formats!r} audio_languages={row.audio_languages!r} '
+          f'subtitles={row.subtitle_languages!r}')
+
+
+def column_formatter_samples(row_count, rng):
+    # Typed values of the dump table columns the formatted export renders
+    import numpy as np
+
+    return {'file_size': np.exp(rng.uniform(0, np.log(2.0 ** 52), row_count)).astype(np.int64).tolist(),
+            'overall_bitrate': rng.integers(0, 150_000_000, row_count).tolist(),
+            'video_bitrate': rng.integers(0, 150_000_000, row_count).tolist(),
+            'duration': rng.integers(0, 6 * 3600 * 1000, row_count).tolist()}
+
+
+def benchmark_column_formatters(row_count=1_000_000, chunk_size=10_000):
+    # Per-row scalar formatting vs one column call, on typed 1M row columns like the dump table holds, then the
+    # formatted export's format_chunks vs format_media_info_row over whole dump rows
+    import numpy as np
+
+    import globals
+    import media_info_formatters
+    from export_media_info_from_db import format_chunks
+    from media_info_search import format_media_info_row
+
+    samples = column_formatter_samples(row_count, np.random.default_rng(1))
+    runs = [('file_size', globals.format_file_size, media_info_formatters.format_file_size_column),
+            ('overall_bitrate', globals.convert_bitrate_to_mbps, media_info_formatters.convert_bitrate_to_mbps_column),
+            ('duration', globals.format_duration, media_info_formatters.format_duration_column)]
+    for column_name, scalar, column in runs:
+        values = samples[column_name]
+        expected, scalar_elapsed = timed(lambda: [scalar(value) for value in values])
+        results, column_elapsed = timed(column, values)
+        if results.tolist() != expected:
+            raise AssertionError(f'{column.__name__} differs from {scalar.__name__} on the benchmark column')
+        print(f'{scalar.__name__:<24} rows={row_count} scalar={scalar_elapsed:.2f}s column={column_elapsed:.2f}s '
+              f'speedup={scalar_elapsed / column_elapsed:.1f}x')
+
+    rows = [(f'Title_{i}_4K.mkv', samples['duration'][i], samples['file_size'][i], samples['overall_bitrate'][i],
+             'HEVC', samples['video_bitrate'][i], 23.976, 'SMPTE ST 2086', 'Display P3',
+             'min: 0.0050 cd/m2, max: 4000 cd/m2', 400, 1000) for i in range(row_count)]
+    chunks = [rows[i:i + chunk_size] for i in range(0, row_count, chunk_size)]
+    # Chunks are dropped once formatted, the way the export writes and forgets them
+    _, scalar_elapsed = timed(lambda: sum(len([format_media_info_row(row) for row in chunk]) for chunk in chunks))
+    column_names = globals.media_info_table_columns
+    _, column_elapsed = timed(lambda: sum(len(chunk) for chunk in format_chunks(chunks, column_names)))
+    results = [row for chunk in format_chunks(chunks, column_names) for row in chunk]
+    if results != [format_media_info_row(row) for row in rows]:
+        raise AssertionError('format_chunks differs from format_media_info_row')
+    print(f'{"formatted export rows":<24} rows={row_count} per row={scalar_elapsed:.2f}s '
+          f'format_chunks={column_elapsed:.2f}s speedup={scalar_elapsed / column_elapsed:.1f}x')
+
+
+def hdr_metadata_corpus(csv_path='media_info.csv'):
+    # Real mastering display strings of the catalogue export, plus the variants other mediainfo versions and
+    # ffprobe write for the same metadata
+    import csv
+
+    with open(csv_path, newline='', encoding='utf-8') as csv_file:
+        rows = list(csv.DictReader(csv_file, delimiter='#'))
+    luminances = [row['mastering_display_luminance'] for row in rows]
+    primaries = [row['mastering_display_color_primaries'] for row in rows]
+    light_levels = [row['max_cll'] for row in rows] + [row['max_fall'] for row in rows]
+    luminances += ['max: 1000 cd/m2, min: 0.0050 cd/m2', 'min:0.0001cd/m2 max:1000cd/m2', 'max: 4000 cd/m2',
+                   'min: 0.0050 cd/m2,max: 4000 cd/m2', 'min: 0.005 cd/m2, max: 1e3 cd/m2']
+    primaries += ['R: x=0.680000 y=0.320000, G: x=0.265000 y=0.690000, B: x=0.150000 y=0.060000, '
+                  'White point: x=0.312700 y=0.329000', 'BT.709', 'DCI-P3']
+    return luminances, primaries, light_levels
+
+
+def ffmpeg_side_data(luminance, max_cll, i):
+    # ffmpeg text output for one title, the old display_primaries style or ffprobe's side data, MaxCLL sometimes absent
+    if i % 2:
+        text = ('display_primaries_x=0.265 0.15 0.68\ndisplay_primaries_y=0.69 0.06 0.32\n'
+                'white_point_x=0.3127\nwhite_point_y=0.329\n'
+                f'min_luminance={luminance.min}\nmax_luminance={luminance.max}\n')
+        return text + (f'MaxFALL=400\nMaxCLL={max_cll}\n' if max_cll else '')
+    text = ('side_data_type=Mastering display metadata\nred_x=34000/50000\nred_y=16000/50000\ngreen_x=13250/50000\n'
+            'green_y=34500/50000\nblue_x=7500/50000\nblue_y=3000/50000\nwhite_point_x=15635/50000\n'
+            f'white_point_y=16450/50000\nmin_luminance={round(luminance.min * 10000)}/10000\n'
+            f'max_luminance={round(luminance.max * 10000)}/10000\n')
+    return text + (f'side_data_type=Content light level metadata\nmax_content={max_cll}\nmax_average=400\n'
+                   if max_cll else '')
+
+
+def benchmark_hdr_metadata(row_count=1_000_000, file_count=20_000, csv_path='media_info.csv'):
+    # Catalogue-sized parsing of the media_info.csv strings: the old split/compile-per-call parsers vs hdr_metadata's
+    # precompiled, memoized ones
+    import re
+
+    import globals
+    import hdr_metadata
+
+    def legacy_max_mdl(mdl):
+        try:
+            if not mdl:
+                return None
+            parts = mdl.split(",")
+            if len(parts) < 2:
+                raise ValueError("Invalid input format")
+            return int(float(parts[1].strip().split()[1]))
+        except (IndexError, ValueError):
+            return None
+
+    def legacy_extract_after_pattern(input_string):
+        match = re.compile(r".*? is (.*)").search(input_string)
+        if match:
+            return match.group(1).strip()
+
+    def legacy_parse_hdr_metadata(content):
+        # hdr_plot.parse_hdr_metadata before hdr_metadata, minus the file read: six compiles per file
+        hdr_data = {}
+        match = re.compile(r'display_primaries_x=([0-9. ]+)\ndisplay_primaries_y=([0-9. ]+)').search(content)
+        if match:
+            hdr_data['display_primaries_x'] = list(map(float, match.group(1).split()))
+            hdr_data['display_primaries_y'] = list(map(float, match.group(2).split()))
+        hdr_data['white_point_x'] = float(re.compile(r'white_point_x=([0-9.]+)').search(content).group(1))
+        hdr_data['white_point_y'] = float(re.compile(r'white_point_y=([0-9.]+)').search(content).group(1))
+        hdr_data['min_luminance'] = float(re.compile(r'min_luminance=([0-9.]+)').search(content).group(1))
+        hdr_data['max_luminance'] = float(re.compile(r'max_luminance=([0-9.]+)').search(content).group(1))
+        max_fall_match = re.compile(r'MaxFALL=([0-9.]+)').search(content)
+        max_cll_match = re.compile(r'MaxCLL=([0-9.]+)').search(content)
+        if max_fall_match:
+            hdr_data['MaxFALL'] = float(max_fall_match.group(1))
+        if max_cll_match:
+            hdr_data['MaxCLL'] = float(max_cll_match.group(1))
+        return hdr_data
+
+    luminances, primaries, light_levels = hdr_metadata_corpus(csv_path)
+    parsed = [hdr_metadata.parse_mastering_luminance(value) for value in luminances if value]
+    print(f'corpus: {len(luminances)} luminance ({len(set(luminances))} distinct), {len(primaries)} primaries, '
+          f'{len(light_levels)} light level string(s)')
+    # Where the split parser gets a value it's the same, except the variants it misreads (min/max swapped)
+    legacy_failures = [value for value in luminances if value and legacy_max_mdl(value) is None]
+    legacy_misreads = [value for value in luminances if legacy_max_mdl(value) not in (None, globals.max_mdl(value))]
+    print(f'luminance strings the legacy max_mdl fails on: {legacy_failures}, misreads: {legacy_misreads}; '
+          f'hdr_metadata fails on {sum(luminance is None or luminance.max is None for luminance in parsed)}')
+    unparsed_primaries = [value for value in primaries if value and hdr_metadata.parse_mastering_primaries(value) is None]
+    print(f'unparsed primaries strings: {unparsed_primaries}')
+
+    # Catalogue-sized columns, the corpus repeated the way titles repeat the same few mastering displays
+    luminance_column = [luminances[i % len(luminances)] for i in range(row_count)]
+    volume_lines = [f'Volume in drive {chr(68 + i % 20)} is WD{i % 8}A_10TB' for i in range(row_count // 10)]
+    uncached_luminance = hdr_metadata.parse_mastering_luminance.__wrapped__
+    runs = [('legacy max_mdl (split)', lambda: [legacy_max_mdl(value) for value in luminance_column]),
+            ('max_mdl, regex uncached', lambda: [uncached_luminance(value) if value else None
+                                                 for value in luminance_column]),
+            ('max_mdl, regex memoized', lambda: [globals.max_mdl(value) for value in luminance_column]),
+            ('legacy extract_after_pattern', lambda: [legacy_extract_after_pattern(line) for line in volume_lines]),
+            ('extract_after_pattern', lambda: [globals.extract_after_pattern(line) for line in volume_lines])]
+    for name, run in runs:
+        hdr_metadata.parse_mastering_luminance.cache_clear()
+        count = len(volume_lines) if 'extract' in name else row_count
+        _, elapsed = timed(run)
+        print(f'{name:<30} rows={count} elapsed={elapsed:.3f}s per row={elapsed / count * 1e6:.2f}us')
+        if name.endswith('memoized'):
+            print(f'{"":<30} {hdr_metadata.parse_mastering_luminance.cache_info()}')
+
+    # ffmpeg side data of file_count titles, the legacy parser only handles the display_primaries style and raises
+    # on a missing field
+    lines = [ffmpeg_side_data(parsed[i % len(parsed)], light_levels[i % len(light_levels)].replace(' cd/m2', ''), i)
+             for i in range(file_count) if parsed[i % len(parsed)].min is not None]
+    legacy_lines = [line for line in lines if line.startswith('display_primaries_x')]
+    _, elapsed = timed(lambda: [legacy_parse_hdr_metadata(line) for line in legacy_lines])
+    print(f'{"legacy parse_hdr_metadata":<30} files={len(legacy_lines)} elapsed={elapsed:.3f}s '
+          f'per file={elapsed / len(legacy_lines) * 1e6:.1f}us')
+    results, elapsed = timed(lambda: [hdr_metadata.parse_ffmpeg_hdr_metadata(line) for line in legacy_lines])
+    print(f'{"parse_ffmpeg_hdr_metadata":<30} files={len(legacy_lines)} elapsed={elapsed:.3f}s '
+          f'per file={elapsed / len(legacy_lines) * 1e6:.1f}us')
+    results, elapsed = timed(lambda: [hdr_metadata.parse_ffmpeg_hdr_metadata(line) for line in lines])
+    print(f'{"parse_ffmpeg_hdr_metadata, all":<30} files={len(lines)} elapsed={elapsed:.3f}s '
+          f'complete={sum(result.primaries is not None and result.luminance is not None for result in results)}')
+
+
+stub_ffprobe_script = """
+import os, sys, time
+time.sleep(float(os.environ.get('STUB_FFPROBE_DELAY', '0.1')))
+i = sum(map(ord, os.path.basename(sys.argv[-1])))
+print('side_data_type=Mastering display metadata')
+for key, value in (('red_x', 34000), ('red_y', 16000), ('green_x', 13250), ('green_y', 34500), ('blue_x', 7500),
+                   ('blue_y', 3000), ('white_point_x', 15635), ('white_point_y', 16450)):
+    print(f'{key}={value}/50000')
+print(f'min_luminance={(1, 50)[i % 2]}/10000')
+print(f'max_luminance={(10000000, 40000000)[i % 2]}/10000')
+print('side_data_type=Content light level metadata')
+print(f'max_content={400 + i % 3000}')
+print(f'max_average={100 + i % 700}')
+"""
+
+
+def synthetic_hdr_library(row_count, rng):
+    # hdr_columns of row_count titles, mostly P3 masters in a BT.2020 container with a few BT.2020 ones
+    import numpy as np
+
+    from hdr_metadata import named_primaries
+    from hdr_plot import hdr_columns
+
+    gamuts = [named_primaries['display p3'], named_primaries['bt.2020']]
+    rows = []
+    for i in range(row_count):
+        red, green, blue, white_point = gamuts[int(rng.random() < 0.1)]
+        peak = (1000.0, 4000.0, 10000.0)[rng.choice(3, p=[0.7, 0.28, 0.02])]
+        max_cll = None if rng.random() < 0.2 else float(rng.integers(100, peak * 1.2))
+        rows.append([*red, *green, *blue, *white_point, (0.0001, 0.005)[i % 2], peak, max_cll,
+                     None if max_cll is None else float(rng.integers(50, max_cll))])
+    return dict(zip(hdr_columns, np.array(rows, dtype=np.float64).T))
+
+
+def benchmark_hdr_batch(file_count=200, delay=0.1, worker_counts=(1, 8, 16), title_count=5_000, legacy_plots=50):
+    # Batch side data extraction with a stub ffprobe (the gain comes from overlapping the runs), then the library
+    # chart of title_count titles against one interactive-style figure per title
+    import sqlite3
+    import sys
+
+    import matplotlib
+    import numpy as np
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    import hdr_plot
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        stub_path = Path(work_dir, 'stub_ffprobe.py')
+        stub_path.write_text(stub_ffprobe_script)
+        os.environ['STUB_FFPROBE_DELAY'] = str(delay)
+        media_dir = Path(work_dir, 'media')
+        media_dir.mkdir()
+        for i in range(file_count):
+            Path(media_dir, f'Title_{i}_4K.mkv').touch()
+
+        for workers in worker_counts:
+            db_file = str(Path(work_dir, f'hdr_{workers}.db'))
+            (extracted, errors), elapsed = timed(hdr_plot.extract_hdr_metadata_batch, [str(media_dir)], db_file,
+                                                 workers, [sys.executable, str(stub_path)])
+            print(f'workers={workers:<3} files={extracted} errors={len(errors)} elapsed={elapsed:.2f}s '
+                  f'throughput={extracted / elapsed:.1f} files/s')
+        (extracted, _), elapsed = timed(hdr_plot.extract_hdr_metadata_batch, [str(media_dir)], db_file,
+                                        worker_counts[-1], [sys.executable, str(stub_path)])
+        print(f'unchanged rerun files={extracted} elapsed={elapsed:.2f}s')
+        conn = sqlite3.connect(db_file)
+        print('stored:', conn.execute(f'SELECT file_name, {", ".join(hdr_plot.hdr_columns)} '
+                                      f'FROM {hdr_plot.hdr_table_name} LIMIT 1').fetchone())
+        conn.close()
+
+        library = synthetic_hdr_library(title_count, np.random.default_rng(0))
+        output_file = Path(work_dir, 'library.png')
+        _, elapsed = timed(hdr_plot.plot_hdr_library, library, str(output_file))
+        print(f'library chart titles={title_count} elapsed={elapsed:.2f}s '
+              f'png={output_file.stat().st_size / 1024:.0f} KiB')
+
+        def legacy_plots_run():
+            # plot_hdr_metadata per title, saved instead of shown
+            for i in range(legacy_plots):
+                plt.show = lambda: plt.savefig(Path(work_dir, 'title.png'))
+                hdr_plot.plot_hdr_metadata({
+                    'display_primaries_x': [library['red_x'][i], library['green_x'][i], library['blue_x'][i]],
+                    'display_primaries_y': [library['red_y'][i], library['green_y'][i], library['blue_y'][i]],
+                    'white_point_x': library['white_point_x'][i], 'white_point_y': library['white_point_y'][i]})
+                plt.close('all')
+
+        _, elapsed = timed(legacy_plots_run)
+        print(f'per title figures titles={legacy_plots} elapsed={elapsed:.2f}s, '
+              f'{title_count} titles ~{elapsed / legacy_plots * title_count:.0f}s')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmarks for the media info tools.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help='Serial vs process pool media file scan.')
+    scan_parser.add_argument('--files', type=int, default=200)
+    scan_parser.add_argument('--file_size', type=int, default=1024 * 1024)
+
+    upsert_parser = subparsers.add_parser('upsert', help='Per-row update loop vs set-based upsert re-import.')
+    upsert_parser.add_argument('--rows', type=int, default=50_000)
+    upsert_parser.add_argument('--batch_size', type=int, default=100)
+
+    dump_parser = subparsers.add_parser('dump', help='Legacy repr vs JSON Lines media info dump reading.')
+    dump_parser.add_argument('--lines', type=int, default=100_000)
+
+    search_parser = subparsers.add_parser('search', help='/search/ latency, LIKE scan vs FTS5 index.')
+    search_parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    search_parser.add_argument('--repeat', type=int, default=20)
+
+    load_parser = subparsers.add_parser('load', help='Concurrent /search/ load test against a running app.')
+    load_parser.add_argument('--url', type=str, default='http://localhost:8000')
+    load_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    load_parser.add_argument('--requests', type=int, default=1000)
+
+    export_parser = subparsers.add_parser('export', help='fetchall/pandas export vs streaming export.')
+    export_parser.add_argument('--rows', type=int, default=1_000_000)
+    export_parser.add_argument('--chunk_size', type=int, default=10_000)
+
+    dump_import_parser = subparsers.add_parser('dump_import', help='pandas python engine vs chunked dump import.')
+    dump_import_parser.add_argument('--files', type=int, default=20)
+    dump_import_parser.add_argument('--rows_per_file', type=int, default=50_000)
+    dump_import_parser.add_argument('--chunk_size', type=int, default=10_000)
+    dump_import_parser.add_argument('--workers', type=int, default=None)
+
+    copy_parser = subparsers.add_parser('copy', help='read/write loop vs zero-copy, concurrent, resumable copy.')
+    copy_parser.add_argument('--files', type=int, default=4)
+    copy_parser.add_argument('--file_size', type=int, default=256 * 1024 * 1024)
+    copy_parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+
+    embeddings_parser = subparsers.add_parser('embeddings', help='Per-text vs batched no-grad embedding.')
+    embeddings_parser.add_argument('--model', type=str, default='bert-base-uncased')
+    embeddings_parser.add_argument('--texts', type=int, default=2_000)
+    embeddings_parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 16, 32, 64])
+
+    mediainfo_parser = subparsers.add_parser('mediainfo', help='Serial vs async mediainfo extraction with a stub.')
+    mediainfo_parser.add_argument('--files', type=int, default=40)
+    mediainfo_parser.add_argument('--delay', type=float, default=0.2)
+    mediainfo_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+
+    tracks_parser = subparsers.add_parser('tracks', help='next() per track type vs single pass track records.')
+    tracks_parser.add_argument('--files', type=int, default=100_000)
+
+    formatters_parser = subparsers.add_parser('formatters', help='Scalar vs column formatters.')
+    formatters_parser.add_argument('--rows', type=int, default=1_000_000)
+
+    hdr_parser = subparsers.add_parser('hdr', help='Split/compile-per-call vs precompiled, memoized HDR parsing.')
+    hdr_parser.add_argument('--rows', type=int, default=1_000_000)
+    hdr_parser.add_argument('--files', type=int, default=20_000)
+    hdr_parser.add_argument('--csv', type=str, default='media_info.csv', help='Catalogue export the corpus is read from.')
+
+    hdr_batch_parser = subparsers.add_parser('hdr_batch', help='Parallel HDR side data extraction and library chart.')
+    hdr_batch_parser.add_argument('--files', type=int, default=200)
+    hdr_batch_parser.add_argument('--delay', type=float, default=0.1)
+    hdr_batch_parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 16])
+    hdr_batch_parser.add_argument('--titles', type=int, default=5_000)
+
+    args = parser.parse_args()
+    if args.benchmark == 'scan':
+        benchmark_scan(args.files, args.file_size)
+    elif args.benchmark == 'upsert':
+        benchmark_upsert(args.rows, args.batch_size)
+    elif args.benchmark == 'dump':
+        benchmark_dump(args.lines)
+    elif args.benchmark == 'search':
+        benchmark_search(args.rows, args.repeat)
+    elif args.benchmark == 'load':
+        for concurrency in args.concurrency:
+            load_test_search(args.url, concurrency, args.requests)
+    elif args.benchmark == 'export':
+        benchmark_export(args.rows, args.chunk_size)
+    elif args.benchmark == 'dump_import':
+        benchmark_dump_import(args.files, args.rows_per_file, args.chunk_size, args.workers)
+    elif args.benchmark == 'copy':
+        benchmark_copy(args.files, args.file_size, args.workers)
+    elif args.benchmark == 'embeddings':
+        benchmark_embeddings(args.model, args.texts, args.batch_sizes)
+    elif args.benchmark == 'mediainfo':
+        benchmark_mediainfo(args.files, args.delay, args.concurrency)
+    elif args.benchmark == 'tracks':
+        benchmark_tracks(args.files)
+    elif args.benchmark == 'formatters':
+        benchmark_column_formatters(args.rows)
+    elif args.benchmark == 'hdr':
+        benchmark_hdr_metadata(args.rows, args.files, args.csv)
+    elif args.benchmark == 'hdr_batch':
+        benchmark_hdr_batch(args.files, args.delay, args.workers, args.titles)
@@ -0,0 +1,56 @@
+import queue
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+default_pool_size = 8
+default_mmap_size = 256 * 1024 * 1024
+default_cache_size_kib = 64 * 1024
+
+
+def enable_wal(db_path):
+    # WAL is a property of the database file and needs a writable connection, readers then never block the importer
+    conn = sqlite3.connect(db_path)
+    journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    conn.close()
+    return journal_mode
+
+
+class ReadOnlyConnectionPool:
+    """Fixed size pool of read-only SQLite connections that can be handed between threads."""
+
+    def __init__(self, db_path, size=default_pool_size, mmap_size=default_mmap_size,
+                 cache_size_kib=default_cache_size_kib):
+        self.db_uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.connections = queue.LifoQueue()
+        self.all_connections = []
+        for _ in range(size):
+            conn = self._connect()
+            self.all_connections.append(conn)
+            self.connections.put(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_uri, uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        # Negative cache_size is in KiB rather than pages
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kib)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # Blocks until a connection is free, a connection is only ever used by one thread at a time
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        for conn in self.all_connections:
+            conn.close()
+        self.all_connections.clear()
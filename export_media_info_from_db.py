@@ -1,9 +1,24 @@
 import csv
+import json
 import pandas as pd
 import sqlite3
 
+from media_info_formatters import display_column_formatters
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+export_formats = ['csv', 'jsonl', 'parquet']
+
+
+def get_query(table_name, all_columns=False):
+    if all_columns:
+        return f"SELECT * FROM {table_name}"
 
-def get_query(table_name):
     columns = ['volume as Volume',
                'file_name as Title',
                'formatted_duration as Duration',
@@ -69,10 +84,175 @@ def export_to_csv_2(db_file, table_name, output_file, delimiter=','):
     print(f"Exported data from table '{table_name}' to to '{output_file}'")
 
 
-# Example usage
-db_file = 'D:/MakeMKV/media_info/media_info_new.db'
-table_name = 'VW_4K_MEDIA_INFO'
-csv_file = 'D:/MakeMKV/media_info/media_info.csv'
-delimiter = '#'
+def iter_chunks(cursor, chunk_size):
+    # fetchmany keeps at most chunk_size rows in memory however large the table is
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def format_chunks(chunks, column_names):
+    # Typed dump-table columns (duration in ms, sizes in bytes, bit rates in bps) rendered the way /search/ shows them,
+    # one column formatter call per column and chunk instead of a scalar call per value
+    formatters = [(i, display_column_formatters[name]) for i, name in enumerate(column_names)
+                  if name in display_column_formatters]
+    for rows in chunks:
+        if not formatters or not rows:
+            yield rows
+            continue
+        # Only the formatted columns are pulled out of the rows, transposing whole chunks costs more than the
+        # formatting saves
+        formatted_rows = [list(row) for row in rows]
+        for i, formatter in formatters:
+            for row, value in zip(formatted_rows, formatter([row[i] for row in rows]).tolist()):
+                row[i] = value
+        yield [tuple(row) for row in formatted_rows]
+
+
+def write_csv_chunks(chunks, column_names, output_file, delimiter):
+    row_count = 0
+    with open(output_file, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile, delimiter=delimiter)
+        csv_writer.writerow(column_names)
+        for rows in chunks:
+            csv_writer.writerows(rows)
+            row_count += len(rows)
+    return row_count
+
+
+def write_jsonl_chunks(chunks, column_names, output_file):
+    row_count = 0
+    with open(output_file, 'w', encoding='utf-8') as jsonl_file:
+        for rows in chunks:
+            jsonl_file.writelines(json.dumps(dict(zip(column_names, row)), separators=(',', ':')) + '\n'
+                                  for row in rows)
+            row_count += len(rows)
+    return row_count
+
+
+def declared_column_types(conn, query):
+    # Declared SQLite type of every result column of query, e.g. the VARCHAR(1000)/INTEGER/REAL types of
+    # globals.media_info_table_columns_def for the dump table. Resolved through aliases and views by a temporary view
+    # over the query, columns computed by an expression have no declared type ('').
+    conn.execute('DROP VIEW IF EXISTS temp.export_columns')
+    conn.execute(f'CREATE TEMP VIEW export_columns AS {query}')
+    try:
+        return [row[2] for row in conn.execute('PRAGMA temp.table_info(export_columns)')]
+    finally:
+        conn.execute('DROP VIEW temp.export_columns')
+
+
+def arrow_type(declared_type):
+    # SQLite type affinity rules (https://www.sqlite.org/datatype3.html) mapped to Arrow, text for anything else
+    declared_type = declared_type.upper()
+    if 'INT' in declared_type:
+        return pa.int64()
+    if any(name in declared_type for name in ('CHAR', 'CLOB', 'TEXT')):
+        return pa.string()
+    if 'BLOB' in declared_type:
+        return pa.binary()
+    if any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB')):
+        return pa.float64()
+    return pa.string()
+
+
+def cast_value(value, field_type):
+    # SQLite doesn't enforce column types, convert what can be converted and export the rest as NULL
+    if value is None:
+        return None
+    try:
+        if pa.types.is_string(field_type):
+            return value if isinstance(value, str) else str(value)
+        if pa.types.is_integer(field_type):
+            return value if isinstance(value, int) else int(float(value))
+        if pa.types.is_floating(field_type):
+            return float(value)
+        if pa.types.is_binary(field_type):
+            return value if isinstance(value, bytes) else str(value).encode('utf-8')
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return value
+
+
+def arrow_column(values, field_type):
+    try:
+        return pa.array(values, type=field_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # A value stored with another type than the column declares, e.g. text in an INTEGER column
+        return pa.array([cast_value(value, field_type) for value in values], type=field_type)
+
+
+def write_parquet_chunks(chunks, column_names, output_file, column_types):
+    # column_types are the declared SQLite types of the columns, see declared_column_types
+    if pq is None:
+        raise RuntimeError('The pyarrow package is required for Parquet export')
+    schema = pa.schema([pa.field(name, arrow_type(column_type))
+                        for name, column_type in zip(column_names, column_types)])
+    row_count = 0
+    # The schema is known before the first row, so an empty result still writes a valid file
+    with pq.ParquetWriter(output_file, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            # One row group per chunk
+            writer.write_table(pa.Table.from_arrays(
+                [arrow_column(list(values), field.type) for values, field in zip(columns, schema)], schema=schema))
+            row_count += len(rows)
+    return row_count
+
+
+def export_media_info(db_file, table_name, output_file, output_format='csv', delimiter=',', chunk_size=10_000,
+                      all_columns=False, formatted=False):
+    # Streams the table/view to output_file chunk by chunk with constant memory. formatted renders the typed columns of
+    # the dump table (with all_columns) as text, see format_chunks.
+    print(f"Exporting data from table '{table_name}' to '{output_file}' as {output_format}")
+    conn = sqlite3.connect(db_file)
+    query = get_query(table_name, all_columns)
+    column_types = declared_column_types(conn, query) if output_format == 'parquet' else None
+    cursor = conn.cursor()
+    cursor.execute(query)
+    column_names = [description[0] for description in cursor.description]
+    chunks = iter_chunks(cursor, chunk_size)
+    if formatted:
+        chunks = format_chunks(chunks, column_names)
+        if column_types:
+            column_types = ['TEXT' if name in display_column_formatters else column_type
+                            for name, column_type in zip(column_names, column_types)]
+
+    if output_format == 'csv':
+        row_count = write_csv_chunks(chunks, column_names, output_file, delimiter)
+    elif output_format == 'jsonl':
+        row_count = write_jsonl_chunks(chunks, column_names, output_file)
+    elif output_format == 'parquet':
+        row_count = write_parquet_chunks(chunks, column_names, output_file, column_types)
+    else:
+        raise ValueError(f"Unsupported export format '{output_format}', expected one of {export_formats}")
+
+    cursor.close()
+    conn.close()
+    print(f"Exported {row_count} row(s) from table '{table_name}' to '{output_file}'")
+    return row_count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export media info from SQLite to CSV, JSON Lines or Parquet.')
+    parser.add_argument('--db_file', type=str, default='D:/MakeMKV/media_info/media_info_new.db')
+    parser.add_argument('--table', type=str, default='VW_4K_MEDIA_INFO', help='Table or view to export.')
+    parser.add_argument('--output_file', type=str, default='D:/MakeMKV/media_info/media_info.csv')
+    parser.add_argument('--format', type=str, choices=export_formats, default=None,
+                        help='Output format, taken from the output file suffix when not given.')
+    parser.add_argument('--delimiter', type=str, default='#', help='CSV delimiter.')
+    parser.add_argument('--chunk_size', type=int, default=10_000, help='Rows fetched and written per chunk.')
+    parser.add_argument('--all_columns', action='store_true',
+                        help='Export every column instead of the catalogue report columns.')
+    parser.add_argument('--formatted', action='store_true',
+                        help='Render the duration, file size and bit rates of the dump table as text like /search/.')
+    args = parser.parse_args()
 
-export_to_csv_1(db_file, table_name, csv_file, delimiter)
+    output_format = args.format or next((export_format for export_format in export_formats
+                                         if args.output_file.lower().endswith('.' + export_format)), 'csv')
+    export_media_info(args.db_file, args.table, args.output_file, output_format, args.delimiter, args.chunk_size,
+                      args.all_columns, args.formatted)
@@ -1,18 +1,229 @@
+import errno
+import hashlib
+import json
 import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from pprint import pprint
 from tqdm import tqdm
 
+from globals import relative_volume_path
+from media_info_cache import partial_content_hash
+
+hash_index_file_name = '.find_diff_hashes.json'
+# Catalogue written by import_media_info_into_db_, one row per (volume, relative_path)
+catalogue_db_path = 'D:/MakeMKV/media_info/media_info_new.db'
+catalogue_table_name = 'media_info'
+hash_chunk_size = 8 * 1024 * 1024
+# Bytes handed to one copy_file_range/sendfile call
+copy_chunk_size = 64 * 1024 * 1024
+# Leading and trailing windows of a partial destination compared with the source before a copy is resumed
+resume_check_size = 16 * 1024 * 1024
+# errno values meaning "this zero-copy call isn't supported for these files", the copy falls back to read/write
+zero_copy_errors = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def scan_mkv_files(directory):
+    """Recursively map the relative path of every .mkv file to its (size, mtime_ns), using the scandir stat cache."""
+    mkv_files = {}
+    pending = [(directory, '')]
+    while pending:
+        path, relative_dir = pending.pop()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                relative_path = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((entry.path, relative_path))
+                elif entry.name.endswith('.mkv') and entry.is_file():
+                    stat = entry.stat()
+                    mkv_files[relative_path] = (stat.st_size, stat.st_mtime_ns)
+    return mkv_files
+
 
 def get_mkv_files(directory):
     """Recursively get all .mkv files from the directory."""
-    mkv_files = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.mkv'):
-                full_path = os.path.join(root, file)
-                relative_path = os.path.relpath(full_path, directory)
-                mkv_files.append(relative_path)
-    return set(mkv_files)
+    return set(scan_mkv_files(directory))
+
+
+def compare_files(dir1_files, dir2_files):
+    """Compare two scans by relative path, then by size and modification time."""
+    common_files = dir1_files.keys() & dir2_files.keys()
+    return {
+        'only_in_dir1': sorted(dir1_files.keys() - dir2_files.keys()),
+        'only_in_dir2': sorted(dir2_files.keys() - dir1_files.keys()),
+        'size_mismatch': sorted(f for f in common_files if dir1_files[f][0] != dir2_files[f][0]),
+        # Same size but a different mtime is normal for copies, only a content check can tell
+        'unverified': sorted(f for f in common_files
+                             if dir1_files[f][0] == dir2_files[f][0] and dir1_files[f][1] != dir2_files[f][1]),
+        'same': sorted(f for f in common_files if dir1_files[f] == dir2_files[f]),
+    }
+
+
+def load_hash_index(directory):
+    """Load the sidecar hash index of a directory, {relative_path: {size, mtime_ns, algorithm, digest}}."""
+    try:
+        with open(os.path.join(directory, hash_index_file_name), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_hash_index(directory, hash_index):
+    """Write the sidecar hash index atomically so an interrupted run never leaves a truncated index behind."""
+    index_path = os.path.join(directory, hash_index_file_name)
+    try:
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(hash_index, f, indent=1, sort_keys=True)
+        os.replace(index_path + '.tmp', index_path)
+    except OSError as e:
+        print(f'Could not write hash index {index_path}: {e}')
+
+
+def hash_file(path, algorithm='blake2b', progress=None, progress_lock=None):
+    """Hash a file in chunks, 'quick' only samples the size, head and tail of the file."""
+    # A progress bar shared by several hashing threads comes with the lock guarding it
+    progress_lock = progress_lock or threading.Lock()
+    if algorithm == 'quick':
+        digest = partial_content_hash(path)
+        if progress is not None:
+            with progress_lock:
+                progress.update(os.path.getsize(path))
+        return digest
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        while chunk := f.read(hash_chunk_size):
+            digest.update(chunk)
+            if progress is not None:
+                with progress_lock:
+                    progress.update(len(chunk))
+    return digest.hexdigest()
+
+
+def file_hashes(directory, files, relative_paths, algorithm='blake2b', workers=4):
+    """Content hashes of relative_paths, reusing the sidecar index for files whose size and mtime are unchanged."""
+    hash_index = load_hash_index(directory)
+    hashes = {}
+    to_hash = []
+    for relative_path in relative_paths:
+        size, mtime_ns = files[relative_path]
+        entry = hash_index.get(relative_path)
+        if entry and (entry['size'], entry['mtime_ns'], entry['algorithm']) == (size, mtime_ns, algorithm):
+            hashes[relative_path] = entry['digest']
+        else:
+            to_hash.append(relative_path)
+
+    if to_hash:
+        total_bytes = sum(files[relative_path][0] for relative_path in to_hash)
+        progress_lock = threading.Lock()
+        with tqdm(total=total_bytes, desc=f'Hashing {directory}', unit='B', unit_scale=True) as progress, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            # hashlib releases the GIL on large updates, so threads hash files in parallel
+            digests = executor.map(lambda relative_path: hash_file(os.path.join(directory, relative_path), algorithm,
+                                                                   progress, progress_lock), to_hash)
+            for relative_path, digest in zip(to_hash, digests):
+                size, mtime_ns = files[relative_path]
+                hashes[relative_path] = digest
+                hash_index[relative_path] = {'size': size, 'mtime_ns': mtime_ns, 'algorithm': algorithm,
+                                             'digest': digest}
+        save_hash_index(directory, hash_index)
+    return hashes
+
+
+def verify_files(differences, dir1, dir2, dir1_files, dir2_files, algorithm='blake2b', workers=4):
+    """Compare the content of the files present in both directories with the same size."""
+    candidates = differences['unverified'] + differences['same']
+    dir1_hashes = file_hashes(dir1, dir1_files, candidates, algorithm, workers)
+    dir2_hashes = file_hashes(dir2, dir2_files, candidates, algorithm, workers)
+    differences['content_mismatch'] = sorted(f for f in candidates if dir1_hashes[f] != dir2_hashes[f])
+    differences['same'] = sorted(f for f in candidates if dir1_hashes[f] == dir2_hashes[f])
+    differences['unverified'] = []
+    return differences
+
+
+def diff_report(dir1, dir2, dir1_files, dir2_files, differences, algorithm=None):
+    """Machine-readable form of a diff, with the size and mtime of every differing file on both sides."""
+    def file_info(files, relative_path):
+        if relative_path not in files:
+            return None
+        size, mtime_ns = files[relative_path]
+        return {'size': size, 'mtime_ns': mtime_ns}
+
+    report = {'dir1': dir1, 'dir2': dir2, 'verify': algorithm,
+              'summary': {status: len(files) for status, files in differences.items()}}
+    for status, files in differences.items():
+        if status != 'same':
+            report[status] = [{'path': f, 'dir1': file_info(dir1_files, f), 'dir2': file_info(dir2_files, f)}
+                              for f in files]
+    return report
+
+
+def open_catalogue(db_path):
+    """Read-only connection to the catalogue, temporary tables still work for the live directory side."""
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def catalogue_side(conn, side, live_table_name):
+    """SQL source of (relative_path, file_size) for a side of a catalogue diff, a catalogued volume or a live directory.
+
+    Only a live directory is scanned, its files are loaded into a temporary table so both sides are diffed in SQL.
+    Live files are keyed by their path below the drive, computed like import_media_info_into_db_ does for the rows.
+    """
+    if not os.path.isdir(side):
+        return f'SELECT relative_path, file_size FROM {catalogue_table_name} WHERE volume = ?', [side]
+    table_name = f'temp.{live_table_name}'
+    conn.execute(f'CREATE TABLE {table_name} (relative_path TEXT PRIMARY KEY, file_size INTEGER)')
+    conn.executemany(f'INSERT INTO {table_name} VALUES (?, ?)',
+                     ((relative_volume_path(os.path.join(side, relative_path)), size)
+                      for relative_path, (size, _) in scan_mkv_files(side).items()))
+    return f'SELECT relative_path, file_size FROM {table_name}', []
+
+
+def compare_catalogue(conn, side1, side2):
+    """Diff two volumes, or a volume and a live directory, with set differences on (relative_path, file_size)."""
+    for side in (side1, side2):
+        if not os.path.isdir(side) and not conn.execute(
+                f'SELECT 1 FROM {catalogue_table_name} WHERE volume = ? LIMIT 1', (side,)).fetchone():
+            raise ValueError(f'{side} is neither a directory nor a catalogued volume')
+    source1, parameters1 = catalogue_side(conn, side1, 'live_files_1')
+    source2, parameters2 = catalogue_side(conn, side2, 'live_files_2')
+    missing_in_side2 = dict(conn.execute(f'{source1} EXCEPT {source2}', parameters1 + parameters2).fetchall())
+    missing_in_side1 = dict(conn.execute(f'{source2} EXCEPT {source1}', parameters2 + parameters1).fetchall())
+    # A path on both sides of the difference is a file whose size differs
+    size_mismatch = missing_in_side2.keys() & missing_in_side1.keys()
+    differences = {
+        'only_in_dir1': sorted(missing_in_side2.keys() - size_mismatch),
+        'only_in_dir2': sorted(missing_in_side1.keys() - size_mismatch),
+        'size_mismatch': sorted(size_mismatch),
+    }
+    sizes = {'dir1': missing_in_side2, 'dir2': missing_in_side1}
+    return differences, sizes
+
+
+def catalogue_main(db_path, side1, side2, report_path=None):
+    conn = open_catalogue(db_path)
+    try:
+        differences, sizes = compare_catalogue(conn, side1, side2)
+    finally:
+        conn.close()
+
+    print_differences(set(differences['only_in_dir1']), set(differences['only_in_dir2']), side1, side2)
+    print_mismatches(differences, side1, side2)
+    if report_path:
+        report = {'dir1': side1, 'dir2': side2, 'catalogue': db_path,
+                  'summary': {status: len(files) for status, files in differences.items()}}
+        for status, files in differences.items():
+            report[status] = [{'path': f, 'dir1': {'size': sizes['dir1'].get(f)} if f in sizes['dir1'] else None,
+                               'dir2': {'size': sizes['dir2'].get(f)} if f in sizes['dir2'] else None}
+                              for f in files]
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nDiff report written to {report_path}")
+    return differences
 
 
 def print_differences(dir1_files, dir2_files, dir1_name, dir2_name):
@@ -35,53 +246,214 @@ def print_differences(dir1_files, dir2_files, dir1_name, dir2_name):
     return only_in_dir1, only_in_dir2
 
 
-def copy_large_file(source_path, dest_path, buffer_size=1024 * 1024):
-    """Copy a large file using a buffer."""
-    print(f'Copying {source_path} to {dest_path}')
-    with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
-        while True:
-            buffer = src.read(buffer_size)
-            if not buffer:
-                break
-            dst.write(buffer)
-        print(f'Copied {source_path} to {dest_path}')
+def print_mismatches(differences, dir1_name, dir2_name):
+    """Print the files present in both directories that differ in size, content, or could not be verified."""
+    labels = {
+        'size_mismatch': 'Files with a different size',
+        'content_mismatch': 'Files with different content',
+        'unverified': 'Files with the same size but a different modification time (use --verify to compare content)',
+    }
+    for status, label in labels.items():
+        if differences.get(status):
+            print(f"\n{label} in {dir1_name} and {dir2_name}:")
+            pprint(differences[status], width=80)
+
+
+class BandwidthLimiter:
+    """Token bucket shared by all copy threads, bytes_per_second=None means unlimited."""
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self.available = float(bytes_per_second or 0)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, byte_count):
+        # Take byte_count tokens, going into debt if needed and sleeping it off outside the lock
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.available + (now - self.updated) * self.bytes_per_second,
+                                 float(self.bytes_per_second))
+            self.updated = now
+            self.available -= byte_count
+            wait = -self.available / self.bytes_per_second if self.available < 0 else 0
+        if wait:
+            time.sleep(wait)
+
 
+def copy_chunk(src, dst, offset, count, buffer_size, methods):
+    """Copy up to count bytes at offset with the first working method, dropping unsupported ones from methods."""
+    while methods[0] != 'readwrite':
+        try:
+            if methods[0] == 'copy_file_range':
+                return os.copy_file_range(src.fileno(), dst.fileno(), count, offset, offset)
+            os.lseek(dst.fileno(), offset, os.SEEK_SET)
+            return os.sendfile(dst.fileno(), src.fileno(), offset, count)
+        except OSError as e:
+            if e.errno not in zero_copy_errors:
+                raise
+            methods.pop(0)
+    src.seek(offset)
+    data = src.read(min(count, buffer_size))
+    dst.seek(offset)
+    view = memoryview(data)
+    while view:
+        view = view[dst.write(view):]
+    return len(data)
+
+
+def zero_copy_methods():
+    """Kernel copy calls usable on this platform, in order of preference, always ending with plain read/write."""
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append('copy_file_range')
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        # Only Linux sendfile accepts a regular file as destination
+        methods.append('sendfile')
+    return methods + ['readwrite']
+
+
+def resume_offset(source_path, dest_path, source_size):
+    """Length of the destination prefix that can be kept, 0 unless its head and tail match the source.
+
+    Only the first and last resume_check_size bytes of the prefix are compared, so a partial copy damaged
+    somewhere in between is resumed as is. Copy with resume=False, or compare with --verify afterwards, when that
+    can't be ruled out.
+    """
+    try:
+        dest_stat = os.stat(dest_path)
+    except FileNotFoundError:
+        return 0
+    dest_size = dest_stat.st_size
+    # A source modified after the partial copy was written can't be resumed
+    if dest_size == 0 or dest_size > source_size or os.stat(source_path).st_mtime_ns > dest_stat.st_mtime_ns:
+        return 0
+    check_offset = max(0, dest_size - resume_check_size)
+    with open(source_path, 'rb') as src, open(dest_path, 'rb') as dst:
+        # The head catches a destination that was written from another file or overwritten from the start
+        head_size = min(resume_check_size, check_offset)
+        if src.read(head_size) != dst.read(head_size):
+            return 0
+        src.seek(check_offset)
+        dst.seek(check_offset)
+        if src.read(dest_size - check_offset) != dst.read():
+            return 0
+    return dest_size
+
+
+def copy_large_file(source_path, dest_path, buffer_size=1024 * 1024, resume=True, limiter=None, progress=None,
+                    progress_lock=None):
+    """Copy a large file with zero-copy kernel calls where available, resuming a verified partial destination."""
+    # A progress bar shared by several copying threads comes with the lock guarding it
+    progress_lock = progress_lock or threading.Lock()
+    source_size = os.path.getsize(source_path)
+    offset = resume_offset(source_path, dest_path, source_size) if resume else 0
+    if progress is not None:
+        # Progress counts the bytes still to copy so the rate isn't inflated by resumed prefixes
+        with progress_lock:
+            progress.total -= offset
+            progress.refresh()
+    if offset == source_size:
+        tqdm.write(f'Already copied {dest_path}')
+    elif offset:
+        tqdm.write(f'Resuming {source_path} to {dest_path} at {offset} bytes')
+    else:
+        tqdm.write(f'Copying {source_path} to {dest_path}')
+
+    methods = zero_copy_methods()
+    with open(source_path, 'rb', buffering=0) as src, open(dest_path, 'r+b' if offset else 'wb', buffering=0) as dst:
+        while offset < source_size:
+            count = min(copy_chunk_size, source_size - offset)
+            copied = copy_chunk(src, dst, offset, count, buffer_size, methods)
+            if copied == 0:
+                raise IOError(f'{source_path} ended at {offset} bytes, expected {source_size}')
+            # Charged after the call, the read/write fallback copies only buffer_size bytes of count
+            if limiter is not None:
+                limiter.consume(copied)
+            offset += copied
+            if progress is not None:
+                with progress_lock:
+                    progress.update(copied)
+        dst.truncate(source_size)
+    shutil.copystat(source_path, dest_path)
+    tqdm.write(f'Copied {source_path} to {dest_path} ({methods[0]})')
+
+
+def copy_files(files, source_dir, dest_dir, workers=1, max_bytes_per_second=None, resume=True):
+    """Copy files from source_dir to dest_dir, workers at a time, with one progress bar over all bytes."""
+    limiter = BandwidthLimiter(max_bytes_per_second)
+    progress_lock = threading.Lock()
+    total_bytes = sum(os.path.getsize(os.path.join(source_dir, file)) for file in files)
+    failed_files = []
+    with tqdm(total=total_bytes, desc="Copying files", unit="B", unit_scale=True, unit_divisor=1024) as progress, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for file in files:
+            source_path = os.path.join(source_dir, file)
+            dest_path = os.path.join(dest_dir, file)
 
-def copy_files(files, source_dir, dest_dir):
-    """Copy files from source_dir to dest_dir with a progress bar."""
-    for file in tqdm(files, desc="Copying files", unit="file"):
-        source_path = os.path.join(source_dir, file)
-        dest_path = os.path.join(dest_dir, file)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            futures[executor.submit(copy_large_file, source_path, dest_path, resume=resume, limiter=limiter,
+                                    progress=progress, progress_lock=progress_lock)] = file
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except OSError as e:
+                tqdm.write(f'Failed to copy {futures[future]}: {e}')
+                failed_files.append(futures[future])
+    return failed_files
 
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-        copy_large_file(source_path, dest_path)
 
+def main(dir1, dir2, verify=None, workers=4, report_path=None, copy_workers=1, max_bytes_per_second=None):
+    dir1_files = scan_mkv_files(dir1)
+    dir2_files = scan_mkv_files(dir2)
+    differences = compare_files(dir1_files, dir2_files)
+    if verify:
+        verify_files(differences, dir1, dir2, dir1_files, dir2_files, verify, workers)
 
-def main(dir1, dir2):
-    dir1_files = get_mkv_files(dir1)
-    dir2_files = get_mkv_files(dir2)
+    only_in_dir1, only_in_dir2 = print_differences(set(dir1_files), set(dir2_files), dir1, dir2)
+    print_mismatches(differences, dir1, dir2)
 
-    only_in_dir1, only_in_dir2 = print_differences(dir1_files, dir2_files, dir1, dir2)
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(diff_report(dir1, dir2, dir1_files, dir2_files, differences, verify), f, indent=2)
+        print(f"\nDiff report written to {report_path}")
 
     if only_in_dir1:
         prompt = input(f"\nDo you want to copy missing files from {dir1} to {dir2}? (y/n): ")
         if prompt.lower() == 'y':
-            copy_files(only_in_dir1, dir1, dir2)
+            copy_files(only_in_dir1, dir1, dir2, copy_workers, max_bytes_per_second)
 
     if only_in_dir2:
         prompt = input(f"\nDo you want to copy missing files from {dir2} to {dir1}? (y/n): ")
         if prompt.lower() == 'y':
-            copy_files(only_in_dir2, dir2, dir1)
+            copy_files(only_in_dir2, dir2, dir1, copy_workers, max_bytes_per_second)
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
 
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <directory1> <directory2>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Compare the .mkv files of two directories.')
+    parser.add_argument('dir1', help='Directory, or with --catalogue a catalogued volume label or a directory.')
+    parser.add_argument('dir2', help='Directory, or with --catalogue a catalogued volume label or a directory.')
+    parser.add_argument('--catalogue', nargs='?', const=catalogue_db_path, default=None,
+                        help='Diff against the media_info catalogue instead of walking both directories, '
+                             f'only sides that are directories are scanned (default {catalogue_db_path}).')
+    parser.add_argument('--verify', nargs='?', const='blake2b', choices=['blake2b', 'quick'], default=None,
+                        help='Compare the content of files with the same size, "quick" only hashes head and tail. '
+                             f'Hashes are cached in a {hash_index_file_name} file in each directory.')
+    parser.add_argument('--workers', type=int, default=4, help='Files hashed in parallel per directory.')
+    parser.add_argument('--report', default=None, help='Write a JSON diff report to this file.')
+    parser.add_argument('--copy_workers', type=int, default=1, help='Files copied concurrently.')
+    parser.add_argument('--max_mb_per_second', type=float, default=None,
+                        help='Bandwidth cap shared by all concurrent copies, in MiB/s.')
+    args = parser.parse_args()
 
-    dir1 = sys.argv[1]
-    dir2 = sys.argv[2]
+    if args.catalogue:
+        catalogue_main(args.catalogue, args.dir1, args.dir2, args.report)
+        sys.exit(0)
 
-    main(dir1, dir2)
+    main(args.dir1, args.dir2, args.verify, args.workers, args.report, args.copy_workers,
+         args.max_mb_per_second * 1024 * 1024 if args.max_mb_per_second else None)
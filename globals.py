@@ -1,15 +1,19 @@
 import os
 import re
 import subprocess
+from pathlib import PurePosixPath, PureWindowsPath
 
+from hdr_metadata import parse_light_level, parse_mastering_luminance
+
+# Numeric columns hold base units (milliseconds, bytes, bits per second), formatting happens only when rendering
 media_info_table_columns_def = [
     ('title', 'VARCHAR(1000)'),
-    ('duration', 'VARCHAR(20)'),
-    ('file_size_gb', 'VARCHAR(50)'),
-    ('overall_bitrate', 'VARCHAR(50)'),
+    ('duration', 'INTEGER'),
+    ('file_size', 'INTEGER'),
+    ('overall_bitrate', 'INTEGER'),
     ('video_codec', 'VARCHAR(20)'),
-    ('video_bitrate', 'VARCHAR(50)'),
-    ('video_framerate', 'VARCHAR(10)'),
+    ('video_bitrate', 'INTEGER'),
+    ('video_framerate', 'REAL'),
     ('hdr_format', 'VARCHAR(4000)'),
     ('masteringdisplay_color_primaries', 'TEXT'),
     ('masteringdisplay_luminance', 'VARCHAR(1000)'),
@@ -19,6 +23,21 @@ media_info_table_columns_def = [
 
 media_info_table_columns = [column[0] for column in media_info_table_columns_def]
 
+# Volume label in the output of `vol`, "Volume in drive D is WD8A_10TB"
+after_is_pattern = re.compile(r".*? is (.*)")
+
+# JSON paths of the catalogue's full_json promoted to indexed columns of media_info, column -> (path, type).
+# tracks[1] is the video track of the remuxes, tracks[2] the first audio track. Adding an entry backfills the new
+# column on the next import_media_info_into_db_ run.
+promoted_json_columns = {
+    'json_video_color_primaries': ('$.tracks[1].color_primaries', 'TEXT'),
+    'json_video_transfer_characteristics': ('$.tracks[1].transfer_characteristics', 'TEXT'),
+    'json_video_matrix_coefficients': ('$.tracks[1].matrix_coefficients', 'TEXT'),
+    'json_video_bit_depth': ('$.tracks[1].bit_depth', 'INTEGER'),
+    'json_video_width': ('$.tracks[1].width', 'INTEGER'),
+    'json_audio_format': ('$.tracks[2].format', 'TEXT'),
+}
+
 
 def coalesce(*args):
     return next((arg for arg in args if arg is not None and len(str(arg).strip()) > 0), None)
@@ -55,30 +74,28 @@ def format_duration(duration_ms):
     return None
 
 
+def relative_volume_path(path):
+    # Path below the drive or root with / separators, the same for a scan of G:/ or of G:/Movies
+    path = str(path)
+    pure_path = PureWindowsPath(path) if PureWindowsPath(path).drive or '\\' in path else PurePosixPath(path)
+    if pure_path.anchor:
+        pure_path = pure_path.relative_to(pure_path.anchor)
+    return pure_path.as_posix()
+
+
 def is_4k_resolution(width, height):
     # Check if the resolution qualifies as 4K
     return (width == 3840 and height == 2160) or (width == 4096 and height == 2160)
 
 
 def max_mdl(mdl):
-    try:
-        if not mdl:
-            return None
-
-        # Find the part of the string that contains the max value
-        parts = mdl.split(",")
-        if len(parts) < 2:
-            raise ValueError("Invalid input format")
-
-        max_part = parts[1].strip()
-        max_value_str = max_part.split()[1]
-
-        # Extract the numeric value
-        return int(float(max_value_str))
-
-        return max_value
-    except (IndexError, ValueError) as e:
+    # Max mastering display luminance in cd/m2 of "min: 0.0050 cd/m2, max: 4000 cd/m2" (in any order or spacing)
+    if not mdl:
+        return None
+    luminance = parse_mastering_luminance(mdl)
+    if luminance is None or luminance.max is None:
         return None
+    return int(luminance.max)
 
 
 def dict_to_delimited_string(dictionary, delimiter=','):
@@ -87,18 +104,12 @@ def dict_to_delimited_string(dictionary, delimiter=','):
 
 
 def cd_m2_value(input_string):
-    try:
-        return int(input_string.replace(' cd/m2', ''))
-    except ValueError as e:
-        return None
+    return parse_light_level(input_string)
 
 
 def extract_after_pattern(input_string):
-    # Create a regular expression pattern to match "anytoken is " and capture everything after it
-    regex = re.compile(r".*? is (.*)")
-
-    # Search for the pattern in the input string
-    match = regex.search(input_string)
+    # Search for "anytoken is " and capture everything after it
+    match = after_is_pattern.search(input_string)
 
     if match:
         # Extract the captured group which is everything after "anytoken is "
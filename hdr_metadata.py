@@ -0,0 +1,173 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import itemgetter
+
+# Parsing of the HDR mastering metadata strings shared by the importers (mediainfo's MasteringDisplay_* fields) and
+# hdr_plot (ffmpeg/ffprobe side data). The same few strings repeat across a whole catalogue, so the string parsers
+# are memoized, returned records are frozen and safe to share.
+
+parse_cache_size = 4096
+
+number = r'[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?(?:/[0-9]+)?'
+# "min: 0.0050 cd/m2, max: 4000 cd/m2", "max: 1000 cd/m2, min: 0.0001 cd/m2", "min:0.0001cd/m2 max:1000cd/m2",
+# ffprobe's "min_luminance=50/10000"
+luminance_pattern = re.compile(rf'\b(min|max)(?:imum)?(?:_luminance)?\s*[:=]\s*({number})', re.IGNORECASE)
+# "R: x=0.680000 y=0.320000, G: x=0.265000 y=0.690000, B: x=0.150000 y=0.060000, White point: x=0.312700 y=0.329000"
+primary_coordinates_pattern = re.compile(rf'\b(R|G|B|White point)\s*:\s*x\s*=\s*({number})\s*,?\s*y\s*=\s*({number})',
+                                         re.IGNORECASE)
+# "962 cd/m2", "962"
+light_level_pattern = re.compile(r'^\s*([0-9]+)\s*(?:cd/m2|nits)?\s*$', re.IGNORECASE)
+# Keys of the ffmpeg -f ffmetadata / ffprobe -show_frames key=value lines parse_ffmpeg_hdr_metadata reads
+ffmpeg_hdr_keys = frozenset({'red_x', 'red_y', 'green_x', 'green_y', 'blue_x', 'blue_y', 'white_point_x',
+                             'white_point_y', 'display_primaries_x', 'display_primaries_y', 'min_luminance',
+                             'max_luminance', 'MaxCLL', 'MaxFALL', 'max_content', 'max_average'})
+ffprobe_primary_keys = (('red_x', 'red_y'), ('green_x', 'green_y'), ('blue_x', 'blue_y'))
+
+d65_white_point = (0.3127, 0.329)
+# Mastering display primaries mediainfo reports by name, CIE 1931 xy of red, green, blue and the white point
+named_primaries = {
+    'display p3': ((0.68, 0.32), (0.265, 0.69), (0.15, 0.06), d65_white_point),
+    'dci-p3': ((0.68, 0.32), (0.265, 0.69), (0.15, 0.06), (0.314, 0.351)),
+    'bt.2020': ((0.708, 0.292), (0.17, 0.797), (0.131, 0.046), d65_white_point),
+    'bt.709': ((0.64, 0.33), (0.3, 0.6), (0.15, 0.06), d65_white_point),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class MasteringLuminance:
+    min: float = None
+    max: float = None
+
+
+@dataclass(frozen=True, slots=True)
+class MasteringPrimaries:
+    # (x, y) chromaticities, name is the mediainfo name when the primaries were given by name
+    red: tuple
+    green: tuple
+    blue: tuple
+    white_point: tuple = None
+    name: str = None
+
+
+@dataclass(frozen=True, slots=True)
+class HdrMetadata:
+    primaries: MasteringPrimaries = None
+    luminance: MasteringLuminance = None
+    max_cll: int = None
+    max_fall: int = None
+    # ffmpeg reports the white point on its own, it's kept even when the primaries are incomplete
+    white_point: tuple = None
+
+
+def parse_number(text):
+    # "0.0050", "1e3" or ffprobe's rationals "40000000/10000"
+    if '/' not in text:
+        return float(text)
+    numerator, _, denominator = text.partition('/')
+    if denominator:
+        return float(numerator) / float(denominator) if float(denominator) else None
+    return float(numerator)
+
+
+@lru_cache(maxsize=parse_cache_size)
+def parse_mastering_luminance(text):
+    # MasteringLuminance of a mastering display luminance string, None without a min or max value
+    if not text:
+        return None
+    values = {}
+    for name, value in luminance_pattern.findall(text):
+        values.setdefault(name.lower(), value)
+    if not values:
+        return None
+    return MasteringLuminance(parse_number(values['min']) if 'min' in values else None,
+                              parse_number(values['max']) if 'max' in values else None)
+
+
+def primaries_by_position(points):
+    # Three xy points in any order (HEVC SEI lists green, blue, red) -> red, green, blue: red has the largest x,
+    # green the largest y
+    red, first, second = sorted(points, key=itemgetter(0), reverse=True)
+    return (red, first, second) if first[1] >= second[1] else (red, second, first)
+
+
+@lru_cache(maxsize=parse_cache_size)
+def parse_mastering_primaries(text):
+    # MasteringPrimaries of "Display P3"/"BT.2020" style names or of "R: x=... y=..., G: ..." coordinates
+    if not text:
+        return None
+    named = named_primaries.get(text.strip().lower())
+    if named:
+        return MasteringPrimaries(*named, name=text.strip())
+    points = {label.lower(): (parse_number(x), parse_number(y))
+              for label, x, y in primary_coordinates_pattern.findall(text)}
+    if not {'r', 'g', 'b'} <= points.keys():
+        return None
+    return MasteringPrimaries(points['r'], points['g'], points['b'], points.get('white point'))
+
+
+@lru_cache(maxsize=parse_cache_size)
+def parse_light_level(text):
+    # MaxCLL/MaxFALL as an int, None for anything but a plain "962 cd/m2"
+    if text is None:
+        return None
+    match = light_level_pattern.match(str(text))
+    return int(match.group(1)) if match else None
+
+
+def ffmpeg_hdr_values(content):
+    # {key: value} of the ffmpeg_hdr_keys lines of ffmpeg/ffprobe text output, the last line of a key wins. Every
+    # other line (tags, side_data_type, ...) is skipped without being stored.
+    values = {}
+    for line in content.splitlines():
+        key, separator, value = line.partition('=')
+        if separator:
+            key = key.strip()
+            if key in ffmpeg_hdr_keys:
+                values[key] = value.strip()
+    return values
+
+
+def side_data_number(values, key):
+    value = values.get(key)
+    try:
+        return parse_number(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_ffmpeg_hdr_metadata(content):
+    # HdrMetadata of ffmpeg/ffprobe text output, every field is optional. Understands the display_primaries_x/_y
+    # lists and MaxFALL/MaxCLL keys as well as ffprobe's side data (red_x=34000/50000, max_content=1000, ...).
+    values = ffmpeg_hdr_values(content)
+
+    primaries = None
+    white_point = None
+    if values.get('white_point_x') and values.get('white_point_y'):
+        white_point = (side_data_number(values, 'white_point_x'), side_data_number(values, 'white_point_y'))
+    if all(values.get(x_key) and values.get(y_key) for x_key, y_key in ffprobe_primary_keys):
+        primaries = MasteringPrimaries(*[(side_data_number(values, x_key), side_data_number(values, y_key))
+                                         for x_key, y_key in ffprobe_primary_keys], white_point)
+    elif values.get('display_primaries_x') and values.get('display_primaries_y'):
+        try:
+            points = list(zip(map(parse_number, values['display_primaries_x'].split()),
+                              map(parse_number, values['display_primaries_y'].split())))
+        except ValueError:
+            points = []
+        if len(points) == 3:
+            primaries = MasteringPrimaries(*primaries_by_position(points), white_point)
+
+    min_luminance = side_data_number(values, 'min_luminance')
+    max_luminance = side_data_number(values, 'max_luminance')
+    luminance = None
+    if min_luminance is not None or max_luminance is not None:
+        luminance = MasteringLuminance(min_luminance, max_luminance)
+
+    max_cll = side_data_number(values, 'MaxCLL')
+    if max_cll is None:
+        max_cll = side_data_number(values, 'max_content')
+    max_fall = side_data_number(values, 'MaxFALL')
+    if max_fall is None:
+        max_fall = side_data_number(values, 'max_average')
+    return HdrMetadata(primaries, luminance, int(max_cll) if max_cll is not None else None,
+                       int(max_fall) if max_fall is not None else None, white_point)
@@ -1,6 +1,28 @@
+import os
+import sqlite3
 import subprocess
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from tqdm import tqdm
+
+from find_diff import scan_mkv_files
+from hdr_metadata import named_primaries, parse_ffmpeg_hdr_metadata
+
+default_db_path = 'D:/MakeMKV/media_info/media_info_new.db'
+hdr_table_name = 'hdr_metadata'
+# ffprobe comes with ffmpeg and prints the side data of the first video frame as key=value lines on stdout
+ffprobe_cmd = ['ffprobe']
+default_batch_workers = 8
+default_ffprobe_timeout = 120
+# Rows written per transaction during a batch extraction
+batch_write_size = 100
+hdr_columns = ['red_x', 'red_y', 'green_x', 'green_y', 'blue_x', 'blue_y', 'white_point_x', 'white_point_y',
+               'min_luminance', 'max_luminance', 'max_cll', 'max_fall']
 
 
 def extract_hdr_metadata(input_file, output_file):
@@ -17,42 +39,29 @@ def extract_hdr_metadata(input_file, output_file):
         print(f'Error occurred while extracting HDR metadata: {e.stderr.decode()}')
 
 
-# Function to parse HDR metadata from text file
+# Function to parse HDR metadata from text file, keys whose values are missing from the file are left out
 def parse_hdr_metadata(file_path):
-    hdr_data = {}
     with open(file_path, 'r') as file:
-        content = file.read()
-
-        # Extract display primaries
-        primaries_pattern = re.compile(r'display_primaries_x=([0-9. ]+)\ndisplay_primaries_y=([0-9. ]+)')
-        match = primaries_pattern.search(content)
-        if match:
-            hdr_data['display_primaries_x'] = list(map(float, match.group(1).split()))
-            hdr_data['display_primaries_y'] = list(map(float, match.group(2).split()))
-
-        # Extract white point
-        white_point_x_pattern = re.compile(r'white_point_x=([0-9.]+)')
-        white_point_y_pattern = re.compile(r'white_point_y=([0-9.]+)')
-        hdr_data['white_point_x'] = float(white_point_x_pattern.search(content).group(1))
-        hdr_data['white_point_y'] = float(white_point_y_pattern.search(content).group(1))
-
-        # Extract luminance
-        min_luminance_pattern = re.compile(r'min_luminance=([0-9.]+)')
-        max_luminance_pattern = re.compile(r'max_luminance=([0-9.]+)')
-        hdr_data['min_luminance'] = float(min_luminance_pattern.search(content).group(1))
-        hdr_data['max_luminance'] = float(max_luminance_pattern.search(content).group(1))
-
-        # Extract MaxFALL and MaxCLL if available
-        max_fall_pattern = re.compile(r'MaxFALL=([0-9.]+)')
-        max_cll_pattern = re.compile(r'MaxCLL=([0-9.]+)')
-        max_fall_match = max_fall_pattern.search(content)
-        max_cll_match = max_cll_pattern.search(content)
-
-        if max_fall_match:
-            hdr_data['MaxFALL'] = float(max_fall_match.group(1))
-        if max_cll_match:
-            hdr_data['MaxCLL'] = float(max_cll_match.group(1))
+        return hdr_metadata_dict(parse_ffmpeg_hdr_metadata(file.read()))
 
+
+def hdr_metadata_dict(metadata):
+    hdr_data = {}
+    primaries = metadata.primaries
+    if primaries:
+        hdr_data['display_primaries_x'] = [primaries.red[0], primaries.green[0], primaries.blue[0]]
+        hdr_data['display_primaries_y'] = [primaries.red[1], primaries.green[1], primaries.blue[1]]
+    if metadata.white_point:
+        hdr_data['white_point_x'], hdr_data['white_point_y'] = metadata.white_point
+    if metadata.luminance:
+        if metadata.luminance.min is not None:
+            hdr_data['min_luminance'] = metadata.luminance.min
+        if metadata.luminance.max is not None:
+            hdr_data['max_luminance'] = metadata.luminance.max
+    if metadata.max_fall is not None:
+        hdr_data['MaxFALL'] = float(metadata.max_fall)
+    if metadata.max_cll is not None:
+        hdr_data['MaxCLL'] = float(metadata.max_cll)
     return hdr_data
 
 
@@ -61,17 +70,18 @@ def plot_hdr_metadata(hdr_data):
     fig, ax = plt.subplots()
 
     # Plot display primaries
-    ax.plot(hdr_data['display_primaries_x'], hdr_data['display_primaries_y'], 'ro', label='Display Primaries')
+    if 'display_primaries_x' in hdr_data:
+        ax.plot(hdr_data['display_primaries_x'], hdr_data['display_primaries_y'], 'ro', label='Display Primaries')
 
-    # Plot white point
-    ax.plot(hdr_data['white_point_x'], hdr_data['white_point_y'], 'bo', label='White Point')
-
-    # Annotate points
-    for i, (x, y) in enumerate(zip(hdr_data['display_primaries_x'], hdr_data['display_primaries_y'])):
-        ax.annotate(f'P{i + 1}', (x, y), textcoords="offset points", xytext=(0, 10), ha='center')
+        # Annotate points
+        for label, x, y in zip(('R', 'G', 'B'), hdr_data['display_primaries_x'], hdr_data['display_primaries_y']):
+            ax.annotate(label, (x, y), textcoords="offset points", xytext=(0, 10), ha='center')
 
-    ax.annotate('White Point', (hdr_data['white_point_x'], hdr_data['white_point_y']),
-                textcoords="offset points", xytext=(0, 10), ha='center', color='blue')
+    # Plot white point
+    if 'white_point_x' in hdr_data:
+        ax.plot(hdr_data['white_point_x'], hdr_data['white_point_y'], 'bo', label='White Point')
+        ax.annotate('White Point', (hdr_data['white_point_x'], hdr_data['white_point_y']),
+                    textcoords="offset points", xytext=(0, 10), ha='center', color='blue')
 
     # Set plot labels and title
     ax.set_xlabel('X Coordinate')
@@ -82,7 +92,153 @@ def plot_hdr_metadata(hdr_data):
     plt.show()
 
 
-# Example usage
-hdr_metadata_file = 'metadata.txt'
-hdr_data = parse_hdr_metadata(hdr_metadata_file)
-plot_hdr_metadata(hdr_data)
\ No newline at end of file
+def read_hdr_side_data(file_path, cmd=None, timeout=default_ffprobe_timeout):
+    # Mastering display and content light level side data of the first video frame, read from ffprobe's stdout
+    result = subprocess.run([*(cmd or ffprobe_cmd), '-v', 'error', '-select_streams', 'v:0', '-read_intervals',
+                             '%+#1', '-show_frames', '-show_entries', 'frame=side_data_list',
+                             '-of', 'default=noprint_wrappers=1', file_path],
+                            capture_output=True, encoding='utf-8', errors='replace', timeout=timeout, check=True)
+    return result.stdout
+
+
+def hdr_metadata_row(metadata):
+    # hdr_columns values of an HdrMetadata, None for whatever the file doesn't carry
+    primaries = metadata.primaries
+    points = [primaries.red, primaries.green, primaries.blue] if primaries else [(None, None)] * 3
+    points.append(metadata.white_point or (None, None))
+    luminance = metadata.luminance
+    return [value for point in points for value in point] + [
+        luminance.min if luminance else None, luminance.max if luminance else None, metadata.max_cll,
+        metadata.max_fall]
+
+
+def create_hdr_table(conn):
+    with conn:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {hdr_table_name} (
+                file_path TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                {', '.join(f'{column} REAL' for column in hdr_columns)},
+                extracted_at TEXT NOT NULL
+            )''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{hdr_table_name}_file_name ON {hdr_table_name} (file_name)')
+
+
+def extract_hdr_metadata_batch(directories, db_path=default_db_path, workers=default_batch_workers, cmd=None,
+                               timeout=default_ffprobe_timeout):
+    # Extract the HDR side data of every .mkv under directories, workers ffprobe processes at a time, into the
+    # hdr_metadata table. Files whose size and mtime didn't change since their row was written are skipped.
+    # Returns the number of files extracted and the failed file paths.
+    conn = sqlite3.connect(db_path)
+    create_hdr_table(conn)
+    known_files = {row[0]: (row[1], row[2]) for row in conn.execute(
+        f'SELECT file_path, file_size, mtime_ns FROM {hdr_table_name}')}
+    files = {}
+    for directory in directories:
+        for relative_path, state in scan_mkv_files(directory).items():
+            files[os.path.join(directory, relative_path)] = state
+    changed_files = sorted(file_path for file_path, state in files.items() if known_files.get(file_path) != state)
+    print(f'{len(changed_files)} of {len(files)} file(s) new or changed')
+
+    placeholders = ', '.join('?' * (len(hdr_columns) + 5))
+    insert_sql = (f'INSERT OR REPLACE INTO {hdr_table_name} (file_path, file_name, file_size, mtime_ns, '
+                  f'{", ".join(hdr_columns)}, extracted_at) VALUES ({placeholders})')
+    rows = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(read_hdr_side_data, file_path, cmd, timeout): file_path
+                   for file_path in changed_files}
+        for future in tqdm(as_completed(futures), total=len(futures), unit='file', desc='HDR side data'):
+            file_path = futures[future]
+            try:
+                metadata = parse_ffmpeg_hdr_metadata(future.result())
+            except Exception as e:
+                # ffprobe failing, timing out or printing something unparsable fails this file, not the batch
+                errors.append(file_path)
+                print(f'Error reading HDR side data of {file_path}: {e}')
+                continue
+            rows.append([file_path, os.path.basename(file_path), *files[file_path], *hdr_metadata_row(metadata),
+                         time.strftime('%Y-%m-%d %H:%M:%S')])
+            if len(rows) >= batch_write_size:
+                with conn:
+                    conn.executemany(insert_sql, rows)
+                rows = []
+    with conn:
+        conn.executemany(insert_sql, rows)
+    conn.close()
+    return len(changed_files) - len(errors), sorted(errors)
+
+
+def load_hdr_library(db_path=default_db_path):
+    # {column: float array} of every extracted file, NaN where the file had no such metadata
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'SELECT {", ".join(hdr_columns)} FROM {hdr_table_name}').fetchall()
+    conn.close()
+    values = np.array(rows, dtype=np.float64).reshape(-1, len(hdr_columns))
+    return dict(zip(hdr_columns, values.T))
+
+
+def plot_hdr_library(library, output_file, title='HDR mastering metadata of the library'):
+    # CIE 1931 xy scatter of the mastering primaries and white points, and mastering peak vs MaxCLL/MaxFALL, of every
+    # title in one PNG. Drawn on a Figure with the Agg canvas, one scatter call per series whatever the title count.
+    figure = Figure(figsize=(16, 7.5), dpi=100)
+    FigureCanvasAgg(figure)
+    chromaticity_axes, luminance_axes = figure.subplots(1, 2)
+
+    for name, style in (('bt.709', ':'), ('display p3', '--'), ('bt.2020', '-')):
+        gamut = np.array(named_primaries[name][:3] + named_primaries[name][:1])
+        chromaticity_axes.plot(gamut[:, 0], gamut[:, 1], style, color='grey', linewidth=1, label=name.upper())
+    for color, marker in (('red', 'o'), ('green', 'o'), ('blue', 'o'), ('white_point', 'x')):
+        chromaticity_axes.scatter(library[f'{color}_x'], library[f'{color}_y'], s=12, alpha=0.3, marker=marker,
+                                  color='black' if color == 'white_point' else color, rasterized=True,
+                                  label=color.replace('_', ' ').capitalize())
+    chromaticity_axes.set_xlim(0, 0.8)
+    chromaticity_axes.set_ylim(0, 0.9)
+    chromaticity_axes.set_aspect('equal')
+    chromaticity_axes.set_xlabel('x')
+    chromaticity_axes.set_ylabel('y')
+    chromaticity_axes.set_title('Mastering display primaries (CIE 1931 xy)')
+    chromaticity_axes.legend(loc='upper right', fontsize='small')
+
+    # Mastering peaks sit on a few values (1000, 4000 nits), a little jitter keeps the titles apart
+    jitter = 1 + np.random.default_rng(0).uniform(-0.04, 0.04, len(library['max_luminance']))
+    luminance_axes.scatter(library['max_luminance'] * jitter, library['max_cll'], s=10, alpha=0.4, label='MaxCLL',
+                           rasterized=True)
+    luminance_axes.scatter(library['max_luminance'] * jitter, library['max_fall'], s=10, alpha=0.4, label='MaxFALL',
+                           rasterized=True)
+    luminance_axes.set_xscale('log')
+    luminance_axes.set_yscale('log')
+    luminance_axes.set_xlabel('Mastering display max luminance (cd/m2)')
+    luminance_axes.set_ylabel('Content light level (cd/m2)')
+    luminance_axes.set_title(f'Luminance of {len(library["max_luminance"])} title(s)')
+    luminance_axes.legend(loc='upper left', fontsize='small')
+
+    figure.suptitle(title)
+    figure.savefig(output_file)
+    print(f'Library chart written to {output_file}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Plot the HDR mastering metadata of one file or of a whole library.')
+    parser.add_argument('--metadata_file', type=str, default='metadata.txt',
+                        help='ffmpeg metadata text file shown interactively when no batch option is given.')
+    parser.add_argument('--batch', type=str, nargs='+', metavar='DIR',
+                        help='Extract the HDR side data of every .mkv under these directories into the database.')
+    parser.add_argument('--db_path', type=str, default=default_db_path)
+    parser.add_argument('--workers', type=int, default=default_batch_workers, help='ffprobe processes at once.')
+    parser.add_argument('--output_png', type=str, default=None,
+                        help='Render the library chart of every file in the database to this PNG.')
+    args = parser.parse_args()
+
+    if args.batch:
+        extracted, failed_files = extract_hdr_metadata_batch(args.batch, args.db_path, args.workers)
+        print(f'{extracted} file(s) extracted, {len(failed_files)} failed')
+    if args.output_png:
+        plot_hdr_library(load_hdr_library(args.db_path), args.output_png)
+    if not (args.batch or args.output_png):
+        hdr_data = parse_hdr_metadata(args.metadata_file)
+        plot_hdr_metadata(hdr_data)
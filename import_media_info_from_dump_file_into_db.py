@@ -1,78 +1,418 @@
+import csv
+import hashlib
 import os
 import sqlite3
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import pandas as pd
 
 from globals import media_info_table_columns, media_info_table_columns_def
+from media_info_search import ensure_fts_index
 
+# Multipliers to base units for the formatted values written by mkv_info (format_file_size, convert_bitrate_to_*)
+file_size_units = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+bitrate_units = {'bps': 1, 'Kbps': 1_000, 'Mbps': 1_000_000, 'Gbps': 1_000_000_000}
 
-def import_media_info_into_db(directory_path, file_name_pattern, delimiter, db_path, table_name):
-    # Initialize an empty list to store DataFrames
-    dataframes = []
-
-    # Loop through all files in the directory
-    for filename in os.listdir(directory_path):
-        if filename.endswith(file_name_pattern):
-            file_path = os.path.join(directory_path, filename)
-            try:
-                # Read the delimited file into a DataFrame
-                df = pd.read_csv(filepath_or_buffer=file_path, delimiter=delimiter, header=None, engine='python', on_bad_lines=lambda error: print("Bad line detected in", file_path, error))
-                # Assign the column names to the DataFrame
-                df.columns = media_info_table_columns
-                dataframes.append(df)
-            except pd.errors.ParserError as e:
-                print(f"Error parsing {file_path}: {e}")
-            except Exception as e:
-                print(f"An error occurred with {file_path}: {e}")
-
-        # Optionally, concatenate all DataFrames into a single DataFrame
-    if dataframes:
-        df = pd.concat(dataframes, ignore_index=True)
-    else:
-        print("No data files found matching the pattern.")
-        return
+# Bookkeeping table of the imported dump files, one per media_info table
+import_files_table_suffix = '_import_files'
 
-        # Ensure the DataFrame has all expected columns and in the correct order
-    for col in media_info_table_columns:
-        if col not in df.columns:
-            df[col] = None  # Add missing columns with None values
 
-        # Reorder columns to match the expected schema
-    df = df[media_info_table_columns]
+def parse_duration_column(column):
+    # "02:24:27" -> 8667000 milliseconds
+    parts = column.astype('string').str.extract(r'^\s*(\d+):(\d{1,2}):(\d{1,2})\s*$').astype('float64')
+    return ((parts[0] * 3600 + parts[1] * 60 + parts[2]) * 1000).round().astype('Int64')
 
-    # Check the DataFrame content before writing to SQLite
-    print("DataFrame content before inserting into database:")
-    print(df.head())
 
-    # Create a connection to the SQLite database (or create it if it doesn't exist)
-    conn = sqlite3.connect(db_path)
+def parse_unit_column(column, units):
+    # "78.09 GB" -> bytes, "72008.09 Kbps" -> bits per second, bare numbers are taken as base units already
+    parts = column.astype('string').str.extract(r'^\s*([0-9]*\.?[0-9]+)\s*([A-Za-z/]*)\s*$')
+    multiplier = parts[1].map(units).astype('float64')
+    multiplier = multiplier.where(parts[1].fillna('') != '', 1.0)
+    return (parts[0].astype('float64') * multiplier).round().astype('Int64')
+
+
+def parse_leading_integer_column(column):
+    # "962 cd/m2", "962" or "None" -> 962, 962, <NA>
+    return column.astype('string').str.extract(r'^\s*(\d+)')[0].astype('Int64')
+
+
+def normalize_media_info_columns(df):
+    # Parse the formatted strings of the dump files into typed columns, one vectorized pass per column
+    df['duration'] = parse_duration_column(df['duration'])
+    df['file_size'] = parse_unit_column(df['file_size'], file_size_units)
+    df['overall_bitrate'] = parse_unit_column(df['overall_bitrate'], bitrate_units)
+    df['video_bitrate'] = parse_unit_column(df['video_bitrate'], bitrate_units)
+    df['video_framerate'] = pd.to_numeric(df['video_framerate'], errors='coerce')
+    df['maxfall'] = parse_leading_integer_column(df['maxfall'])
+    df['maxcll'] = parse_leading_integer_column(df['maxcll'])
+    return df
 
-    # Create a cursor object
-    cursor = conn.cursor()
 
+def create_media_info_table(cursor, table_name):
     # Create the SQL table schema string
     columns_schema = ', '.join([f"{col_name} {col_type}" for col_name, col_type in media_info_table_columns_def])
     create_table_sql = f'''
       CREATE TABLE IF NOT EXISTS {table_name} (
           id INTEGER PRIMARY KEY AUTOINCREMENT,
+          volume VARCHAR(100),
           {columns_schema}
       )
       '''
-
-    # Create the table
     cursor.execute(create_table_sql)
+    # Tables created before the delta import get the volume column added, it stays NULL until the next full import
+    if 'volume' not in {row[1] for row in cursor.execute(f'PRAGMA table_info({table_name})')}:
+        cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN volume VARCHAR(100)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS ix_{table_name}_volume_title ON {table_name} (volume, title)')
+
+
+def create_import_files_table(cursor, table_name):
+    cursor.execute(f'''
+      CREATE TABLE IF NOT EXISTS {table_name}{import_files_table_suffix} (
+          file_name TEXT PRIMARY KEY,
+          volume VARCHAR(100) NOT NULL,
+          sha256 TEXT NOT NULL,
+          mtime_ns INTEGER NOT NULL,
+          size INTEGER NOT NULL,
+          row_count INTEGER NOT NULL,
+          imported_at TEXT NOT NULL
+      )
+      ''')
+
+
+def dump_file_volume(file_path, file_name_pattern):
+    # "D:/MakeMKV/media_info/WD8A_10TB_final.txt" -> "WD8A_10TB"
+    file_name = os.path.basename(file_path)
+    return file_name[:-len(file_name_pattern)] if file_name.endswith(file_name_pattern) else file_name
+
+
+def dump_file_state(file_path):
+    # (sha256, mtime_ns, size) of a dump file as stored in the import files table
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(partial(file.read, 1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest(), stat.st_mtime_ns, stat.st_size
+
+
+def record_import_file(conn, table_name, file_path, volume, state, row_count):
+    conn.execute(f"INSERT OR REPLACE INTO {table_name}{import_files_table_suffix} "
+                 f"(file_name, volume, sha256, mtime_ns, size, row_count, imported_at) "
+                 f"VALUES (?, ?, ?, ?, ?, ?, datetime('now'))",
+                 (os.path.basename(file_path), volume, *state, row_count))
+
+
+def changed_dump_files(conn, table_name, file_paths):
+    # Dump files whose content differs from the last import, with their new state. Files with an unchanged mtime and
+    # size aren't read at all, touched files with identical content only get their mtime refreshed.
+    stored_states = {file_name: (sha256, mtime_ns, size) for file_name, sha256, mtime_ns, size in conn.execute(
+        f'SELECT file_name, sha256, mtime_ns, size FROM {table_name}{import_files_table_suffix}')}
+    changed_files = {}
+    for file_path in file_paths:
+        stored_state = stored_states.get(os.path.basename(file_path))
+        stat = os.stat(file_path)
+        if stored_state and stored_state[1:] == (stat.st_mtime_ns, stat.st_size):
+            continue
+        state = dump_file_state(file_path)
+        if stored_state and stored_state[0] == state[0]:
+            with conn:
+                conn.execute(f'UPDATE {table_name}{import_files_table_suffix} SET mtime_ns = ? WHERE file_name = ?',
+                             (state[1], os.path.basename(file_path)))
+            continue
+        changed_files[file_path] = state
+    return changed_files
+
+
+def dump_row_keys(titles):
+    # Identity of the rows of one volume in file order: the title and the number of earlier rows with that title.
+    # Titles repeat (every disc has a title_t00.mkv), those rows stay separate instead of collapsing into one. The
+    # full import stores rows in file order and id order, so its rows get the same keys as the dump file's.
+    occurrences = Counter()
+    keys = []
+    for title in titles:
+        keys.append((title, occurrences[title]))
+        occurrences[title] += 1
+    return keys
+
+
+def apply_dump_file_delta(conn, table_name, volume, rows):
+    # Diff the rows of one dump file against the stored rows of its volume by dump_row_keys and write only the
+    # differences. Returns the (inserted, updated, deleted) row counts.
+    new_rows = dict(zip(dump_row_keys(row[0] for row in rows), rows))
+    stored = conn.execute(f"SELECT id, {', '.join(media_info_table_columns)} FROM {table_name} "
+                          f"WHERE volume = ? ORDER BY id", (volume,)).fetchall()
+    stored_rows = {key: (row[0], row[1:]) for key, row in zip(dump_row_keys(row[1] for row in stored), stored)}
+    deleted_ids = [(row_id,) for key, (row_id, _) in stored_rows.items() if key not in new_rows]
+    inserted_rows = [(volume, *row) for key, row in new_rows.items() if key not in stored_rows]
+    updated_rows = [(*row, stored_rows[key][0]) for key, row in new_rows.items()
+                    if key in stored_rows and stored_rows[key][1] != row]
+
+    conn.executemany(f'DELETE FROM {table_name} WHERE id = ?', deleted_ids)
+    conn.executemany(f"UPDATE {table_name} SET {', '.join(f'{column} = ?' for column in media_info_table_columns)} "
+                     f"WHERE id = ?", updated_rows)
+    conn.executemany(f"INSERT INTO {table_name} (volume, {', '.join(media_info_table_columns)}) "
+                     f"VALUES ({', '.join('?' * (len(media_info_table_columns) + 1))})", inserted_rows)
+    return len(inserted_rows), len(updated_rows), len(deleted_ids)
+
+
+def dataframe_rows(df):
+    # Plain tuples with None for missing values, ready for executemany
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def iter_dump_file_chunks(file_path, delimiter, chunk_size):
+    # Read one dump file chunk by chunk with the C parser, yielding the normalized rows of every chunk
+    for df in pd.read_csv(filepath_or_buffer=file_path, delimiter=delimiter, header=None,
+                          names=media_info_table_columns, engine='c', chunksize=chunk_size, dtype=str,
+                          quoting=csv.QUOTE_NONE, on_bad_lines='warn'):
+        yield dataframe_rows(normalize_media_info_columns(df))
+
+
+def parse_dump_file(file_path, delimiter, chunk_size):
+    # Runs in the worker processes, the chunks of a file go back to the parent as one result
+    return list(iter_dump_file_chunks(file_path, delimiter, chunk_size))
+
+
+def future_chunks(future):
+    yield from future.result()
+
 
-    # Write the DataFrame to an SQLite table
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
+def iter_parsed_dump_files(file_paths, delimiter, chunk_size, workers):
+    # Yields (file_path, chunks) in file order. chunks is an iterable of row lists that raises when the file can't be
+    # parsed (see read_dump_file_chunks). Serially a file is read lazily one chunk at a time, with workers > 1 files
+    # are parsed in a process pool with at most 2 * workers files in flight, so parsed files don't pile up in memory
+    # while the single writer is behind.
+    if workers <= 1:
+        for file_path in file_paths:
+            yield file_path, iter_dump_file_chunks(file_path, delimiter, chunk_size)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append((file_path, executor.submit(parse_dump_file, file_path, delimiter, chunk_size)))
+            if len(pending) >= workers * 2:
+                file_path, future = pending.popleft()
+                yield file_path, future_chunks(future)
+        while pending:
+            file_path, future = pending.popleft()
+            yield file_path, future_chunks(future)
+
+
+def read_dump_file_chunks(file_path, chunks):
+    # Iterate the chunks of iter_parsed_dump_files, reporting a file that can't be parsed and ending its chunks, the
+    # caller drops what it already read of that file. Yields None last when the file failed.
+    chunks = iter(chunks)
+    while True:
+        try:
+            rows = next(chunks)
+        except StopIteration:
+            return
+        except pd.errors.ParserError as e:
+            print(f"Error parsing {file_path}: {e}")
+            yield None
+            return
+        except Exception as e:
+            print(f"An error occurred with {file_path}: {e}")
+            yield None
+            return
+        yield rows
+
+
+def media_info_table_needs_migration(conn, table_name):
+    existing_columns = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info({table_name})')}
+    if not existing_columns:
+        return False
+    return 'id' not in existing_columns or any(existing_columns.get(column) != column_type
+                                               for column, column_type in media_info_table_columns_def)
+
+
+def import_media_info_into_db(directory_path, file_name_pattern, delimiter, db_path, table_name, chunk_size=10_000,
+                              workers=None, delta=False, prune=False):
+    # Full import replaces the table, delta import only re-reads dump files that changed since the last import and
+    # applies the row differences of their volume. prune removes the volumes of dump files that no longer exist.
+    file_paths = sorted(os.path.join(directory_path, filename) for filename in os.listdir(directory_path)
+                        if filename.endswith(file_name_pattern))
+    if not file_paths:
+        print("No data files found matching the pattern.")
+        return
+
+    # Create a connection to the SQLite database (or create it if it doesn't exist)
+    conn = sqlite3.connect(db_path)
+    if media_info_table_needs_migration(conn, table_name):
+        conn.close()
+        migrate_media_info_table(db_path, table_name)
+        conn = sqlite3.connect(db_path)
+
+    # The declared schema (id autoincrement, typed columns) is kept, rows are appended to it
+    create_media_info_table(conn.cursor(), table_name)
+    create_import_files_table(conn.cursor(), table_name)
+    if delta and conn.execute(f'SELECT 1 FROM {table_name} WHERE volume IS NULL LIMIT 1').fetchone():
+        print(f'{table_name} has rows without a volume (imported before delta mode), running a full import')
+        delta = False
+
+    start = time.perf_counter()
+    if delta:
+        removed_file_names = import_changed_dump_files(conn, table_name, file_paths, file_name_pattern, delimiter,
+                                                       chunk_size, workers, prune)
+    else:
+        removed_file_names = []
+        import_all_dump_files(conn, table_name, file_paths, file_name_pattern, delimiter, chunk_size, workers)
+    print(f'Import finished in {time.perf_counter() - start:.2f}s')
+
+    # No-op unless the full-text index is missing or stale
+    ensure_fts_index(conn, table_name)
 
     # Close the connection
     conn.close()
+    return removed_file_names
+
+
+def import_all_dump_files(conn, table_name, file_paths, file_name_pattern, delimiter, chunk_size, workers):
+    insert_sql = (f"INSERT INTO {table_name} (volume, {', '.join(media_info_table_columns)}) "
+                  f"VALUES ({', '.join('?' * (len(media_info_table_columns) + 1))})")
+    workers = min(workers or os.cpu_count() or 1, len(file_paths))
+
+    start = time.perf_counter()
+    total_rows = 0
+    # One transaction for the whole import: readers see the previous import until the new one is complete, and an
+    # interrupted import leaves the previous one in place. Every file is inserted under a savepoint so a file that
+    # fails to parse half way is skipped as a whole.
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(f'DELETE FROM {table_name}')
+        conn.execute(f'DELETE FROM {table_name}{import_files_table_suffix}')
+        for file_path, chunks in iter_parsed_dump_files(file_paths, delimiter, chunk_size, workers):
+            volume = dump_file_volume(file_path, file_name_pattern)
+            file_rows = 0
+            # Every row is kept in file order, the row identity the delta import diffs by (dump_row_keys)
+            conn.execute('SAVEPOINT dump_file')
+            for rows in read_dump_file_chunks(file_path, chunks):
+                if rows is None:
+                    conn.execute('ROLLBACK TO dump_file')
+                    file_rows = None
+                    break
+                conn.executemany(insert_sql, [(volume, *row) for row in rows])
+                file_rows += len(rows)
+            conn.execute('RELEASE dump_file')
+            if file_rows is None:
+                continue
+            record_import_file(conn, table_name, file_path, volume, dump_file_state(file_path), file_rows)
+            total_rows += file_rows
+            print(f'Imported {file_rows} row(s) from {file_path}')
+
+    elapsed = time.perf_counter() - start
+    print(f'Imported {total_rows} row(s) from {len(file_paths)} file(s) in {elapsed:.2f}s '
+          f'({total_rows / elapsed if elapsed else 0:.0f} rows/sec)')
+
+
+def import_changed_dump_files(conn, table_name, file_paths, file_name_pattern, delimiter, chunk_size, workers, prune):
+    changed_files = changed_dump_files(conn, table_name, file_paths)
+    print(f'{len(changed_files)} of {len(file_paths)} dump file(s) changed since the last import')
+
+    total_inserted = total_updated = total_deleted = 0
+    if changed_files:
+        workers = min(workers or os.cpu_count() or 1, len(changed_files))
+        for file_path, chunks in iter_parsed_dump_files(list(changed_files), delimiter, chunk_size, workers):
+            chunks = list(read_dump_file_chunks(file_path, chunks))
+            if None in chunks:
+                continue
+            volume = dump_file_volume(file_path, file_name_pattern)
+            rows = [row for chunk in chunks for row in chunk]
+            # The row changes of a file and its new state are committed together
+            with conn:
+                inserted, updated, deleted = apply_dump_file_delta(conn, table_name, volume, rows)
+                record_import_file(conn, table_name, file_path, volume, changed_files[file_path], len(rows))
+            total_inserted += inserted
+            total_updated += updated
+            total_deleted += deleted
+            print(f'{file_path}: {inserted} inserted, {updated} updated, {deleted} deleted')
+
+    # Dump files imported before but gone from the directory now
+    current_file_names = {os.path.basename(file_path) for file_path in file_paths}
+    removed_files = [(file_name, volume) for file_name, volume in conn.execute(
+        f'SELECT file_name, volume FROM {table_name}{import_files_table_suffix} ORDER BY file_name')
+                     if file_name not in current_file_names]
+    for file_name, volume in removed_files:
+        if prune:
+            with conn:
+                deleted = conn.execute(f'DELETE FROM {table_name} WHERE volume = ?', (volume,)).rowcount
+                conn.execute(f'DELETE FROM {table_name}{import_files_table_suffix} WHERE file_name = ?', (file_name,))
+            total_deleted += deleted
+            print(f'Pruned {deleted} row(s) of removed dump file {file_name}')
+        else:
+            print(f'Dump file {file_name} no longer exists, its rows of volume {volume} are kept')
+
+    print(f'Delta import: {total_inserted} inserted, {total_updated} updated, {total_deleted} deleted')
+    return [file_name for file_name, _ in removed_files]
+
+
+def migrate_media_info_table(db_path, table_name, chunk_size=50_000):
+    # Convert a database imported with the old VARCHAR schema (or written by DataFrame.to_sql without the id column)
+    # to the declared typed one, in place and in one transaction
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    existing_columns = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info({table_name})')}
+    if not existing_columns:
+        print(f'Table {table_name} not found in {db_path}')
+        conn.close()
+        return
+    if not media_info_table_needs_migration(conn, table_name):
+        print(f'Table {table_name} already has the typed schema')
+        conn.close()
+        return
+
+    old_columns = [('file_size_gb' if column == 'file_size' and 'file_size_gb' in existing_columns else column)
+                   for column in media_info_table_columns]
+    migrated_table_name = f'{table_name}_migrated'
+    insert_sql = (f"INSERT INTO {migrated_table_name} ({', '.join(media_info_table_columns)}) "
+                  f"VALUES ({', '.join('?' * len(media_info_table_columns))})")
+    row_count = 0
+    try:
+        conn.execute('BEGIN')
+        conn.execute(f'DROP TABLE IF EXISTS {migrated_table_name}')
+        create_media_info_table(conn.cursor(), migrated_table_name)
+        for df in pd.read_sql_query(f"SELECT {', '.join(old_columns)} FROM {table_name} ORDER BY rowid", conn,
+                                    chunksize=chunk_size):
+            df.columns = media_info_table_columns
+            conn.executemany(insert_sql, dataframe_rows(normalize_media_info_columns(df)))
+            row_count += len(df)
+        conn.execute(f'DROP TABLE {table_name}')
+        conn.execute(f'ALTER TABLE {migrated_table_name} RENAME TO {table_name}')
+        conn.execute(f'DROP INDEX ix_{migrated_table_name}_volume_title')
+        create_media_info_table(conn.cursor(), table_name)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    print(f'Migrated {row_count} row(s) of {table_name} to the typed schema')
+
+    # Dropping the old table took the full-text index triggers with it
+    ensure_fts_index(conn, table_name)
+    conn.close()
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Import _final.txt media info dumps into SQLite.')
+    parser.add_argument('command', nargs='?', default='import', choices=['import', 'migrate'],
+                        help='import the dump files, or migrate an existing database to the typed schema.')
+    parser.add_argument('--chunk_size', type=int, default=10_000, help='Rows read and inserted per chunk.')
+    parser.add_argument('--workers', type=int, default=None, help='Processes parsing dump files, defaults to CPUs.')
+    parser.add_argument('--delta', action='store_true', help='Only import dump files changed since the last import.')
+    parser.add_argument('--prune', action='store_true',
+                        help='With --delta, delete the rows of dump files that no longer exist.')
+    args = parser.parse_args()
+
     directory_path = 'D:/MakeMKV/media_info'
     file_name_pattern = '_final.txt'
     delimiter = '#'
     db_path = 'D:/MakeMKV/media_info/media_info.db'
     table_name = 'media_info'
-    import_media_info_into_db(directory_path, file_name_pattern, delimiter, db_path, table_name);
+    if args.command == 'migrate':
+        migrate_media_info_table(db_path, table_name)
+    else:
+        import_media_info_into_db(directory_path, file_name_pattern, delimiter, db_path, table_name, args.chunk_size,
+                                  args.workers, args.delta, args.prune)
@@ -1,13 +1,19 @@
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
 from pymediainfo import MediaInfo
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, and_
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, Index, func, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from globals import get_volume_label, format_duration, format_file_size, convert_bitrate_to_mbps, \
-    convert_bitrate_to_kbps, max_mdl, cd_m2_value
+    convert_bitrate_to_kbps, max_mdl, cd_m2_value, promoted_json_columns, relative_volume_path
+from media_info_cache import get_cache, set_pymediainfo_source_path
+from media_tracks import GeneralTrack, MediaTracks, VideoTrack
 
 volume_label = None
 Base = declarative_base()
@@ -15,9 +21,16 @@ Base = declarative_base()
 
 class MediaInfoModel(Base):
     __tablename__ = 'media_info'
+    __table_args__ = (
+        # MakeMKV names every disc's files title_t00.mkv, ..., so only the path identifies a file on a volume
+        Index('ux_media_info_volume_relative_path', 'volume', 'relative_path', unique=True),
+        Index('ix_media_info_volume_file_name', 'volume', 'file_name'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     volume = Column(String, nullable=False)
     file_name = Column(String, nullable=False)
+    # Path below the volume root with / separators, "Movies/Title/title_t00.mkv"
+    relative_path = Column(String)
     duration = Column(Integer)
     formatted_duration = Column(String)
     file_size = Column(Integer)
@@ -35,143 +48,351 @@ class MediaInfoModel(Base):
     max_mdl = Column(Integer)
     max_fall = Column(Integer)
     max_cll = Column(Integer)
+    # Audio and subtitle tracks, e.g. audio_formats "MLP FBA 8ch en, AC-3 6ch en"
+    audio_track_count = Column(Integer)
+    audio_formats = Column(String)
+    audio_languages = Column(String)
+    subtitle_track_count = Column(Integer)
+    subtitle_languages = Column(String)
     full_json = Column(Text, nullable=False)
+    # File system fingerprint used by the incremental rescan to skip unchanged files
+    stat_size = Column(Integer)
+    stat_mtime_ns = Column(Integer)
+    stat_inode = Column(Integer)
 
 
-def extract_media_info(file_path):
-    media_info = MediaInfo.parse(file_path)
-    return media_info.to_data()
+def upgrade_schema(engine):
+    # create_all only creates missing tables, so add columns introduced after a database was first created
+    existing_columns = {column['name'] for column in inspect(engine).get_columns(MediaInfoModel.__tablename__)}
+    with engine.begin() as connection:
+        for column in MediaInfoModel.__table__.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {MediaInfoModel.__tablename__} '
+                                        f'ADD COLUMN {column.name} {column_type}'))
 
+    backfill_relative_paths(engine)
 
-def prepare_media_info(file_name, media_info_json):
-    media_info = json.loads(media_info_json)
-    general_info = next((track for track in media_info['tracks'] if track['track_type'] == 'General'), {})
-    video_info = next((track for track in media_info['tracks'] if track['track_type'] == 'Video'), {})
+    table_name = MediaInfoModel.__tablename__
+    existing_indexes = {index['name'] for index in inspect(engine).get_indexes(table_name)}
+    with engine.begin() as connection:
+        if 'ux_media_info_volume_relative_path' not in existing_indexes:
+            # Rows are never removed here, a database holding the same file twice is reported and left as it is
+            duplicates = connection.execute(text(
+                f'SELECT volume, relative_path, COUNT(*), GROUP_CONCAT(id) FROM {table_name} '
+                f'GROUP BY volume, relative_path HAVING COUNT(*) > 1 ORDER BY volume, relative_path')).fetchall()
+            if duplicates:
+                for volume, relative_path, count, ids in duplicates:
+                    print(f'{volume} {relative_path} is stored {count} times, ids {ids}')
+                raise RuntimeError(f'{len(duplicates)} file(s) are stored more than once in {table_name}, remove '
+                                   f'the extra rows before importing')
+        # Superseded by the relative path index, it made files sharing a name in different folders collide
+        connection.execute(text('DROP INDEX IF EXISTS ux_media_info_volume_file_name'))
+        for index in MediaInfoModel.__table__.indexes:
+            if index.name not in existing_indexes:
+                index.create(connection)
 
-    return MediaInfoModel(
-        volume=media_info.get('volume'),
-        file_name=file_name,
-        duration=general_info.get('duration'),
-        formatted_duration=format_duration(general_info.get('duration')),
-        file_size=general_info.get('file_size'),
-        formatted_file_size=format_file_size(general_info.get('file_size')),
-        overall_bit_rate=general_info.get('overall_bit_rate'),
-        formatted_overall_bit_rate=convert_bitrate_to_mbps(general_info.get('overall_bit_rate')),
-        video_format=video_info.get('format'),
-        video_bit_rate=video_info.get('bit_rate'),
-        formatted_video_bit_rate=convert_bitrate_to_kbps(video_info.get('bit_rate')),
-        frame_rate=video_info.get('frame_rate'),
-        hdr_format=video_info.get('hdr_format'),
-        color_primaries=video_info.get('color_primaries'),
-        mastering_display_color_primaries=video_info.get('mastering_display_color_primaries'),
-        mastering_display_luminance=video_info.get('mastering_display_luminance'),
-        max_mdl=max_mdl(video_info.get('mastering_display_luminance')),
-        max_fall=cd_m2_value(video_info.get('maximum_frameaverage_light_level')),
-        max_cll=cd_m2_value(video_info.get('maximum_content_light_level')),
-        full_json=media_info_json
-    )
+
+def relative_path_prefix(media_files_path):
+    # relative_path prefix of every file below a scan root, '' when the root is the whole volume
+    root = relative_volume_path(media_files_path)
+    return '' if root in ('', '.') else root.rstrip('/') + '/'
+
+
+def backfill_relative_paths(engine, batch_size=1000):
+    # Rows written before relative_path existed get it from the General track's complete_name in full_json
+    table_name = MediaInfoModel.__tablename__
+    with engine.begin() as connection:
+        rows = connection.execute(text(
+            f"SELECT id, file_name, json_extract(full_json, '$.tracks[0].complete_name') FROM {table_name} "
+            f"WHERE relative_path IS NULL")).fetchall()
+        updates = [{'id': row_id, 'relative_path': relative_volume_path(complete_name or file_name)}
+                   for row_id, file_name, complete_name in rows]
+        for i in range(0, len(updates), batch_size):
+            connection.execute(text(f'UPDATE {table_name} SET relative_path = :relative_path WHERE id = :id'),
+                               updates[i:i + batch_size])
+
+
+def promote_json_columns(engine, batch_size=10_000):
+    # Materialize the JSON paths of globals.promoted_json_columns into indexed columns. Triggers keep them in sync
+    # with full_json on insert/upsert, rows that existed when a column was added (or its path changed) are
+    # backfilled in id batches and the progress is recorded, so an interrupted backfill continues where it stopped.
+    table_name = MediaInfoModel.__tablename__
+    with engine.begin() as connection:
+        connection.execute(text(f'CREATE TABLE IF NOT EXISTS {table_name}_promoted_columns '
+                                f'(column_name TEXT PRIMARY KEY, json_path TEXT NOT NULL, '
+                                f'backfilled_to_id INTEGER NOT NULL, backfill_end_id INTEGER NOT NULL)'))
+        existing_columns = {column['name'] for column in inspect(connection).get_columns(table_name)}
+        promoted = dict(connection.execute(
+            text(f'SELECT column_name, json_path FROM {table_name}_promoted_columns')).fetchall())
+        max_id = connection.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM {table_name}')).scalar()
+        for column_name, (json_path, column_type) in promoted_json_columns.items():
+            if column_name not in existing_columns:
+                connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+            if promoted.get(column_name) != json_path:
+                connection.execute(text(f'INSERT OR REPLACE INTO {table_name}_promoted_columns '
+                                        f'(column_name, json_path, backfilled_to_id, backfill_end_id) '
+                                        f'VALUES (:column_name, :path, 0, :max_id)'),
+                                   {'column_name': column_name, 'path': json_path, 'max_id': max_id})
+
+        # Rows written after this transaction get their values from the triggers, the backfill covers the rest
+        assignments = ', '.join(f"{column_name} = json_extract(new.full_json, '{json_path}')"
+                                for column_name, (json_path, _) in promoted_json_columns.items())
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {table_name}_promoted_ai'))
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {table_name}_promoted_au'))
+        if promoted_json_columns:
+            connection.execute(text(f'CREATE TRIGGER {table_name}_promoted_ai AFTER INSERT ON {table_name} BEGIN '
+                                    f'UPDATE {table_name} SET {assignments} WHERE id = new.id; END'))
+            connection.execute(text(f'CREATE TRIGGER {table_name}_promoted_au AFTER UPDATE OF full_json '
+                                    f'ON {table_name} BEGIN '
+                                    f'UPDATE {table_name} SET {assignments} WHERE id = new.id; END'))
+
+    for column_name, (json_path, _) in promoted_json_columns.items():
+        with engine.connect() as connection:
+            backfilled_to_id, backfill_end_id = connection.execute(
+                text(f'SELECT backfilled_to_id, backfill_end_id FROM {table_name}_promoted_columns '
+                     f'WHERE column_name = :column_name'), {'column_name': column_name}).one()
+        if backfilled_to_id < backfill_end_id:
+            print(f'Backfilling {column_name} from {json_path}')
+        while backfilled_to_id < backfill_end_id:
+            batch_end = min(backfilled_to_id + batch_size, backfill_end_id)
+            # One short transaction per batch, the importer and readers aren't blocked for the whole backfill
+            with engine.begin() as connection:
+                connection.execute(text(f"UPDATE {table_name} SET {column_name} = "
+                                        f"json_extract(full_json, '{json_path}') WHERE id > :start AND id <= :end"),
+                                   {'start': backfilled_to_id, 'end': batch_end})
+                connection.execute(text(f'UPDATE {table_name}_promoted_columns SET backfilled_to_id = :end '
+                                        f'WHERE column_name = :column_name'),
+                                   {'end': batch_end, 'column_name': column_name})
+            backfilled_to_id = batch_end
+        # Created after the backfill, building an index once is cheaper than maintaining it through every batch
+        with engine.begin() as connection:
+            connection.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table_name}_{column_name} '
+                                    f'ON {table_name} ({column_name})'))
+
+
+upsert_columns = [column.name for column in MediaInfoModel.__table__.columns if column.name != 'id']
+keep_existing_when_null_columns = {'max_fall', 'max_cll'}
+
+
+def media_info_row(media_info):
+    return {column: getattr(media_info, column) for column in upsert_columns}
+
+
+def parse_media_info_xml(file_path):
+    # Same library call MediaInfo.parse makes by default, but returning the raw output so it can be cached
+    return MediaInfo.parse(file_path, output='OLDXML')
+
+
+def extract_media_info(file_path, cache_path=None):
+    cache = get_cache(cache_path)
+    if cache:
+        media_info = MediaInfo(cache.get_or_parse(file_path, 'OLDXML', parse_media_info_xml))
+        return set_pymediainfo_source_path(media_info.to_data(), file_path)
+    return MediaInfo.parse(file_path).to_data()
 
 
-def bulk_save_or_update(session, media_info_list, file_names):
-    # Extract volume from the first media_info in the list
-    volume = media_info_list[0].volume
+def discover_media_files(media_files_path):
+    # Producer side of the scan, paths are yielded lazily so parsing starts before the walk finishes
+    yield from Path(media_files_path).rglob('*.mkv')
 
-    # Query existing file names based on volume and file_names
-    existing_files = session.query(MediaInfoModel.file_name).filter(
-        and_(
-            MediaInfoModel.volume == volume,
-            MediaInfoModel.file_name.in_(file_names)
-        )
-    ).all()
 
-    # Create a set of existing file names
-    existing_files = {file[0] for file in existing_files}
+def file_fingerprint(file_path):
+    stat = file_path.stat()
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
 
-    update_list = []
-    insert_list = []
 
-    for media_info in media_info_list:
-        if media_info.file_name in existing_files:
-            update_list.append(media_info)
+def load_fingerprints(session, volume, prefix=''):
+    # Stored rows of the files below prefix only, a rescan of G:/Movies must not see G:/TV as deleted
+    query = session.query(MediaInfoModel.relative_path, MediaInfoModel.stat_size, MediaInfoModel.stat_mtime_ns,
+                          MediaInfoModel.stat_inode).filter(MediaInfoModel.volume == volume)
+    if prefix:
+        # A range on the (volume, relative_path) index rather than LIKE, '_' in file names is a LIKE wildcard.
+        # prefix ends with '/', every path below it sorts before the same prefix ending with '0' ('/' + 1).
+        query = query.filter(MediaInfoModel.relative_path >= prefix,
+                             MediaInfoModel.relative_path < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    rows = query.all()
+    return {relative_path: (size, mtime_ns, inode) for relative_path, size, mtime_ns, inode in rows}
+
+
+def discover_changed_files(file_paths, stored_fingerprints, fingerprints, seen_paths, skip_unchanged=True):
+    # Stat every discovered file and only pass on the ones whose fingerprint differs from the stored row
+    for file_path in file_paths:
+        fingerprint = file_fingerprint(file_path)
+        relative_path = relative_volume_path(file_path)
+        seen_paths.add(relative_path)
+        if skip_unchanged and stored_fingerprints.get(relative_path) == fingerprint:
+            continue
+        fingerprints[file_path] = fingerprint
+        yield file_path
+
+
+def parse_media_file(file_path, cache_path=None):
+    # Runs inside the worker processes, so it has to stay a module level function
+    return file_path, extract_media_info(file_path, cache_path)
+
+
+def iter_media_info(file_paths, workers=1, cache_path=None):
+    # Yield (file_path, media_info) in discovery order so the parallel scan writes exactly what the serial one does
+    parse = partial(parse_media_file, cache_path=cache_path)
+    if workers <= 1:
+        for file_path in file_paths:
+            yield parse(file_path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded window of files in flight instead of submitting the whole volume up front
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(executor.submit(parse, file_path))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prepare_media_info(file_name, media_info, relative_path=None):
+    # media_info is the to_data() dict, serialized once for full_json. relative_path defaults to the file name for
+    # callers that only have a name.
+    tracks = MediaTracks.from_pymediainfo(media_info)
+    general_info = tracks.general or GeneralTrack()
+    video_info = tracks.video or VideoTrack()
+
+    return MediaInfoModel(
+        volume=media_info.get('volume'),
+        file_name=file_name,
+        relative_path=relative_path or file_name,
+        duration=general_info.duration,
+        formatted_duration=format_duration(general_info.duration),
+        file_size=general_info.file_size,
+        formatted_file_size=format_file_size(general_info.file_size),
+        overall_bit_rate=general_info.overall_bit_rate,
+        formatted_overall_bit_rate=convert_bitrate_to_mbps(general_info.overall_bit_rate),
+        video_format=video_info.format,
+        video_bit_rate=video_info.bit_rate,
+        formatted_video_bit_rate=convert_bitrate_to_kbps(video_info.bit_rate),
+        frame_rate=video_info.frame_rate,
+        hdr_format=video_info.hdr_format,
+        color_primaries=video_info.color_primaries,
+        mastering_display_color_primaries=video_info.mastering_display_color_primaries,
+        mastering_display_luminance=video_info.mastering_display_luminance,
+        max_mdl=max_mdl(video_info.mastering_display_luminance),
+        max_fall=cd_m2_value(video_info.max_fall),
+        max_cll=cd_m2_value(video_info.max_cll),
+        audio_track_count=len(tracks.audio),
+        audio_formats=tracks.audio_summary(),
+        audio_languages=tracks.audio_languages(),
+        subtitle_track_count=len(tracks.text),
+        subtitle_languages=tracks.subtitle_languages(),
+        full_json=json.dumps(media_info)
+    )
+
+
+def bulk_save_or_update(session, media_info_list):
+    # One INSERT ... ON CONFLICT(volume, relative_path) DO UPDATE executed for the whole batch
+    table = MediaInfoModel.__table__
+    statement = sqlite_insert(table)
+    update_columns = {}
+    for column in upsert_columns:
+        if column in ('volume', 'relative_path'):
+            continue
+        if column in keep_existing_when_null_columns:
+            # Don't overwrite a known MaxFALL/MaxCLL with NULL from a file that lost its HDR10 metadata
+            update_columns[column] = func.coalesce(statement.excluded[column], table.c[column])
         else:
-            insert_list.append(media_info)
-
-    if update_list:
-        for media_info in update_list:
-            existing = session.query(MediaInfoModel).filter(
-                MediaInfoModel.volume == media_info.volume,
-                MediaInfoModel.file_name == media_info.file_name
-            ).first()
-            if existing:
-                # Update existing object with new values
-                existing.volume = media_info.volume
-                existing.duration = media_info.duration
-                existing.formatted_duration = media_info.formatted_duration
-                existing.file_size = media_info.file_size
-                existing.formatted_file_size = media_info.formatted_file_size
-                existing.overall_bit_rate = media_info.overall_bit_rate
-                existing.formatted_overall_bit_rate = media_info.formatted_overall_bit_rate
-                existing.video_format = media_info.video_format
-                existing.bit_rate = media_info.video_bit_rate
-                existing.formatted_video_bit_rate = media_info.formatted_video_bit_rate
-                existing.frame_rate = media_info.frame_rate
-                existing.hdr_format = media_info.hdr_format
-                existing.color_primaries = media_info.color_primaries
-                existing.mastering_display_color_primaries = media_info.mastering_display_color_primaries
-                existing.mastering_display_luminance = media_info.mastering_display_luminance
-                existing.max_mdl = media_info.max_mdl
-                existing.max_fall = media_info.max_fall if media_info.max_fall is not None else existing.max_fall
-                existing.max_cll = media_info.max_cll if media_info.max_cll is not None else existing.max_cll
-                existing.full_json = media_info.full_json
-
-    if insert_list:
-        session.bulk_save_objects(insert_list)
+            update_columns[column] = statement.excluded[column]
+    statement = statement.on_conflict_do_update(index_elements=[table.c.volume, table.c.relative_path],
+                                                set_=update_columns)
 
+    session.execute(statement, [media_info_row(media_info) for media_info in media_info_list])
     session.commit()
 
 
-def main(media_files_path, db_path, batch_size=100):
+def main(media_files_path, db_path, batch_size=100, workers=1, incremental=False, prune=False, cache_path=None):
     volume = get_volume_label(media_files_path)
     engine = create_engine(db_path)
     Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    promote_json_columns(engine)
     Session = sessionmaker(bind=engine)
     session = Session()
 
     media_info_list = []
-    file_names = set()
+
+    stored_fingerprints = load_fingerprints(session, volume, relative_path_prefix(media_files_path))
+    fingerprints = {}
+    seen_paths = set()
+    file_paths = discover_changed_files(discover_media_files(media_files_path), stored_fingerprints, fingerprints,
+                                        seen_paths, skip_unchanged=incremental)
 
     file_count = 0
-    for file_path in Path(media_files_path).rglob('*.mkv'):
+    # Single writer: parsing may run in a process pool but only this loop touches the session
+    for file_path, media_info in iter_media_info(file_paths, workers, cache_path):
         file_count += 1
         print(f'{file_count} Processing {file_path}')
-        media_info = extract_media_info(file_path)
         media_info['volume'] = volume
-        media_info_obj = prepare_media_info(file_path.name, json.dumps(media_info))
+        media_info_obj = prepare_media_info(file_path.name, media_info, relative_volume_path(file_path))
+        media_info_obj.stat_size, media_info_obj.stat_mtime_ns, media_info_obj.stat_inode = \
+            fingerprints.pop(file_path)
         media_info_list.append(media_info_obj)
-        file_names.add(file_path.name)
 
         if len(media_info_list) >= batch_size:
-            bulk_save_or_update(session, media_info_list, file_names)
+            bulk_save_or_update(session, media_info_list)
             media_info_list.clear()
-            file_names.clear()
 
     if media_info_list:
-        bulk_save_or_update(session, media_info_list, file_names)
+        bulk_save_or_update(session, media_info_list)
+
+    if cache_path:
+        print('Media info cache', get_cache(cache_path).stats())
+
+    if incremental:
+        print(f'Skipped {len(seen_paths) - file_count} unchanged file(s), processed {file_count} file(s)')
+
+    deleted_paths = sorted(set(stored_fingerprints) - seen_paths)
+    if deleted_paths:
+        print(f'{len(deleted_paths)} file(s) stored for {volume} no longer exist:')
+        for relative_path in deleted_paths:
+            print(f'  {relative_path}')
+        if prune:
+            for i in range(0, len(deleted_paths), batch_size):
+                session.query(MediaInfoModel).filter(
+                    MediaInfoModel.volume == volume,
+                    MediaInfoModel.relative_path.in_(deleted_paths[i:i + batch_size])
+                ).delete(synchronize_session=False)
+            session.commit()
+            print(f'Removed {len(deleted_paths)} deleted file(s) from the database')
 
     session.close()
+    return deleted_paths
 
 
 if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser(description='Extract media info from MKV files and store in SQLite database.')
-    parser.add_argument('media_files_volume', type=str,
-                        help='Volume that has path to the directory containing MKV files.')
-    parser.add_argument('media_files_path', type=str, help='Path to the directory containing MKV files.')
-    parser.add_argument('database_path', type=str, help='Path to database which will contain the media info.')
+    parser.add_argument('media_files_path', type=str, nargs='?', default='G:/',
+                        help='Path to the directory containing MKV files.')
+    parser.add_argument('database_path', type=str, nargs='?',
+                        default='sqlite:///D:/MakeMKV/media_info/media_info_new.db',
+                        help='Path to database which will contain the media info.')
     parser.add_argument('--batch_size', type=int, default=100, help='Number of records to insert in each batch.')
-    #args = parser.parse_args()
-    #main(args.media_files_volume, args.media_files_path, args.database_path, args.batch_size)
-    main("G:/", "sqlite:///D:/MakeMKV/media_info/media_info_new.db", 100)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes parsing media files, 1 keeps the serial scan.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only parse files whose size, mtime or inode changed since the last scan.')
+    parser.add_argument('--prune', action='store_true',
+                        help='Remove rows for files that no longer exist on the volume.')
+    parser.add_argument('--cache_path', type=str, default=None,
+                        help='Path to the mediainfo output cache shared with mkv_info.')
+    args = parser.parse_args()
+    main(args.media_files_path, args.database_path, args.batch_size, args.workers, args.incremental, args.prune,
+         args.cache_path)
 
-#select *, json_extract(full_json, '$.tracks[1].color_primaries') color_primaries from VW_4K_MEDIA_INFO where mastering_display_color_primaries NOT like '%2020%' AND mastering_display_color_primaries NOT like '%P3%'
\ No newline at end of file
+# Color primaries audit, answered from the promoted json_video_color_primaries column and its index instead of
+# json_extract over every full_json:
+#   select json_video_color_primaries, mastering_display_color_primaries, count(*) from media_info
+#   group by 1, 2
+#   select volume, file_name, mastering_display_color_primaries from media_info
+#   where json_video_color_primaries = 'BT.2020'
+#   and mastering_display_color_primaries not in ('Display P3', 'BT.2020')
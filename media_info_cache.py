@@ -0,0 +1,186 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+default_cache_max_bytes = 1024 * 1024 * 1024
+default_sample_bytes = 4 * 1024 * 1024
+
+_caches = {}
+
+
+def partial_content_hash(file_path, sample_bytes=default_sample_bytes):
+    # Cheap content key: file size plus the first and last sample_bytes, so copies on other drives share a key
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=20)
+    with open(file_path, 'rb') as file:
+        if size <= 2 * sample_bytes:
+            digest.update(file.read())
+        else:
+            digest.update(file.read(sample_bytes))
+            file.seek(size - sample_bytes)
+            digest.update(file.read(sample_bytes))
+    return digest.hexdigest()
+
+
+class MediaInfoCache:
+    """On-disk cache of raw mediainfo output keyed by partial content hash and output format, with LRU eviction."""
+
+    def __init__(self, cache_path, max_bytes=default_cache_max_bytes, sample_bytes=default_sample_bytes):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.sample_bytes = sample_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Usable from any thread (asyncio.to_thread in mkv_info), one statement sequence at a time
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, timeout=60, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS media_info_cache (
+                    content_key TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    raw_output TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (content_key, output_format)
+                )''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS ix_media_info_cache_last_access '
+                              'ON media_info_cache (last_access)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS media_info_cache_stats '
+                              '(name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            # Running total of the entry sizes kept by triggers, put reads it instead of summing the whole table
+            if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                                     "AND name = 'media_info_cache_size_ai'").fetchone():
+                self.conn.execute("INSERT OR REPLACE INTO media_info_cache_stats (name, value) "
+                                  "SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM media_info_cache")
+            for trigger, event, change in (('ai', 'INSERT', 'new.size'), ('ad', 'DELETE', '-old.size'),
+                                           ('au', 'UPDATE OF size', 'new.size - old.size')):
+                self.conn.execute(f"CREATE TRIGGER IF NOT EXISTS media_info_cache_size_{trigger} AFTER {event} "
+                                  f"ON media_info_cache BEGIN UPDATE media_info_cache_stats "
+                                  f"SET value = value + {change} WHERE name = 'total_bytes'; END")
+
+    def _count(self, name, count=1):
+        self.conn.execute('INSERT INTO media_info_cache_stats (name, value) VALUES (?, ?) '
+                          'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', (name, count))
+
+    def get(self, content_key, output_format):
+        with self.lock, self.conn:
+            row = self.conn.execute('SELECT raw_output FROM media_info_cache WHERE content_key = ? AND output_format = ?',
+                                    (content_key, output_format)).fetchone()
+            if row is None:
+                self.misses += 1
+                self._count('misses')
+                return None
+            self.hits += 1
+            self._count('hits')
+            self.conn.execute('UPDATE media_info_cache SET last_access = ? WHERE content_key = ? AND output_format = ?',
+                              (time.time(), content_key, output_format))
+            return row[0]
+
+    def put(self, content_key, output_format, raw_output):
+        with self.lock, self.conn:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete wouldn't fire the size trigger
+            self.conn.execute('INSERT INTO media_info_cache '
+                              '(content_key, output_format, raw_output, size, last_access) VALUES (?, ?, ?, ?, ?) '
+                              'ON CONFLICT(content_key, output_format) DO UPDATE SET '
+                              'raw_output = excluded.raw_output, size = excluded.size, '
+                              'last_access = excluded.last_access',
+                              (content_key, output_format, raw_output, len(raw_output), time.time()))
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes again
+        total_bytes = self.conn.execute("SELECT value FROM media_info_cache_stats "
+                                        "WHERE name = 'total_bytes'").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for content_key, output_format, size in self.conn.execute(
+                'SELECT content_key, output_format, size FROM media_info_cache ORDER BY last_access').fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            self.conn.execute('DELETE FROM media_info_cache WHERE content_key = ? AND output_format = ?',
+                              (content_key, output_format))
+            total_bytes -= size
+            evicted += 1
+        self.evictions += evicted
+        self._count('evictions', evicted)
+
+    def get_or_parse(self, file_path, output_format, parse):
+        # parse(file_path) must return the raw output as a string, None results are not cached. The output names the
+        # file it was parsed from, callers replace that with file_path (set_pymediainfo_source_path,
+        # set_mediainfo_json_source_path) as a hit may come from a copy of the file elsewhere.
+        content_key = partial_content_hash(file_path, self.sample_bytes)
+        raw_output = self.get(content_key, output_format)
+        if raw_output is None:
+            raw_output = parse(file_path)
+            if raw_output is not None:
+                self.put(content_key, output_format, raw_output)
+        return raw_output
+
+    def stats(self):
+        with self.lock:
+            lifetime = dict(self.conn.execute('SELECT name, value FROM media_info_cache_stats').fetchall())
+            entries, total_bytes = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media_info_cache').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'lifetime_hits': lifetime.get('hits', 0),
+            'lifetime_misses': lifetime.get('misses', 0),
+            'lifetime_evictions': lifetime.get('evictions', 0),
+            'entries': entries,
+            'total_bytes': total_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        _caches.pop(self.cache_path, None)
+
+
+def source_path_fields(file_path):
+    # General track fields mediainfo derives from the path of the file it parsed
+    complete_name = os.fspath(file_path)
+    folder_name, file_name_extension = os.path.split(complete_name)
+    file_name, file_extension = os.path.splitext(file_name_extension)
+    return {'complete_name': complete_name, 'folder_name': folder_name, 'file_name': file_name,
+            'file_extension': file_extension[1:], 'file_name_extension': file_name_extension}
+
+
+def set_pymediainfo_source_path(data, file_path):
+    # data is MediaInfo.to_data(), only the path fields present in the output are replaced
+    fields = source_path_fields(file_path)
+    for track in data.get('tracks', ()):
+        if track.get('track_type') == 'General':
+            track.update((name, value) for name, value in fields.items() if name in track)
+    return data
+
+
+def set_mediainfo_json_source_path(media_info, file_path):
+    # `mediainfo --Output=JSON` names the file in media/@ref, --Full adds CompleteName, FolderName, ... to General
+    media = media_info.get('media') or {}
+    if '@ref' in media:
+        media['@ref'] = os.fspath(file_path)
+    fields = {''.join(part.capitalize() for part in name.split('_')): value
+              for name, value in source_path_fields(file_path).items()}
+    for track in media.get('track', ()):
+        if track.get('@type') == 'General':
+            track.update((name, value) for name, value in fields.items() if name in track)
+    return media_info
+
+
+def get_cache(cache_path, max_bytes=default_cache_max_bytes):
+    # One cache connection per process, worker processes of the parallel scan open their own on first use
+    if cache_path is None:
+        return None
+    if cache_path not in _caches:
+        _caches[cache_path] = MediaInfoCache(cache_path, max_bytes)
+    return _caches[cache_path]
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+
+# A model name is looked up in cache_dir, a directory path is loaded as is. Nothing is downloaded unless
+# local_files_only is turned off, the machines running this are offline.
+default_model_name_or_path = 'bert-base-uncased'
+default_cache_dir = 'D:/MakeMKV/media_info'
+default_batch_size = 32
+# The per-title texts are short, so this only bounds pathological file names
+default_max_length = 128
+
+table_name = 'media_info'
+embeddings_table_name = 'media_info_embeddings'
+# Catalogue columns the per-title text is built from
+text_columns = ['file_name', 'volume', 'formatted_duration', 'formatted_file_size', 'video_format', 'frame_rate',
+                'hdr_format', 'mastering_display_color_primaries', 'max_mdl', 'max_cll', 'max_fall']
+
+_models = {}
+
+
+class EmbeddingModel:
+    """Tokenizer and model loaded once, encoding texts in padded batches with mean pooling over real tokens."""
+
+    def __init__(self, model_name_or_path=default_model_name_or_path, cache_dir=default_cache_dir,
+                 local_files_only=True, max_length=default_max_length, device=None):
+        self.model_name = os.path.basename(os.path.normpath(model_name_or_path))
+        self.max_length = max_length
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path, cache_dir=cache_dir,
+                                                       local_files_only=local_files_only)
+        self.model = AutoModel.from_pretrained(model_name_or_path, cache_dir=cache_dir,
+                                               local_files_only=local_files_only)
+        self.model.to(self.device)
+        self.model.eval()
+        self.dimension = self.model.config.hidden_size
+
+    def encode(self, texts, batch_size=default_batch_size):
+        # Returns a float32 array of shape (len(texts), dimension) in the order of texts
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Batching texts of similar length keeps the padding per batch small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        with torch.no_grad():
+            for start in range(0, len(order), batch_size):
+                batch_indexes = order[start:start + batch_size]
+                inputs = self.tokenizer([texts[i] for i in batch_indexes], return_tensors='pt', truncation=True,
+                                        padding=True, max_length=self.max_length).to(self.device)
+                hidden_state = self.model(**inputs).last_hidden_state
+                mask = inputs['attention_mask'].unsqueeze(-1).to(hidden_state.dtype)
+                pooled = (hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                embeddings[batch_indexes] = pooled.cpu().numpy()
+        return embeddings
+
+
+def get_embedding_model(model_name_or_path=default_model_name_or_path, cache_dir=default_cache_dir,
+                        local_files_only=True):
+    # One loaded model per process, loading BERT takes seconds and hundreds of MB
+    key = (model_name_or_path, cache_dir, local_files_only)
+    if key not in _models:
+        _models[key] = EmbeddingModel(model_name_or_path, cache_dir, local_files_only)
+    return _models[key]
+
+
+def media_info_text(row):
+    # Compact description of one catalogue row (text_columns order), e.g.
+    # "13 Hours The Secret Soldiers of Benghazi. HEVC, SMPTE ST 2086, Display P3, mastering 1000 nits, MaxCLL 962, ..."
+    (file_name, volume, formatted_duration, formatted_file_size, video_format, frame_rate, hdr_format, primaries,
+     max_mdl, max_cll, max_fall) = row
+    title = os.path.splitext(file_name or '')[0].replace('_', ' ').strip()
+    if title.endswith(' 4K'):
+        title = title[:-3]
+    details = [video_format, hdr_format, primaries,
+               f'mastering {max_mdl} nits' if max_mdl is not None else None,
+               f'MaxCLL {max_cll}' if max_cll is not None else None,
+               f'MaxFALL {max_fall}' if max_fall is not None else None,
+               f'{frame_rate} fps' if frame_rate is not None else None,
+               formatted_duration, formatted_file_size, f'volume {volume}' if volume else None]
+    return f"{title}. {', '.join(str(detail) for detail in details if detail)}"
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def create_embeddings_table(conn):
+    with conn:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {embeddings_table_name} (
+                id INTEGER PRIMARY KEY,
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL
+            )''')
+
+
+def load_media_info_texts(conn):
+    # {media_info.id: text} of every catalogue row
+    cursor = conn.execute(f"SELECT id, {', '.join(text_columns)} FROM {table_name} ORDER BY id")
+    return {row[0]: media_info_text(row[1:]) for row in cursor}
+
+
+def update_embeddings(conn, model, batch_size=default_batch_size, write_batch_size=1024):
+    # Embed catalogue rows that are new or whose text changed since they were embedded (or embedded with another
+    # model) and drop embeddings of deleted rows. Embeddings are committed every write_batch_size rows, so an
+    # interrupted run keeps its progress. Returns the number of rows embedded and deleted.
+    create_embeddings_table(conn)
+    texts = load_media_info_texts(conn)
+    stored_hashes = dict(conn.execute(f'SELECT id, text_hash FROM {embeddings_table_name} WHERE model = ?',
+                                      (model.model_name,)).fetchall())
+    changed_ids = [row_id for row_id, text in texts.items() if stored_hashes.get(row_id) != text_hash(text)]
+    deleted_ids = [(row_id,) for row_id, in conn.execute(f'SELECT id FROM {embeddings_table_name}').fetchall()
+                   if row_id not in texts]
+    with conn:
+        conn.executemany(f'DELETE FROM {embeddings_table_name} WHERE id = ?', deleted_ids)
+
+    start = time.perf_counter()
+    for i in range(0, len(changed_ids), write_batch_size):
+        batch_ids = changed_ids[i:i + write_batch_size]
+        batch_texts = [texts[row_id] for row_id in batch_ids]
+        embeddings = model.encode(batch_texts, batch_size)
+        with conn:
+            conn.executemany(f'INSERT OR REPLACE INTO {embeddings_table_name} (id, model, text_hash, embedding) '
+                             f'VALUES (?, ?, ?, ?)',
+                             [(row_id, model.model_name, text_hash(text), embedding.tobytes())
+                              for row_id, text, embedding in zip(batch_ids, batch_texts, embeddings)])
+    elapsed = time.perf_counter() - start
+
+    print(f'{len(changed_ids)} of {len(texts)} row(s) embedded in {elapsed:.2f}s '
+          f'({len(changed_ids) / elapsed if elapsed else 0:.1f} embeddings/sec), '
+          f'{len(deleted_ids)} stale embedding(s) removed')
+    return len(changed_ids), len(deleted_ids)
+
+
+def load_embeddings(conn, model_name, ids=None, id_batch_size=900):
+    # (ids, float32 matrix) of the stored embeddings of a model, optionally only of the given ids
+    query = f'SELECT id, embedding FROM {embeddings_table_name} WHERE model = ?'
+    if ids is None:
+        rows = conn.execute(f'{query} ORDER BY id', (model_name,)).fetchall()
+    else:
+        ids = sorted(ids)
+        rows = []
+        # Bounded IN lists, SQLite limits the number of parameters of a statement
+        for i in range(0, len(ids), id_batch_size):
+            batch_ids = ids[i:i + id_batch_size]
+            rows += conn.execute(f"{query} AND id IN ({', '.join('?' * len(batch_ids))}) ORDER BY id",
+                                 [model_name, *batch_ids]).fetchall()
+    row_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    if not rows:
+        return row_ids, np.empty((0, 0), dtype=np.float32)
+    return row_ids, np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Embed new and changed catalogue rows for semantic search.')
+    parser.add_argument('--db_path', default='D:/MakeMKV/media_info/media_info_new.db')
+    parser.add_argument('--model', default=default_model_name_or_path,
+                        help='Model name in the cache directory, or a local model directory.')
+    parser.add_argument('--cache_dir', default=default_cache_dir)
+    parser.add_argument('--batch_size', type=int, default=default_batch_size)
+    parser.add_argument('--allow_download', action='store_true', help='Fetch the model if it is not cached locally.')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path)
+    update_embeddings(conn, get_embedding_model(args.model, args.cache_dir, not args.allow_download), args.batch_size)
+    conn.close()
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+# Column versions of the globals formatters for DataFrame columns/arrays of bulk rows, equal element for element to the
+# scalar functions. Missing values (None/NaN) give None where the scalar functions would raise. Kept apart from globals
+# so the importers and mkv_info don't load numpy and pandas. Used by export_media_info_from_db --formatted.
+
+file_size_unit_names = [' B', ' KB', ' MB', ' GB', ' TB']
+duration_tails = np.array([f':{minutes:02}:{seconds:02}' for minutes in range(60) for seconds in range(60)],
+                          dtype=object)
+
+
+def column_values(column):
+    if isinstance(column, pd.Series):
+        return column
+    # Integer columns (with SQLite NULLs as Int64) keep the integer fast paths, anything else is formatted from the
+    # original objects
+    values = np.asarray(column)
+    if values.dtype.kind == 'i':
+        return pd.Series(values)
+    values = pd.array(list(column))
+    return pd.Series(values) if pd.api.types.is_integer_dtype(values.dtype) else pd.Series(column, dtype=object)
+
+
+def fixed_2_strings(values, suffix_codes=0, suffixes=('',)):
+    # f"{value:.2f}{suffixes[code]}" of a float64 array. Rounding value * 100 gives the same digits unless the product
+    # is within float error of half a cent, those (and negative or huge values) are formatted one by one. The rest
+    # only has a few thousand distinct (cents, suffix) pairs, each is formatted once.
+    scaled = values * 100
+    slow = (~np.isfinite(values) | np.signbit(values) | (values >= 1e7)
+            | (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6))
+    cents = np.rint(np.where(slow, 0, scaled)).astype(np.int64)
+    codes, unique_keys = pd.factorize(cents * len(suffixes) + suffix_codes)
+    if len(unique_keys) <= len(values) // 8:
+        unique_strings = np.array([f'{cents // 100}.{cents % 100:02}{suffixes[code]}'
+                                   for cents, code in (divmod(key, len(suffixes)) for key in unique_keys.tolist())],
+                                  dtype=object)
+        strings = unique_strings[codes]
+    else:
+        # Mostly distinct values (e.g. bit rates in Kbps), join the distinct integer parts to ".cc<suffix>" instead
+        whole, cent = np.divmod(cents, 100)
+        whole_codes, unique_wholes = pd.factorize(whole)
+        tails = np.array([f'.{cent:02}{suffix}' for cent in range(100) for suffix in suffixes], dtype=object)
+        strings = (np.array([str(value) for value in unique_wholes.tolist()], dtype=object)[whole_codes]
+                   + tails[cent * len(suffixes) + suffix_codes])
+    slow_codes = np.broadcast_to(suffix_codes, values.shape)[slow].tolist()
+    strings[slow] = [f'{value:.2f}{suffixes[code]}' for value, code in zip(values[slow].tolist(), slow_codes)]
+    return strings
+
+
+def numeric_values(column):
+    # float64 values of a column and the mask of missing/unparsable ones
+    values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return values, np.isnan(values)
+
+
+def format_file_size_column(column):
+    column = column_values(column)
+    values, missing = numeric_values(column)
+    units = np.zeros(len(values), dtype=np.int64)
+    # Divide the way format_file_size does, one 1024 step at a time, so the floats (and digits) are identical
+    for _ in range(len(file_size_unit_names)):
+        larger = values >= 1024
+        values = np.where(larger, values / 1024, values)
+        units += larger
+    missing |= units == len(file_size_unit_names)
+    strings = fixed_2_strings(values, np.minimum(units, len(file_size_unit_names) - 1), file_size_unit_names)
+    strings[missing] = None
+    return pd.Series(strings, index=column.index, dtype=object)
+
+
+def convert_bitrate_column(column, divisor, unit):
+    column = column_values(column)
+    values, missing = numeric_values(column)
+    missing |= values == 0
+    values = np.trunc(values)
+    strings = fixed_2_strings(values / divisor, 0, (f' {unit}',))
+    strings[missing] = None
+    return pd.Series(strings, index=column.index, dtype=object)
+
+
+def convert_bitrate_to_mbps_column(column):
+    return convert_bitrate_column(column, 1_000_000, 'Mbps')
+
+
+def format_duration_column(column):
+    column = column_values(column)
+    missing = column.isna().to_numpy(copy=True)
+    if pd.api.types.is_integer_dtype(column.dtype) or pd.api.types.is_bool_dtype(column.dtype):
+        duration_ms = column.to_numpy(dtype=np.float64, na_value=0)
+        missing |= duration_ms == 0
+    else:
+        # format_duration drops the decimal point of "7263.104" (mediainfo seconds) to get milliseconds
+        values = column.astype(object)
+        missing |= ((values == '') | (values == 0)).to_numpy(dtype=bool)
+        text = values.where(~missing, '0').astype(str).str.replace('.', '', regex=False)
+        duration_ms = pd.to_numeric(text, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    missing |= np.isnan(duration_ms)
+    seconds = duration_ms / 1000
+    hours = np.floor_divide(seconds, 3600)
+    minutes = np.floor_divide(np.remainder(seconds, 3600), 60)
+    seconds = np.remainder(seconds, 60)
+    # "hh:" of each distinct hour joined to one of the 3600 ":mm:ss" tails
+    hours = np.where(missing, 0, hours).astype(np.int64)
+    tails = (np.where(missing, 0, minutes) * 60 + np.where(missing, 0, seconds).astype(np.int64)).astype(np.int64)
+    hour_codes, unique_hours = pd.factorize(hours)
+    hour_strings = np.array([f'{hours:02}' for hours in unique_hours.tolist()], dtype=object)
+    strings = hour_strings[hour_codes] + duration_tails[tails]
+    strings[missing] = None
+    return pd.Series(strings, index=column.index, dtype=object)
+
+
+# Column versions of media_info_search.display_formatters, for the typed columns of the dump table
+display_column_formatters = {
+    'duration': format_duration_column,
+    'file_size': format_file_size_column,
+    'overall_bitrate': convert_bitrate_to_mbps_column,
+    'video_bitrate': convert_bitrate_to_mbps_column,
+}
@@ -0,0 +1,92 @@
+table_name = 'media_info'
+
+# Typed filters of the /query/ endpoint, all on columns of import_media_info_into_db_.MediaInfoModel
+prefix_filter_columns = ['hdr_format']
+exact_filter_columns = ['mastering_display_color_primaries']
+range_filter_columns = ['max_mdl', 'max_cll', 'max_fall', 'frame_rate', 'file_size', 'video_bit_rate']
+
+# Equality column first, range column last, so each common filter combination is a single index range scan
+query_indexes = {
+    'ix_media_info_hdr_format_max_cll': ('hdr_format', 'max_cll'),
+    'ix_media_info_primaries_max_mdl_max_cll': ('mastering_display_color_primaries', 'max_mdl', 'max_cll'),
+    'ix_media_info_max_cll': ('max_cll',),
+    'ix_media_info_max_fall': ('max_fall',),
+    'ix_media_info_max_mdl': ('max_mdl',),
+    'ix_media_info_frame_rate': ('frame_rate',),
+    'ix_media_info_file_size': ('file_size',),
+    'ix_media_info_video_bit_rate': ('video_bit_rate',),
+}
+
+result_columns = ['id', 'volume', 'file_name', 'formatted_duration', 'formatted_file_size', 'video_format',
+                  'formatted_video_bit_rate', 'frame_rate', 'hdr_format', 'mastering_display_color_primaries',
+                  'mastering_display_luminance', 'max_mdl', 'max_fall', 'max_cll']
+
+# Facet name -> SQL expression grouped over the filtered rows
+facet_expressions = {
+    'hdr_format': 'hdr_format',
+    'mastering_display_color_primaries': 'mastering_display_color_primaries',
+    'max_mdl': 'max_mdl',
+    'frame_rate': 'frame_rate',
+    'max_cll': "CASE WHEN max_cll IS NULL THEN NULL WHEN max_cll < 500 THEN '<500' WHEN max_cll < 1000 THEN '500-999' "
+               "WHEN max_cll < 2000 THEN '1000-1999' WHEN max_cll < 4000 THEN '2000-3999' ELSE '>=4000' END",
+}
+
+
+def ensure_query_indexes(conn):
+    # Returns False when the catalogue table doesn't exist yet (nothing imported)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone():
+        print(f'Table {table_name} not found, skipping query indexes')
+        return False
+    with conn:
+        for index_name, columns in query_indexes.items():
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({", ".join(columns)})')
+    conn.execute('PRAGMA optimize')
+    return True
+
+
+def build_filter_clause(filters):
+    # filters: {'hdr_format': 'Dolby Vision', 'min_max_cll': 1000, 'max_file_size': ...}, None values are ignored
+    conditions = []
+    parameters = []
+    for column in prefix_filter_columns:
+        value = filters.get(column)
+        if value:
+            # Range form of a prefix match so the index on the column can be used (LIKE would scan)
+            conditions.append(f'{column} >= ? AND {column} < ?')
+            parameters += [value, value + '\U0010ffff']
+    for column in exact_filter_columns:
+        value = filters.get(column)
+        if value:
+            conditions.append(f'{column} = ?')
+            parameters.append(value)
+    for column in range_filter_columns:
+        for bound, operator in (('min', '>='), ('max', '<=')):
+            value = filters.get(f'{bound}_{column}')
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                parameters.append(value)
+    return ' AND '.join(conditions) or '1 = 1', parameters
+
+
+def query_media_info(conn, filters, limit=50, offset=0, sort=None):
+    # Page of matching rows plus facet counts and total of the whole filtered set
+    where_clause, parameters = build_filter_clause(filters)
+    order_by = f'{sort} DESC, id' if sort in range_filter_columns else 'id'
+    cursor = conn.execute(f'SELECT {", ".join(result_columns)} FROM {table_name} WHERE {where_clause} '
+                          f'ORDER BY {order_by} LIMIT ? OFFSET ?', parameters + [limit, offset])
+    rows = [dict(zip(result_columns, row)) for row in cursor.fetchall()]
+
+    # All facets in one statement over the filtered rows
+    facet_selects = [f"SELECT '{facet}', {expression}, COUNT(*) FROM hits GROUP BY 2"
+                     for facet, expression in facet_expressions.items()]
+    facet_columns = ', '.join(facet_expressions)
+    facets = {facet: [] for facet in facet_expressions}
+    for facet, value, count in conn.execute(
+            f'WITH hits AS (SELECT {facet_columns} FROM {table_name} WHERE {where_clause}) '
+            + ' UNION ALL '.join(facet_selects), parameters):
+        facets[facet].append({'value': value, 'count': count})
+    for facet_values in facets.values():
+        facet_values.sort(key=lambda facet_value: -facet_value['count'])
+
+    total = sum(facet_value['count'] for facet_value in facets['hdr_format'])
+    return {'total': total, 'rows': rows, 'facets': facets}
@@ -0,0 +1,170 @@
+import math
+import re
+import threading
+import time
+
+from globals import media_info_table_columns, media_info_table_columns_def, format_duration, format_file_size, \
+    convert_bitrate_to_mbps
+
+fts_table_suffix = '_fts'
+# Free text columns go into the full-text index, numeric ones are left to structured filters
+fts_columns = [column for column, column_type in media_info_table_columns_def if column_type not in ('INTEGER', 'REAL')]
+fts_token_pattern = re.compile(r'[^\W_]+')
+
+count_cache_ttl = 30
+count_cache_max_entries = 1024
+count_cache = {}
+count_cache_lock = threading.Lock()
+
+# Column -> formatter applied to search results just before rendering
+display_formatters = {
+    'duration': format_duration,
+    'file_size': format_file_size,
+    'overall_bitrate': convert_bitrate_to_mbps,
+    'video_bitrate': convert_bitrate_to_mbps,
+}
+
+
+def fts_table_name(table_name):
+    return table_name + fts_table_suffix
+
+
+def ensure_fts_index(conn, table_name='media_info'):
+    # Create (or re-create) the FTS5 index and its sync triggers, returns True when the index had to be rebuilt.
+    # Replacing the content table (e.g. DataFrame.to_sql(if_exists='replace')) drops the triggers, which is how a
+    # stale index is detected here.
+    fts_table = fts_table_name(table_name)
+    trigger_names = {f'{fts_table}_ai', f'{fts_table}_ad', f'{fts_table}_au'}
+    existing_columns = [row[1] for row in conn.execute(f'PRAGMA table_info({fts_table})')]
+    existing_triggers = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table_name,))}
+    if existing_columns == fts_columns and trigger_names <= existing_triggers:
+        return False
+
+    columns = ', '.join(fts_columns)
+    new_values = ', '.join(f'new.{column}' for column in fts_columns)
+    old_values = ', '.join(f'old.{column}' for column in fts_columns)
+    print(f'Building full-text index {fts_table} over {table_name}')
+    with conn:
+        for trigger_name in trigger_names:
+            conn.execute(f'DROP TRIGGER IF EXISTS {trigger_name}')
+        conn.execute(f'DROP TABLE IF EXISTS {fts_table}')
+        conn.execute(f"CREATE VIRTUAL TABLE {fts_table} USING fts5({columns}, content='{table_name}', "
+                     f"tokenize='unicode61 remove_diacritics 2')")
+        conn.execute(f'''
+            CREATE TRIGGER {fts_table}_ai AFTER INSERT ON {table_name} BEGIN
+                INSERT INTO {fts_table} (rowid, {columns}) VALUES (new.rowid, {new_values});
+            END''')
+        conn.execute(f'''
+            CREATE TRIGGER {fts_table}_ad AFTER DELETE ON {table_name} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+            END''')
+        conn.execute(f'''
+            CREATE TRIGGER {fts_table}_au AFTER UPDATE ON {table_name} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+                INSERT INTO {fts_table} (rowid, {columns}) VALUES (new.rowid, {new_values});
+            END''')
+        conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+    return True
+
+
+def build_fts_query(query):
+    # Every word of the query has to match, the last characters of each word may be a prefix ("Dolb" -> "Dolby")
+    tokens = fts_token_pattern.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def count_search_results(conn, query, table_name='media_info'):
+    # Total match count per query string, cached for count_cache_ttl seconds so paging doesn't recount every request.
+    # Also decides whether the query is answered by the full-text index or the substring fallback.
+    key = (table_name, query)
+    now = time.monotonic()
+    with count_cache_lock:
+        cached = count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1], cached[2]
+
+    fts_query = build_fts_query(query)
+    total_rows = 0
+    if fts_query:
+        fts_table = fts_table_name(table_name)
+        total_rows = conn.execute(f'SELECT COUNT(*) FROM {fts_table} WHERE {fts_table} MATCH ?',
+                                  (fts_query,)).fetchone()[0]
+    search_mode = 'fts'
+    if total_rows == 0:
+        where_clause, parameters = like_where_clause(query)
+        total_rows = conn.execute(f'SELECT COUNT(*) FROM {table_name} WHERE {where_clause}', parameters).fetchone()[0]
+        search_mode = 'like'
+
+    with count_cache_lock:
+        if len(count_cache) >= count_cache_max_entries:
+            for expired_key in [k for k, v in count_cache.items() if v[0] <= now] or list(count_cache)[:1]:
+                del count_cache[expired_key]
+        count_cache[key] = (now + count_cache_ttl, search_mode, total_rows)
+    return search_mode, total_rows
+
+
+def like_where_clause(query):
+    # Substring match over every column, used for queries the token index can't answer (e.g. "oldier")
+    where_clause = " OR ".join([f"{col} LIKE ?" for col in media_info_table_columns])
+    return where_clause, ['%' + query + '%'] * len(media_info_table_columns)
+
+
+def search_query_parts(search_mode, query, table_name):
+    # FROM/WHERE clause, parameters and row id column of a search. In full-text mode the id is taken from the index
+    # so cursor constraints become a rowid range seek inside FTS5.
+    if search_mode == 'fts':
+        fts_table = fts_table_name(table_name)
+        return (f'{fts_table} JOIN {table_name} ON {table_name}.rowid = {fts_table}.rowid WHERE {fts_table} MATCH ?',
+                [build_fts_query(query)], f'{fts_table}.rowid')
+    where_clause, parameters = like_where_clause(query)
+    return f'{table_name} WHERE ({where_clause})', parameters, f'{table_name}.rowid'
+
+
+def search_media_info(conn, query, page, items_per_page, table_name='media_info', extra_columns=()):
+    # Offset paging: ranked full-text search, falling back to the substring scan when the index has no match.
+    # extra_columns (e.g. id, volume) follow the media_info_table_columns in each row.
+    offset = (page - 1) * items_per_page
+    search_mode, total_rows = count_search_results(conn, query, table_name)
+    columns = ', '.join(f'{table_name}.{column}' for column in [*media_info_table_columns, *extra_columns])
+    from_clause, parameters, id_column = search_query_parts(search_mode, query, table_name)
+    order_by = f'{fts_table_name(table_name)}.rank' if search_mode == 'fts' else id_column
+    rows = conn.execute(f'SELECT {columns} FROM {from_clause} ORDER BY {order_by} LIMIT ? OFFSET ?',
+                        parameters + [items_per_page, offset]).fetchall()
+    total_pages = math.ceil(total_rows / items_per_page)
+    return rows, total_pages
+
+
+def search_media_info_keyset(conn, query, items_per_page, after=None, before=None, table_name='media_info'):
+    # Keyset paging on the row id: every page is an index seek from the cursor, so deep pages cost the same as the
+    # first one. Returns the rows, cursors for the next/previous page (None at either end) and the total row count.
+    search_mode, total_rows = count_search_results(conn, query, table_name)
+    columns = ', '.join(f'{table_name}.{column}' for column in media_info_table_columns)
+    from_clause, parameters, id_column = search_query_parts(search_mode, query, table_name)
+    if before is not None:
+        cursor_clause, order, cursor = f'AND {id_column} < ?', 'DESC', before
+    else:
+        cursor_clause, order, cursor = f'AND {id_column} > ?', 'ASC', after if after is not None else 0
+    rows = conn.execute(f'SELECT {id_column}, {columns} FROM {from_clause} {cursor_clause} '
+                        f'ORDER BY {id_column} {order} LIMIT ?',
+                        parameters + [cursor, items_per_page + 1]).fetchall()
+    has_more = len(rows) > items_per_page
+    rows = rows[:items_per_page]
+    if before is not None:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if before is not None:
+            next_cursor = rows[-1][0]
+            prev_cursor = rows[0][0] if has_more else None
+        else:
+            next_cursor = rows[-1][0] if has_more else None
+            prev_cursor = rows[0][0] if after is not None else None
+    return [row[1:] for row in rows], next_cursor, prev_cursor, total_rows
+
+
+def format_media_info_row(row):
+    # Render the typed numeric columns of a media_info row the way the dump files used to store them
+    return tuple(display_formatters[column](value) if column in display_formatters and value is not None else value
+                 for column, value in zip(media_info_table_columns, row))
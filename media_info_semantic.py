@@ -0,0 +1,36 @@
+from media_info_embeddings import default_cache_dir, default_model_name_or_path, get_embedding_model
+from media_info_vector_index import MediaInfoVectorIndex, lookup_rows
+from semantic_query import QueryEmbeddingCache, default_embedding_cache_size
+
+# volume and relative_path identify a catalogue row when the hybrid mode fuses rankings
+result_columns = ('id', 'volume', 'relative_path', 'file_name', 'formatted_duration', 'formatted_file_size',
+                  'video_format', 'hdr_format', 'mastering_display_color_primaries', 'max_mdl', 'max_cll', 'max_fall')
+
+
+class SemanticSearch:
+    """Embedding model and memory-mapped vector index loaded once, with an LRU cache of query embeddings."""
+
+    def __init__(self, index_file, model_name_or_path=default_model_name_or_path, cache_dir=default_cache_dir,
+                 embedding_cache_size=default_embedding_cache_size):
+        self.model = get_embedding_model(model_name_or_path, cache_dir)
+        self.vector_index = MediaInfoVectorIndex(index_file, self.model.model_name)
+        if not self.vector_index.load(mmap=True):
+            raise FileNotFoundError(f'No {self.model.model_name} vector index at {index_file}, '
+                                    f'build it with semantics_search_poc.py')
+        # The first forward pass initializes the kernels, pay for it at startup rather than on the first query
+        self.model.encode(['warm up'])
+        # Cased models tell "HDR" from "hdr", only a lowercasing tokenizer lets the two share an embedding
+        self.embedding_cache = QueryEmbeddingCache(embedding_cache_size,
+                                                   getattr(self.model.tokenizer, 'do_lower_case', False))
+
+    def encode(self, query):
+        return self.model.encode([query])
+
+    def search(self, query_embedding, k):
+        # [(media_info.id, distance)], the rows themselves are looked up separately
+        return self.vector_index.search(query_embedding, k)
+
+
+def lookup_result_rows(conn, results):
+    return lookup_rows(conn, results, result_columns)
+
@@ -0,0 +1,146 @@
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+from media_info_embeddings import embeddings_table_name, load_embeddings, table_name
+
+# Above this many vectors a flat index is rebuilt as large_index_type, exact search gets slow past that
+default_large_index_threshold = 50_000
+default_large_index_type = 'ivf'
+default_nprobe = 16
+default_hnsw_neighbours = 32
+# Vectors used to train the IVF coarse quantizer, more doesn't improve the clustering noticeably
+ivf_training_sample = 100_000
+
+
+def build_index(index_type, vectors, ids):
+    # Every index type searches by media_info.id: flat and HNSW through IndexIDMap, IVF stores the ids in its lists
+    dimension = vectors.shape[1]
+    if index_type == 'flat':
+        index = faiss.IndexIDMap(faiss.IndexFlatL2(dimension))
+    elif index_type == 'hnsw':
+        index = faiss.IndexIDMap(faiss.IndexHNSWFlat(dimension, default_hnsw_neighbours))
+    elif index_type == 'ivf':
+        nlist = max(1, min(int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, nlist)
+        sample = vectors
+        if len(vectors) > ivf_training_sample:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), ivf_training_sample, replace=False)]
+        index.train(sample)
+    else:
+        raise ValueError(f'Unknown index type {index_type}')
+    if len(vectors):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+class MediaInfoVectorIndex:
+    """FAISS index of the catalogue embeddings keyed by media_info.id, updated in place as rows change.
+
+    The index is stored in index_file, with a JSON sidecar holding the index type and the text hash of every
+    indexed id. sync() compares the sidecar with the media_info_embeddings table and only adds/removes changed rows.
+    """
+
+    def __init__(self, index_file, model_name, large_index_threshold=default_large_index_threshold,
+                 large_index_type=default_large_index_type):
+        self.index_file = index_file
+        self.state_file = index_file + '.json'
+        self.model_name = model_name
+        self.large_index_threshold = large_index_threshold
+        self.large_index_type = large_index_type
+        self.index = None
+        self.index_type = None
+        self.text_hashes = {}
+
+    def load(self, mmap=True):
+        # Memory-mapped indexes are for searching only, sync() needs an index loaded with mmap=False.
+        # Returns False when there is no usable index on disk (missing, or built with another model).
+        if not (os.path.exists(self.index_file) and os.path.exists(self.state_file)):
+            return False
+        with open(self.state_file, encoding='utf-8') as f:
+            state = json.load(f)
+        if state['model'] != self.model_name:
+            print(f'{self.index_file} was built with {state["model"]}, not {self.model_name}')
+            return False
+        self.index = faiss.read_index(self.index_file, faiss.IO_FLAG_MMAP if mmap else 0)
+        self.index_type = state['index_type']
+        self.text_hashes = {int(row_id): text_hash for row_id, text_hash in state['text_hashes'].items()}
+        return True
+
+    def save(self):
+        # Written next to the target and renamed, readers never see a half written index
+        if self.index is None:
+            return
+        faiss.write_index(self.index, self.index_file + '.tmp')
+        with open(self.state_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model_name, 'index_type': self.index_type,
+                       'text_hashes': self.text_hashes}, f)
+        os.replace(self.index_file + '.tmp', self.index_file)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def rebuild(self, conn, index_type=None):
+        ids, vectors = load_embeddings(conn, self.model_name)
+        if index_type is None:
+            index_type = self.large_index_type if len(ids) > self.large_index_threshold else 'flat'
+        print(f'Building {index_type} index of {len(ids)} embedding(s)')
+        self.index = build_index(index_type, vectors, ids) if len(ids) else None
+        self.index_type = index_type
+        self.text_hashes = self.stored_text_hashes(conn)
+
+    def stored_text_hashes(self, conn):
+        return dict(conn.execute(f'SELECT id, text_hash FROM {embeddings_table_name} WHERE model = ?',
+                                 (self.model_name,)).fetchall())
+
+    def sync(self, conn):
+        # Bring the index in line with the embeddings table, returns the number of ids added and removed
+        if self.index is None and not self.load(mmap=False):
+            self.rebuild(conn)
+            return len(self.text_hashes), 0
+
+        stored_hashes = self.stored_text_hashes(conn)
+        removed_ids = [row_id for row_id, text_hash in self.text_hashes.items()
+                       if stored_hashes.get(row_id) != text_hash]
+        added_ids = [row_id for row_id, text_hash in stored_hashes.items()
+                     if self.text_hashes.get(row_id) != text_hash]
+        if self.index_type == 'flat' and len(stored_hashes) > self.large_index_threshold:
+            self.rebuild(conn, self.large_index_type)
+            return len(added_ids), len(removed_ids)
+        if removed_ids and self.index_type == 'hnsw':
+            # HNSW graphs don't support removal, rebuilding from the stored embeddings is cheap next to embedding
+            self.rebuild(conn, 'hnsw')
+            return len(added_ids), len(removed_ids)
+
+        if removed_ids:
+            self.index.remove_ids(np.array(removed_ids, dtype=np.int64))
+            for row_id in removed_ids:
+                del self.text_hashes[row_id]
+        if added_ids:
+            ids, vectors = load_embeddings(conn, self.model_name, added_ids)
+            self.index.add_with_ids(vectors, ids)
+            self.text_hashes.update((row_id, stored_hashes[row_id]) for row_id in ids.tolist())
+        print(f'{len(added_ids)} id(s) added to and {len(removed_ids)} removed from the {self.index_type} index')
+        return len(added_ids), len(removed_ids)
+
+    def search(self, query_embeddings, k=5, nprobe=default_nprobe):
+        # [(media_info.id, distance)] of the k nearest rows for the first query embedding
+        if self.index is None or self.index.ntotal == 0:
+            return []
+        if self.index_type == 'ivf':
+            faiss.extract_index_ivf(self.index).nprobe = nprobe
+        elif self.index_type == 'hnsw':
+            faiss.downcast_index(self.index.index).hnsw.efSearch = max(nprobe * 4, k)
+        distances, ids = self.index.search(np.asarray(query_embeddings, dtype=np.float32).reshape(1, -1), k)
+        return [(int(row_id), float(distance)) for row_id, distance in zip(ids[0], distances[0]) if row_id != -1]
+
+
+def lookup_rows(conn, results, columns=('id', 'volume', 'file_name', 'hdr_format', 'max_mdl', 'max_cll')):
+    # Catalogue rows of search results, fetched by id in result order, ids deleted since the last sync are skipped
+    if not results:
+        return []
+    ids = [row_id for row_id, _ in results]
+    rows = {row[0]: dict(zip(columns, row)) for row in conn.execute(
+        f"SELECT {', '.join(columns)} FROM {table_name} WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+    return [dict(rows[row_id], distance=distance) for row_id, distance in results if row_id in rows]
@@ -0,0 +1,126 @@
+from dataclasses import dataclass, field
+
+# mediainfo reports tracks in two shapes: the CLI JSON read by mkv_info ({'media': {'track': [{'@type': ...}]}}, with
+# CamelCase keys) and pymediainfo's to_data() used by import_media_info_into_db_ ({'tracks': [{'track_type': ...}]},
+# with snake_case keys). The records below hold the raw values of either, converting them is left to the callers.
+
+all_track_types = frozenset({'General', 'Video', 'Audio', 'Text'})
+
+
+@dataclass(slots=True)
+class GeneralTrack:
+    duration: object = None
+    file_size: object = None
+    overall_bit_rate: object = None
+
+
+@dataclass(slots=True)
+class VideoTrack:
+    format: object = None
+    bit_rate: object = None
+    frame_rate: object = None
+    hdr_format: object = None
+    color_primaries: object = None
+    mastering_display_color_primaries: object = None
+    mastering_display_luminance: object = None
+    max_fall: object = None
+    max_cll: object = None
+
+
+@dataclass(slots=True)
+class AudioTrack:
+    format: object = None
+    commercial_name: object = None
+    bit_rate: object = None
+    channels: object = None
+    language: object = None
+
+    def summary(self):
+        # "MLP FBA 8ch en"
+        channels = f'{self.channels}ch' if self.channels else None
+        return ' '.join(str(part) for part in (self.format, channels, self.language) if part)
+
+
+@dataclass(slots=True)
+class TextTrack:
+    format: object = None
+    language: object = None
+
+
+@dataclass(slots=True)
+class MediaTracks:
+    general: GeneralTrack = None
+    video: VideoTrack = None
+    audio: list = field(default_factory=list)
+    text: list = field(default_factory=list)
+
+    @classmethod
+    def from_mediainfo_json(cls, media_info, track_types=all_track_types):
+        # One pass over the tracks of `mediainfo --Output=JSON`, the first general and video track are kept. Only
+        # tracks of track_types are built, the pass stops once the general and video track are all it still needs.
+        tracks = cls()
+        single_tracks_only = not track_types & {'Audio', 'Text'}
+        for track in media_info['media']['track']:
+            track_type = track.get('@type')
+            if track_type not in track_types:
+                continue
+            if track_type == 'General':
+                if tracks.general is None:
+                    tracks.general = GeneralTrack(track.get('Duration'), track.get('FileSize'),
+                                                  track.get('OverallBitRate'))
+            elif track_type == 'Video':
+                if tracks.video is None:
+                    tracks.video = VideoTrack(track.get('Format'), track.get('BitRate'), track.get('FrameRate'),
+                                              track.get('HDR_Format'), track.get('colour_primaries'),
+                                              track.get('MasteringDisplay_ColorPrimaries'),
+                                              track.get('MasteringDisplay_Luminance'), track.get('MaxFALL'),
+                                              track.get('MaxCLL'))
+                if single_tracks_only and tracks.general is not None:
+                    break
+            elif track_type == 'Audio':
+                tracks.audio.append(AudioTrack(track.get('Format'), track.get('Format_Commercial_IfAny'),
+                                               track.get('BitRate'), track.get('Channels'), track.get('Language')))
+            elif track_type == 'Text':
+                tracks.text.append(TextTrack(track.get('Format'), track.get('Language')))
+        return tracks
+
+    @classmethod
+    def from_pymediainfo(cls, media_info, track_types=all_track_types):
+        # One pass over the tracks of pymediainfo's MediaInfo.to_data(), track_types as in from_mediainfo_json
+        tracks = cls()
+        single_tracks_only = not track_types & {'Audio', 'Text'}
+        for track in media_info['tracks']:
+            track_type = track.get('track_type')
+            if track_type not in track_types:
+                continue
+            if track_type == 'General':
+                if tracks.general is None:
+                    tracks.general = GeneralTrack(track.get('duration'), track.get('file_size'),
+                                                  track.get('overall_bit_rate'))
+            elif track_type == 'Video':
+                if tracks.video is None:
+                    tracks.video = VideoTrack(track.get('format'), track.get('bit_rate'), track.get('frame_rate'),
+                                              track.get('hdr_format'), track.get('color_primaries'),
+                                              track.get('mastering_display_color_primaries'),
+                                              track.get('mastering_display_luminance'),
+                                              track.get('maximum_frameaverage_light_level'),
+                                              track.get('maximum_content_light_level'))
+                if single_tracks_only and tracks.general is not None:
+                    break
+            elif track_type == 'Audio':
+                tracks.audio.append(AudioTrack(track.get('format'), track.get('commercial_name'),
+                                               track.get('bit_rate'), track.get('channel_s'), track.get('language')))
+            elif track_type == 'Text':
+                tracks.text.append(TextTrack(track.get('format'), track.get('language')))
+        return tracks
+
+    def audio_summary(self):
+        # "MLP FBA 8ch en, AC-3 6ch en", None without audio tracks
+        return ', '.join(track.summary() for track in self.audio) or None
+
+    def audio_languages(self):
+        # Distinct languages in track order, "en, fr"
+        return ', '.join(dict.fromkeys(track.language for track in self.audio if track.language)) or None
+
+    def subtitle_languages(self):
+        return ', '.join(dict.fromkeys(track.language for track in self.text if track.language)) or None
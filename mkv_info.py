@@ -1,3 +1,6 @@
+import ast
+import asyncio
+import gzip
 import json
 import os
 import shutil
@@ -6,25 +9,50 @@ import traceback
 from pathlib import Path
 
 from globals import dict_to_delimited_string, format_duration, format_file_size, convert_bitrate_to_mbps
+from media_info_cache import get_cache, partial_content_hash, set_mediainfo_json_source_path
+from media_tracks import MediaTracks
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-def get_mediainfo(file_path):
+# Command line of the mediainfo CLI, e.g. ['C:/Tools/MediaInfo/mediainfo.exe'] when it isn't on the PATH
+mediainfo_cmd = ['mediainfo']
+default_mediainfo_concurrency = 4
+default_mediainfo_timeout = 300
+default_mediainfo_retries = 2
+
+
+def run_mediainfo(file_path, cmd=None):
+    # Run the mediainfo command and return its raw JSON output. mediainfo writes UTF-8 whatever the locale, decoded
+    # the way run_mediainfo_async does it rather than with the locale encoding text=True would use (cp1252 on Windows)
+    result = subprocess.run(
+        [*(cmd or mediainfo_cmd), '--Output=JSON', file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    # Check for errors
+    if result.returncode != 0:
+        print(f'Error: {result.stderr.decode("utf-8", "replace").strip()}')
+        return None
+    return result.stdout.decode('utf-8')
+
+
+def get_mediainfo(file_path, cache=None):
     try:
-        # Run the mediainfo command and capture the output
-        result = subprocess.run(
-            ['mediainfo', '--Output=JSON', file_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-
-        # Check for errors
-        if result.returncode != 0:
-            print(f"Error: {result.stderr}")
+        if cache:
+            raw_output = cache.get_or_parse(file_path, 'JSON', run_mediainfo)
+        else:
+            raw_output = run_mediainfo(file_path)
+        if raw_output is None:
             return None
 
         # Parse the JSON output
-        media_info = json.loads(result.stdout)
+        media_info = json.loads(raw_output)
+        if cache:
+            set_mediainfo_json_source_path(media_info, file_path)
         return media_info
     except Exception as ex:
         print(f'Exception while getting media_info for {file_path}')
@@ -32,23 +60,147 @@ def get_mediainfo(file_path):
         return None
 
 
+async def run_mediainfo_async(file_path, cmd=None, timeout=default_mediainfo_timeout,
+                              retries=default_mediainfo_retries):
+    # Async run_mediainfo: a run that exceeds timeout seconds is killed, failed runs are retried with a short backoff
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        process = await asyncio.create_subprocess_exec(*(cmd or mediainfo_cmd), '--Output=JSON', file_path,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            print(f'mediainfo timed out after {timeout}s on {file_path} (attempt {attempt + 1}/{retries + 1})')
+            continue
+        if process.returncode == 0:
+            return stdout.decode('utf-8')
+        print(f'Error: {stderr.decode("utf-8", "replace").strip()} (attempt {attempt + 1}/{retries + 1})')
+    return None
+
+
+def lookup_cached_mediainfo(cache, file_path):
+    content_key = partial_content_hash(file_path, cache.sample_bytes)
+    return content_key, cache.get(content_key, 'JSON')
+
+
+async def get_mediainfo_async(file_path, cache=None, cmd=None, timeout=default_mediainfo_timeout,
+                              retries=default_mediainfo_retries):
+    try:
+        content_key = None
+        if cache:
+            # Hashing reads from the disk and the cache is SQLite, neither runs on the event loop thread
+            content_key, raw_output = await asyncio.to_thread(lookup_cached_mediainfo, cache, file_path)
+            if raw_output is not None:
+                return set_mediainfo_json_source_path(json.loads(raw_output), file_path)
+        raw_output = await run_mediainfo_async(file_path, cmd, timeout, retries)
+        if raw_output is None:
+            return None
+        if cache:
+            await asyncio.to_thread(cache.put, content_key, 'JSON', raw_output)
+        return json.loads(raw_output)
+    except Exception as ex:
+        print(f'Exception while getting media_info for {file_path}')
+        traceback.print_exc();
+        return None
+
+
+async def dump_media_info_async(paths, media_info_json_dump_file_path, cache=None,
+                                concurrency=default_mediainfo_concurrency, cmd=None,
+                                timeout=default_mediainfo_timeout, retries=default_mediainfo_retries):
+    # Keep up to concurrency mediainfo processes running. Results are appended to a .partial file as they complete,
+    # remembering the offset of every line, then copied into the dump in path order so the output doesn't depend on
+    # completion order. Returns the number of files dumped and the paths that failed.
+    partial_file_path = f'{media_info_json_dump_file_path}.partial'
+    semaphore = asyncio.Semaphore(concurrency)
+    offsets = {}
+    error_list = []
+
+    with open(partial_file_path, 'wb') as partial_file:
+        async def dump(seq, path):
+            async with semaphore:
+                media_info = await get_mediainfo_async(path, cache, cmd, timeout, retries)
+            if media_info:
+                offsets[seq] = partial_file.tell()
+                partial_file.write(media_info_dump_line(media_info).encode('utf-8'))
+                print(f'[{len(offsets)}] Dumped media info for {path}')
+            else:
+                print(f'Got empty media info for {path}')
+                error_list.append(path)
+
+        await asyncio.gather(*(dump(seq, str(path)) for seq, path in enumerate(paths)))
+
+    with open(partial_file_path, 'rb') as partial_file, \
+            open_media_info_dump(media_info_json_dump_file_path, 'w') as media_info_json_dump_file:
+        for seq in sorted(offsets):
+            partial_file.seek(offsets[seq])
+            media_info_json_dump_file.write(partial_file.readline().decode('utf-8'))
+    os.remove(partial_file_path)
+    return len(offsets), sorted(error_list)
+
+
+def open_media_info_dump(file_path, mode='r'):
+    # Compression follows the file suffix: .gz is gzip, .zst is zstd, anything else is plain text
+    suffix = Path(file_path).suffix.lower()
+    if suffix == '.gz':
+        return gzip.open(file_path, mode + 't', encoding='utf-8')
+    if suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError(f'The zstandard package is required to open {file_path}')
+        return zstandard.open(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode)
+
+
+def media_info_dump_line(media_info):
+    # One compact JSON document per line (JSON Lines), ensure_ascii keeps the file readable in any encoding
+    return json.dumps(media_info, separators=(',', ':')) + '\n'
+
+
+def write_media_info_dump_line(media_info_json_dump_file, media_info):
+    media_info_json_dump_file.write(media_info_dump_line(media_info))
+
+
+def parse_media_info_dump_line(line):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        # Dumps written before the JSON Lines format hold the Python repr of the dict, never eval() those
+        return ast.literal_eval(line)
+
+
+def read_media_info_dump(media_info_json_dump_file_path):
+    # Generator over the dump, only one line is held in memory at a time
+    with open_media_info_dump(media_info_json_dump_file_path) as media_info_json_dump_file:
+        for line_number, line in enumerate(media_info_json_dump_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                media_info = parse_media_info_dump_line(line)
+            except (ValueError, SyntaxError):
+                print(f'Skipping unparsable line {line_number} in {media_info_json_dump_file_path}')
+                traceback.print_exc();
+                continue
+            if media_info:
+                yield media_info
+
+
 def extract_and_write_media_info(media_info_json_dump_input_file_path, media_info_output_file_path):
     with open(media_info_output_file_path, 'w') as media_info_output_file:
         print('Writing sanitised media_info to', media_info_output_file_path)
-        with open(media_info_json_dump_input_file_path, 'r') as media_info_json_dump_file:
-            for media_info in media_info_json_dump_file:
-                try:
-                    media_info = eval(media_info.strip())
-                    if not media_info:
-                        continue
-                    final_media_info = extract_fields_from_media_info(media_info)
-                    if final_media_info:
-                        media_info_output_file.write(dict_to_delimited_string(final_media_info, '#'))
-                        media_info_output_file.write('\n')
-                except Exception as ex:
-                    print(f'Exception while writing sanitised media_info from {media_info_json_dump_input_file_path}')
-                    print(media_info)
-                    traceback.print_exc();
+        for media_info in read_media_info_dump(media_info_json_dump_input_file_path):
+            try:
+                final_media_info = extract_fields_from_media_info(media_info)
+                if final_media_info:
+                    media_info_output_file.write(dict_to_delimited_string(final_media_info, '#'))
+                    media_info_output_file.write('\n')
+            except Exception as ex:
+                print(f'Exception while writing sanitised media_info from {media_info_json_dump_input_file_path}')
+                print(media_info)
+                traceback.print_exc();
         print('Wrote sanitised media_info to', media_info_output_file_path)
 
 
@@ -59,47 +211,58 @@ def extract_fields_from_media_info(media_info):
     # print(media_info)
     # Extract user supplied file name
 
+    # The general and video track in one pass, the _final.txt fields don't use the audio and text tracks
+    tracks = MediaTracks.from_mediainfo_json(media_info, track_types={'General', 'Video'})
+
     # Extract general track information
-    general_track = next((track for track in media_info['media']['track'] if track['@type'] == 'General'), None)
+    general_track = tracks.general
     if general_track:
-        duration = general_track.get('Duration')
+        duration = general_track.duration
         media_details["Duration"] = format_duration(duration) if duration else None
-        file_size = general_track.get('FileSize')
+        file_size = general_track.file_size
         media_details["File_size"] = format_file_size(int(file_size)) if file_size else None
-        media_details["OverallBitRate"] = convert_bitrate_to_mbps(general_track.get('OverallBitRate'))
+        media_details["OverallBitRate"] = convert_bitrate_to_mbps(general_track.overall_bit_rate)
 
     # Extract video track information
-    video_track = next((track for track in media_info['media']['track'] if track['@type'] == 'Video'), None)
+    video_track = tracks.video
     if video_track:
-        media_details["Video_Codec"] = video_track.get('Format')
+        media_details["Video_Codec"] = video_track.format
         if media_details["Video_Codec"] not in ['HEVC']:
             return None
-        video_bitrate = video_track.get('BitRate')
-        media_details["Video_Bit_Rate"] = convert_bitrate_to_mbps(video_bitrate)
-        media_details["FrameRate"] = video_track.get('FrameRate')
-        media_details["HDR_Format"] = video_track.get('HDR_Format')
-        media_details["MasteringDisplay_ColorPrimaries"] = video_track.get('MasteringDisplay_ColorPrimaries')
-        media_details["MasteringDisplay_Luminance"] = video_track.get('MasteringDisplay_Luminance')
-        val = str(video_track.get('MaxFALL'))
+        media_details["Video_Bit_Rate"] = convert_bitrate_to_mbps(video_track.bit_rate)
+        media_details["FrameRate"] = video_track.frame_rate
+        media_details["HDR_Format"] = video_track.hdr_format
+        media_details["MasteringDisplay_ColorPrimaries"] = video_track.mastering_display_color_primaries
+        media_details["MasteringDisplay_Luminance"] = video_track.mastering_display_luminance
+        val = str(video_track.max_fall)
         media_details["MaxFALL"] = val.replace("cd/m2", "").strip()
-        val = str(video_track.get('MaxCLL'))
+        val = str(video_track.max_cll)
         media_details["MaxCLL"] = val.replace("cd/m2", "").strip()
 
-    # Extract audio track information
-    # audio_track = next((track for track in media_info['media']['track'] if track['@type'] == 'Audio'), None)
-    # if audio_track:
-    #     audio_bitrate = audio_track.get('BitRate')
-    #     media_details["Audio bit rate"] = convert_bitrate_to_kbps(audio_bitrate)
-    #     media_details["Audio format"] = audio_track.get('Format')
+    # Audio and subtitle tracks are in tracks.audio and tracks.text (summarized in the catalogue by
+    # import_media_info_into_db_), they stay out of the _final.txt columns the dump importer reads
 
     return media_details
 
 
+def report_media_info_dump(media_info_json_dump_file_path, file_count, error_list, cache):
+    print(f"Dumped media info for {file_count} file(s) to {media_info_json_dump_file_path}")
+    print('Error list', error_list)
+    print('Error count', len(error_list))
+    if cache:
+        print('Media info cache', cache.stats())
+
+
 def main():
     dir_path = 'F:\\'
     media_info_file_name = 'WD8A_10TB'
+    # JSON Lines dump, use a .gz or .zst suffix to compress it. Legacy repr dumps are still readable
     media_info_json_dump_file_path = f'D:/MakeMKV/media_info/{media_info_file_name}.txt'
     media_info_final_dump_file_path = f'D:/MakeMKV/media_info/{media_info_file_name}_final.txt'
+    # Raw mediainfo output cache shared with import_media_info_into_db_, set to None to always parse
+    media_info_cache_path = 'D:/MakeMKV/media_info/media_info_cache.db'
+    # mediainfo processes running at once, 1 keeps the serial loop
+    mediainfo_concurrency = default_mediainfo_concurrency
     option = 3
 
     if option not in [1, 2, 3]:
@@ -123,29 +286,37 @@ def main():
             shutil.copy2(media_info_json_dump_file_path, media_info_json_dump_backup_file_path)
             print(f"Backup created at {media_info_json_dump_backup_file_path}")
 
-        # Create media_info json dump file
-        with open(media_info_json_dump_file_path, 'w') as media_info_json_dump_file:
-            paths = directory_path.glob(pattern, )
-            if not paths:
-                print(f"Found no files in {dir_path} matching pattern {pattern}")
-                return
-            print(f"Dumping media info to {media_info_json_dump_file_path}")
-            file_count = 1
-            error_list = list()
-            for path in paths:
-                path = str(path)
-                print(f'[{file_count}] Dumping media info for {path}')
-                media_info = get_mediainfo(path)
-                if media_info:
-                    media_info_json_dump_file.write(str(media_info) + '\n')
-                    print(f'[{file_count}] Dumped media info for {path}')
-                    file_count += 1
-                else:
-                    print(f'[{file_count}] Got empty media info for {path}')
-                    error_list.append(path)
-            print(f"Dumped media info for {file_count} file(s) to {media_info_json_dump_file_path}")
-            print('Error list', error_list)
-            print('Error count', len(error_list))
+        cache = get_cache(media_info_cache_path)
+        if mediainfo_concurrency > 1:
+            # Sorted so the dump has the same order however the extractions interleave
+            paths = sorted(directory_path.glob(pattern))
+            print(f"Dumping media info for {len(paths)} file(s) to {media_info_json_dump_file_path}")
+            file_count, error_list = asyncio.run(dump_media_info_async(paths, media_info_json_dump_file_path, cache,
+                                                                       mediainfo_concurrency))
+        else:
+            # Create media_info json dump file
+            with open_media_info_dump(media_info_json_dump_file_path, 'w') as media_info_json_dump_file:
+                paths = directory_path.glob(pattern, )
+                if not paths:
+                    print(f"Found no files in {dir_path} matching pattern {pattern}")
+                    return
+                print(f"Dumping media info to {media_info_json_dump_file_path}")
+                file_count = 1
+                error_list = list()
+                for path in paths:
+                    path = str(path)
+                    print(f'[{file_count}] Dumping media info for {path}')
+                    media_info = get_mediainfo(path, cache)
+                    if media_info:
+                        write_media_info_dump_line(media_info_json_dump_file, media_info)
+                        print(f'[{file_count}] Dumped media info for {path}')
+                        file_count += 1
+                    else:
+                        print(f'[{file_count}] Got empty media info for {path}')
+                        error_list.append(path)
+            # file_count is the number the next dumped file would get
+            file_count -= 1
+        report_media_info_dump(media_info_json_dump_file_path, file_count, error_list, cache)
     # Create media_info final dump file from media info json dump file
     if option in [2, 3]:
         if not os.path.isfile(media_info_json_dump_file_path):
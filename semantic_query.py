@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+# Query side of /semantic/ that doesn't need torch or faiss: the query embedding cache and the fusion of the semantic
+# ranking of catalogue rows with the full-text ranking of dump rows
+
+default_embedding_cache_size = 512
+# Reciprocal rank fusion constant, 60 is the value from the original RRF paper and works without tuning
+rrf_k = 60
+
+
+class QueryEmbeddingCache:
+    """LRU cache of query embeddings, keyed by the exact query text unless the tokenizer lowercases it anyway."""
+
+    def __init__(self, max_entries=default_embedding_cache_size, lowercase=False):
+        self.max_entries = max_entries
+        self.lowercase = lowercase
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, query):
+        # Queries the model can't tell apart share an entry, nothing else does
+        return query.lower() if self.lowercase else query
+
+    def get(self, query):
+        key = self.key(query)
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query, embedding):
+        key = self.key(query)
+        with self.lock:
+            self.entries[key] = embedding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                    'misses': self.misses}
+
+
+def first_ranks(ranking):
+    # {key: rank} of a ranking that may repeat keys, each key at its first position in the full list
+    ranks = {}
+    for rank, key in enumerate(ranking, 1):
+        ranks.setdefault(key, rank)
+    return ranks
+
+
+def reciprocal_rank_fusion(*rankings):
+    # rankings: lists of keys, best first. A key counts once per ranking, at its first position, and the positions
+    # are those of the whole list. Returns [(key, score)] ordered by the fused score.
+    scores = {}
+    for ranking in rankings:
+        for key, rank in first_ranks(ranking).items():
+            scores[key] = scores.get(key, 0) + 1 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def catalogue_keys_by_name(conn, volume_names, table_name='media_info'):
+    # {(volume, file_name): (volume, relative_path)} of the names that identify exactly one catalogue row. A name
+    # found in several folders of a volume is ambiguous, dump rows with it aren't matched to any catalogue row.
+    volume_names = list(dict.fromkeys(volume_names))
+    if not volume_names:
+        return {}
+    paths = {}
+    where_clause = ' OR '.join(['(volume = ? AND file_name = ?)'] * len(volume_names))
+    for volume, file_name, relative_path in conn.execute(
+            f'SELECT volume, file_name, relative_path FROM {table_name} WHERE {where_clause}',
+            [value for volume_name in volume_names for value in volume_name]):
+        paths.setdefault((volume, file_name), []).append(relative_path)
+    return {volume_name: (volume_name[0], relative_paths[0])
+            for volume_name, relative_paths in paths.items() if len(relative_paths) == 1}
+
+
+def hybrid_rows(semantic_rows, text_rows, catalogue_keys, k):
+    # Fuse the semantic ranking of catalogue rows with the full-text ranking of dump rows. Catalogue rows are keyed by
+    # (volume, relative_path), a dump row takes the key of the catalogue row its (volume, title) maps to in
+    # catalogue_keys and otherwise stays its own entry, keyed by its dump id.
+    semantic_keys = [(row['volume'], row['relative_path']) for row in semantic_rows]
+    text_keys = [catalogue_keys.get((row['volume'], row['title']), ('dump', row['id'])) for row in text_rows]
+    semantic_ranks = first_ranks(semantic_keys)
+    text_ranks = first_ranks(text_keys)
+    semantic_by_key = dict(zip(reversed(semantic_keys), reversed(semantic_rows)))
+    text_by_key = dict(zip(reversed(text_keys), reversed(text_rows)))
+    fused_rows = []
+    for key, score in reciprocal_rank_fusion(semantic_keys, text_keys)[:k]:
+        row = semantic_by_key.get(key) or text_by_key[key]
+        fused_rows.append({'key': list(key), 'file_name': row.get('file_name') or row.get('title'),
+                           'score': round(score, 6), 'semantic_rank': semantic_ranks.get(key),
+                           'text_rank': text_ranks.get(key), 'row': row})
+    return fused_rows
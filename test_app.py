@@ -0,0 +1,182 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app
+import media_info_search
+from import_media_info_from_dump_file_into_db import import_media_info_into_db
+from import_media_info_into_db_ import Base, MediaInfoModel, bulk_save_or_update, upgrade_schema
+from semantic_query import QueryEmbeddingCache
+
+dump_lines = [
+    'Blade Runner 2049#02:43:48#78.09 GB#68.21 Mbps#HEVC#65000.00 Kbps#23.976#SMPTE ST 2086#Display P3#'
+    'min: 0.0050 cd/m2, max: 4000 cd/m2#400 cd/m2#1000 cd/m2',
+    'Dune Part Two#02:46:10#80.12 GB#69.02 Mbps#HEVC#66000.00 Kbps#23.976#Dolby Vision / SMPTE ST 2086#BT.2020#'
+    'min: 0.0001 cd/m2, max: 1000 cd/m2#250 cd/m2#900 cd/m2',
+    'Heat#02:50:27#60.00 GB#47.00 Mbps#HEVC#45000.00 Kbps#23.976#SMPTE ST 2086#Display P3#'
+    'min: 0.0050 cd/m2, max: 1000 cd/m2#None#None',
+]
+catalogue_rows = [
+    ('Blade_Runner_2049.mkv', 'SMPTE ST 2086', 'Display P3', 4000, 400, 1000),
+    ('Dune_Part_Two.mkv', 'Dolby Vision, Version 1.0, dvhe.08.06 / SMPTE ST 2086', 'BT.2020', 1000, 250, 900),
+    ('Heat.mkv', 'SMPTE ST 2086', 'Display P3', 1000, None, None),
+]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Real databases written by the two importers, the app opens them through its read-only pools
+    (tmp_path / 'WD8A_10TB_final.txt').write_text('\n'.join(dump_lines) + '\n', encoding='utf-8')
+    import_media_info_into_db(str(tmp_path), '_final.txt', '#', str(tmp_path / 'media_info.db'), 'media_info',
+                              workers=1)
+    engine = create_engine(f'sqlite:///{(tmp_path / "media_info_new.db").as_posix()}')
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    session = sessionmaker(bind=engine)()
+    bulk_save_or_update(session, [
+        MediaInfoModel(volume='WD8A_10TB', file_name=file_name, relative_path=f'Movies/{file_name}',
+                       video_format='HEVC', frame_rate=23.976, file_size=60_000_000_000, video_bit_rate=65_000_000,
+                       hdr_format=hdr_format, mastering_display_color_primaries=primaries, max_mdl=max_mdl,
+                       max_fall=max_fall, max_cll=max_cll, full_json='{}')
+        for file_name, hdr_format, primaries, max_mdl, max_fall, max_cll in catalogue_rows])
+    session.close()
+    engine.dispose()
+
+    monkeypatch.setattr(app, 'db_path', str(tmp_path / 'media_info.db'))
+    monkeypatch.setattr(app, 'catalogue_db_path', str(tmp_path / 'media_info_new.db'))
+    monkeypatch.setattr(app, 'items_per_page', 2)
+    media_info_search.count_cache.clear()
+    with TestClient(app.app) as client:
+        yield client
+
+
+def test_search_pages_and_formats_rows(client):
+    first = client.get('/search/', params={'query': 'SMPTE'})
+    assert first.status_code == 200
+    assert 'page=2' in first.text
+    second = client.get('/search/', params={'query': 'SMPTE', 'page': 2})
+    # Pages are in rank order, together they hold every match once
+    for title in ('Blade Runner 2049', 'Dune Part Two', 'Heat'):
+        assert (title in first.text) != (title in second.text)
+    assert '78.09 GB' in first.text + second.text
+
+
+def test_search_keyset_mode(client):
+    response = client.get('/search/', params={'query': 'SMPTE', 'mode': 'keyset'})
+    assert response.status_code == 200
+    assert '3 result(s)' in response.text
+    assert 'after=2' in response.text
+    response = client.get('/search/', params={'query': 'SMPTE', 'after': 2})
+    assert 'Heat' in response.text and 'Blade Runner' not in response.text
+
+
+def test_query_filters_and_facets(client):
+    response = client.get('/query/', params={'hdr_format': 'SMPTE', 'min_max_mdl': 1000,
+                                             'mastering_display_color_primaries': 'Display P3', 'sort': 'max_mdl'})
+    assert response.status_code == 200
+    body = response.json()
+    assert body['total'] == 2
+    assert [row['file_name'] for row in body['rows']] == ['Blade_Runner_2049.mkv', 'Heat.mkv']
+    assert sorted((facet['value'], facet['count']) for facet in body['facets']['max_mdl']) == [(1000, 1), (4000, 1)]
+
+    body = client.get('/query/', params={'min_max_cll': 950}).json()
+    assert [row['file_name'] for row in body['rows']] == ['Blade_Runner_2049.mkv']
+
+
+def test_semantic_is_unavailable_without_the_model(client, monkeypatch):
+    monkeypatch.setattr(app, 'semantic_search', None)
+    assert client.get('/semantic/', params={'query': 'space'}).status_code == 503
+
+
+class FakeSemanticSearch:
+    # Stands in for media_info_semantic.SemanticSearch, the vector search returns the catalogue ids it was given
+    def __init__(self, result_ids):
+        self.embedding_cache = QueryEmbeddingCache(4)
+        self.result_ids = result_ids
+        self.encoded = []
+
+    def encode(self, query):
+        self.encoded.append(query)
+        return [float(len(query))]
+
+    def search(self, query_embedding, k):
+        return [(row_id, 0.1 * rank) for rank, row_id in enumerate(self.result_ids[:k])]
+
+
+def lookup_result_rows(conn, results):
+    columns = ('id', 'volume', 'relative_path', 'file_name')
+    rows = {row[0]: dict(zip(columns, row)) for row in conn.execute(f'SELECT {", ".join(columns)} FROM media_info')}
+    return [dict(rows[row_id], distance=distance) for row_id, distance in results if row_id in rows]
+
+
+@pytest.fixture
+def semantic_search(client, monkeypatch):
+    monkeypatch.setattr(app, 'media_info_semantic', SimpleNamespace(lookup_result_rows=lookup_result_rows))
+    search = FakeSemanticSearch([1, 2, 3])
+    monkeypatch.setattr(app, 'semantic_search', search)
+    return search
+
+
+def test_semantic_caches_the_query_embedding_by_exact_text(client, semantic_search):
+    first = client.get('/semantic/', params={'query': 'HDR', 'k': 2}).json()
+    second = client.get('/semantic/', params={'query': 'HDR', 'k': 3}).json()
+    third = client.get('/semantic/', params={'query': 'hdr', 'k': 2}).json()
+    assert (first['cached'], second['cached'], third['cached']) == (False, True, False)
+    assert semantic_search.encoded == ['HDR', 'hdr']
+    assert [row['file_name'] for row in second['results']] == ['Blade_Runner_2049.mkv', 'Dune_Part_Two.mkv',
+                                                               'Heat.mkv']
+    assert third['cache'] == {'entries': 2, 'max_entries': 4, 'hits': 1, 'misses': 2}
+
+
+def test_semantic_rejects_an_unknown_mode(client, semantic_search):
+    assert client.get('/semantic/', params={'query': 'HDR', 'mode': 'hybird'}).status_code == 422
+
+
+def test_hybrid_fuses_rows_sharing_a_file_name_by_identity(client, semantic_search, tmp_path):
+    # Two catalogue titles named title_t00.mkv in different folders, and two dump rows of that name the catalogue
+    # can't tell apart, next to Sicario.mkv which both rankings find
+    with sqlite3.connect(tmp_path / 'media_info_new.db') as conn:
+        conn.executemany("INSERT INTO media_info (volume, file_name, relative_path, full_json) "
+                         "VALUES ('WD8A_10TB', ?, ?, '{}')",
+                         [('title_t00.mkv', 'Movies/A/title_t00.mkv'), ('title_t00.mkv', 'Movies/B/title_t00.mkv'),
+                          ('Sicario.mkv', 'Movies/Sicario.mkv')])
+        catalogue_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM media_info WHERE hdr_format IS NULL ORDER BY id")]
+    conn.close()
+    with sqlite3.connect(tmp_path / 'media_info.db') as conn:
+        conn.executemany("INSERT INTO media_info (volume, title, hdr_format) VALUES ('WD8A_10TB', ?, 'HLG')",
+                         [('title_t00.mkv',), ('title_t00.mkv',), ('Sicario.mkv',)])
+        dump_ids = [row[0] for row in conn.execute("SELECT id FROM media_info WHERE hdr_format = 'HLG' ORDER BY id")]
+    conn.close()
+    semantic_search.result_ids = catalogue_ids
+
+    body = client.get('/semantic/', params={'query': 'HLG', 'mode': 'hybrid'}).json()
+    results = {tuple(row['key']): row for row in body['results']}
+    assert set(results) == {('WD8A_10TB', 'Movies/A/title_t00.mkv'), ('WD8A_10TB', 'Movies/B/title_t00.mkv'),
+                            ('WD8A_10TB', 'Movies/Sicario.mkv'), ('dump', dump_ids[0]), ('dump', dump_ids[1])}
+    assert results[('WD8A_10TB', 'Movies/A/title_t00.mkv')]['semantic_rank'] == 1
+    assert results[('WD8A_10TB', 'Movies/B/title_t00.mkv')]['semantic_rank'] == 2
+    sicario = results[('WD8A_10TB', 'Movies/Sicario.mkv')]
+    assert sicario['semantic_rank'] == 3 and sicario['text_rank'] is not None
+    assert body['results'][0]['key'] == ['WD8A_10TB', 'Movies/Sicario.mkv']
+    assert sorted(row['text_rank'] for row in body['results'] if row['text_rank']) == [1, 2, 3]
+
+
+def test_startup_on_fresh_databases_answers_searches_with_no_results(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'db_path', str(tmp_path / 'media_info.db'))
+    monkeypatch.setattr(app, 'catalogue_db_path', str(tmp_path / 'media_info_new.db'))
+    media_info_search.count_cache.clear()
+    with TestClient(app.app) as client:
+        response = client.get('/search/', params={'query': 'SMPTE'})
+        assert response.status_code == 200
+        assert 'Blade Runner' not in response.text
+
+
+def test_shutdown_after_a_failed_startup(monkeypatch):
+    for name in ('db_pool', 'catalogue_db_pool', 'db_executor', 'encode_executor'):
+        monkeypatch.setattr(app, name, None)
+    app.close_database()
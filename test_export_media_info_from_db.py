@@ -0,0 +1,69 @@
+import json
+import sqlite3
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from export_media_info_from_db import export_media_info
+from globals import media_info_table_columns, media_info_table_columns_def
+from import_media_info_from_dump_file_into_db import create_media_info_table
+from media_info_search import format_media_info_row
+
+declared_arrow_types = {'INTEGER': pa.int64(), 'REAL': pa.float64(), 'TEXT': pa.string(),
+                        'VARCHAR(20)': pa.string(), 'VARCHAR(1000)': pa.string(), 'VARCHAR(4000)': pa.string()}
+
+
+def dump_database(db_file, rows):
+    conn = sqlite3.connect(db_file)
+    create_media_info_table(conn.cursor(), 'media_info')
+    with conn:
+        conn.executemany(f'INSERT INTO media_info (volume, {", ".join(media_info_table_columns)}) '
+                         f'VALUES ({", ".join("?" * (len(media_info_table_columns) + 1))})', rows)
+    conn.close()
+
+
+def test_parquet_schema_is_the_declared_schema(tmp_path):
+    db_file = str(tmp_path / 'media_info.db')
+    # The first chunk has no value at all in the numeric columns, later ones hold values of the wrong type
+    dump_database(db_file, [('WD8A', 'Heat', None, None, None, 'HEVC', None, None, None, None, None, None, None)] * 3 +
+                  [('WD8A', 1917, 8667000, '78.09', 68_210_000, 'HEVC', 65_000_000, '23.976', 'SMPTE ST 2086',
+                    'Display P3', 'min: 0.0050 cd/m2, max: 4000 cd/m2', '400 cd/m2', 1000)])
+    output_file = str(tmp_path / 'media_info.parquet')
+    assert export_media_info(db_file, 'media_info', output_file, 'parquet', chunk_size=2, all_columns=True) == 4
+
+    table = pq.read_table(output_file)
+    expected = [('id', pa.int64()), ('volume', pa.string())] + [
+        (column, declared_arrow_types[column_type]) for column, column_type in media_info_table_columns_def]
+    assert [(field.name, field.type) for field in table.schema] == expected
+    last_row = table.to_pylist()[-1]
+    assert last_row['title'] == '1917'
+    assert last_row['file_size'] == 78
+    assert last_row['video_framerate'] == 23.976
+    assert last_row['maxfall'] is None
+    assert last_row['maxcll'] == 1000
+
+
+def test_empty_export_writes_the_schema(tmp_path):
+    db_file = str(tmp_path / 'media_info.db')
+    dump_database(db_file, [])
+    output_file = str(tmp_path / 'media_info.parquet')
+    assert export_media_info(db_file, 'media_info', output_file, 'parquet', all_columns=True) == 0
+    assert pq.read_schema(output_file).field('duration').type == pa.int64()
+
+
+def test_formatted_export_matches_the_search_formatting(tmp_path):
+    db_file = str(tmp_path / 'media_info.db')
+    dump_database(db_file, [('WD8A', 'Heat', None, None, None, 'HEVC', None, None, None, None, None, None, None),
+                            ('WD8A', '1917', 8667000, 78_090_000_000, 68_210_000, 'HEVC', 65_000_000, 23.976,
+                             'SMPTE ST 2086', 'Display P3', 'min: 0.0050 cd/m2, max: 4000 cd/m2', 400, 1000),
+                            ('WD8B', 'Dune', '7263.104', '1024', 0, 'AVC', '48000000', 24.0, None, None, None, None,
+                             None)] * 3)
+    output_file = str(tmp_path / 'media_info.jsonl')
+    assert export_media_info(db_file, 'media_info', output_file, 'jsonl', chunk_size=4, all_columns=True,
+                             formatted=True) == 9
+
+    conn = sqlite3.connect(db_file)
+    expected = [list(row[:2] + format_media_info_row(row[2:])) for row in conn.execute('SELECT * FROM media_info')]
+    conn.close()
+    with open(output_file, encoding='utf-8') as jsonl_file:
+        assert [list(json.loads(line).values()) for line in jsonl_file] == expected
@@ -0,0 +1,191 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+from tqdm import tqdm
+
+import find_diff
+from find_diff import compare_catalogue, copy_files, copy_large_file, open_catalogue, resume_offset
+from globals import relative_volume_path
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Chunks and the resume check window scaled down to the size of the test files
+    monkeypatch.setattr(find_diff, 'copy_chunk_size', 64 * 1024)
+    monkeypatch.setattr(find_diff, 'resume_check_size', 4 * 1024)
+
+
+def write_file(path, data, mtime_ns=None):
+    path.write_bytes(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.charged = []
+        self.lock = threading.Lock()
+
+    def consume(self, byte_count):
+        with self.lock:
+            self.charged.append(byte_count)
+
+
+source_data = os.urandom(200 * 1024 + 123)
+
+
+def test_resume_offset_keeps_a_matching_prefix(tmp_path, small_chunks):
+    write_file(tmp_path / 'source.mkv', source_data, 1_000_000_000)
+    assert resume_offset(tmp_path / 'source.mkv', tmp_path / 'missing.mkv', len(source_data)) == 0
+    write_file(tmp_path / 'dest.mkv', source_data[:100_000], 2_000_000_000)
+    assert resume_offset(tmp_path / 'source.mkv', tmp_path / 'dest.mkv', len(source_data)) == 100_000
+
+
+def test_resume_offset_only_checks_the_head_and_tail_windows(tmp_path, small_chunks):
+    # The documented limitation: damage between the two windows isn't detected
+    write_file(tmp_path / 'source.mkv', source_data, 1_000_000_000)
+    damaged = source_data[:50_000] + bytes([source_data[50_000] ^ 1]) + source_data[50_001:100_000]
+    write_file(tmp_path / 'dest.mkv', damaged, 2_000_000_000)
+    assert resume_offset(tmp_path / 'source.mkv', tmp_path / 'dest.mkv', len(source_data)) == 100_000
+
+
+@pytest.mark.parametrize('dest_data, dest_mtime_ns', [
+    (b'', 2_000_000_000),
+    # Tail of the prefix differs from the source
+    (source_data[:99_999] + bytes([source_data[99_999] ^ 1]), 2_000_000_000),
+    # Head of the prefix differs from the source, the tail window matches
+    (bytes([source_data[0] ^ 1]) + source_data[1:100_000], 2_000_000_000),
+    # Longer than the source
+    (source_data + b'x', 2_000_000_000),
+    # Source modified after the partial copy was written
+    (source_data[:100_000], 500_000_000),
+])
+def test_resume_offset_restarts_unusable_destinations(tmp_path, small_chunks, dest_data, dest_mtime_ns):
+    write_file(tmp_path / 'source.mkv', source_data, 1_000_000_000)
+    write_file(tmp_path / 'dest.mkv', dest_data, dest_mtime_ns)
+    assert resume_offset(tmp_path / 'source.mkv', tmp_path / 'dest.mkv', len(source_data)) == 0
+
+
+@pytest.mark.parametrize('methods', [['readwrite'], find_diff.zero_copy_methods()])
+def test_resumed_copy_charges_the_limiter_for_the_bytes_copied(tmp_path, small_chunks, monkeypatch, methods):
+    monkeypatch.setattr(find_diff, 'zero_copy_methods', lambda: list(methods))
+    write_file(tmp_path / 'source.mkv', source_data, 1_000_000_000)
+    write_file(tmp_path / 'dest.mkv', source_data[:100_000], 2_000_000_000)
+    limiter = RecordingLimiter()
+    with tqdm(total=len(source_data), file=io.StringIO()) as progress:
+        copy_large_file(str(tmp_path / 'source.mkv'), str(tmp_path / 'dest.mkv'), buffer_size=16 * 1024,
+                        limiter=limiter, progress=progress)
+        assert progress.n == progress.total == len(source_data) - 100_000
+    assert (tmp_path / 'dest.mkv').read_bytes() == source_data
+    assert sum(limiter.charged) == len(source_data) - 100_000
+    if methods == ['readwrite']:
+        assert max(limiter.charged) == 16 * 1024
+
+
+def test_copy_files_progress_covers_resumed_and_new_files(tmp_path, small_chunks, monkeypatch):
+    progress_bars = []
+
+    class RecordingProgress(tqdm):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, file=io.StringIO(), **kwargs)
+            progress_bars.append(self)
+
+    monkeypatch.setattr(find_diff, 'tqdm', RecordingProgress)
+    source_dir, dest_dir = tmp_path / 'source', tmp_path / 'dest'
+    (source_dir / 'Movies').mkdir(parents=True)
+    dest_dir.mkdir()
+    files = [os.path.join('Movies', f'Title_{i}.mkv') for i in range(6)]
+    for i, file in enumerate(files):
+        write_file(source_dir / file, source_data[i:], 1_000_000_000)
+    # Half the files were partly copied before
+    (dest_dir / 'Movies').mkdir()
+    for file in files[::2]:
+        write_file(dest_dir / file, (source_dir / file).read_bytes()[:50_000], 2_000_000_000)
+
+    assert copy_files(files, str(source_dir), str(dest_dir), workers=4) == []
+    resumed_bytes = 3 * 50_000
+    assert progress_bars[0].n == progress_bars[0].total == \
+        sum((source_dir / file).stat().st_size for file in files) - resumed_bytes
+    for file in files:
+        assert (dest_dir / file).read_bytes() == (source_dir / file).read_bytes()
+
+
+def test_file_hashes_updates_the_shared_progress_bar_one_thread_at_a_time(tmp_path, monkeypatch):
+    progress_bars = []
+
+    class SerialProgress(tqdm):
+        # Records updates from several hashing threads running at the same time
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, file=io.StringIO(), **kwargs)
+            self.active = 0
+            self.overlapped = False
+            progress_bars.append(self)
+
+        def update(self, n=1):
+            self.active += 1
+            self.overlapped |= self.active > 1
+            time.sleep(0.001)
+            super().update(n)
+            self.active -= 1
+
+    monkeypatch.setattr(find_diff, 'tqdm', SerialProgress)
+    monkeypatch.setattr(find_diff, 'hash_chunk_size', 16 * 1024)
+    files = {}
+    for i in range(8):
+        write_file(tmp_path / f'Title_{i}.mkv', source_data[i:], 1_000_000_000)
+        files[f'Title_{i}.mkv'] = (len(source_data) - i, 1_000_000_000)
+
+    hashes = find_diff.file_hashes(str(tmp_path), files, sorted(files), workers=4)
+    assert hashes == {file: find_diff.hash_file(str(tmp_path / file)) for file in files}
+    assert progress_bars[0].n == progress_bars[0].total == sum(size for size, _ in files.values())
+    assert not progress_bars[0].overlapped
+
+
+def catalogue_database(db_file, rows):
+    # The media_info columns a catalogue diff reads, rows are (volume, relative_path, file_size)
+    with sqlite3.connect(db_file) as conn:
+        conn.execute('CREATE TABLE media_info (id INTEGER PRIMARY KEY, volume TEXT, file_name TEXT, '
+                     'relative_path TEXT, file_size INTEGER, UNIQUE (volume, relative_path))')
+        conn.executemany('INSERT INTO media_info (volume, file_name, relative_path, file_size) VALUES (?, ?, ?, ?)',
+                         [(volume, relative_path.rsplit('/', 1)[-1], relative_path, size)
+                          for volume, relative_path, size in rows])
+    conn.close()
+
+
+def test_catalogue_diff_against_a_live_directory_keeps_duplicate_base_names_apart(tmp_path):
+    live_dir = tmp_path / 'live'
+    for relative_path, size in (('Movies/A/title_t00.mkv', 10), ('Movies/B/title_t00.mkv', 20),
+                                ('TV/C/title_t00.mkv', 5)):
+        (live_dir / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (live_dir / relative_path).write_bytes(b'\0' * size)
+    root = relative_volume_path(live_dir)
+    catalogue_database(tmp_path / 'media_info.db', [('WD8A', f'{root}/Movies/A/title_t00.mkv', 10),
+                                                    ('WD8A', f'{root}/Movies/B/title_t00.mkv', 25),
+                                                    ('WD8A', f'{root}/Movies/D/title_t00.mkv', 7)])
+
+    conn = open_catalogue(tmp_path / 'media_info.db')
+    differences, sizes = compare_catalogue(conn, 'WD8A', str(live_dir))
+    conn.close()
+    assert differences == {'only_in_dir1': [f'{root}/Movies/D/title_t00.mkv'],
+                           'only_in_dir2': [f'{root}/TV/C/title_t00.mkv'],
+                           'size_mismatch': [f'{root}/Movies/B/title_t00.mkv']}
+    assert sizes['dir1'][f'{root}/Movies/B/title_t00.mkv'] == 25
+    assert sizes['dir2'][f'{root}/Movies/B/title_t00.mkv'] == 20
+
+
+def test_catalogue_diff_between_volumes_keeps_duplicate_base_names_apart(tmp_path):
+    catalogue_database(tmp_path / 'media_info.db', [
+        ('WD8A', 'Movies/A/title_t00.mkv', 10), ('WD8A', 'Movies/B/title_t00.mkv', 20),
+        ('WD8A', 'Movies/C/title_t00.mkv', 30),
+        ('WD2', 'Movies/A/title_t00.mkv', 10), ('WD2', 'Movies/B/title_t00.mkv', 21),
+        ('WD2', 'TV/D/title_t00.mkv', 10)])
+
+    conn = open_catalogue(tmp_path / 'media_info.db')
+    differences, _ = compare_catalogue(conn, 'WD8A', 'WD2')
+    conn.close()
+    assert differences == {'only_in_dir1': ['Movies/C/title_t00.mkv'], 'only_in_dir2': ['TV/D/title_t00.mkv'],
+                           'size_mismatch': ['Movies/B/title_t00.mkv']}
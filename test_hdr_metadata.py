@@ -0,0 +1,84 @@
+import pytest
+
+from hdr_metadata import (MasteringLuminance, MasteringPrimaries, parse_ffmpeg_hdr_metadata, parse_light_level,
+                          parse_mastering_luminance, parse_mastering_primaries)
+
+ffprobe_side_data = ('side_data_type=Mastering display metadata\nred_x=34000/50000\nred_y=16000/50000\n'
+                     'green_x=13250/50000\ngreen_y=34500/50000\nblue_x=7500/50000\nblue_y=3000/50000\n'
+                     'white_point_x=15635/50000\nwhite_point_y=16450/50000\nmin_luminance=50/10000\n'
+                     'max_luminance=40000000/10000\nside_data_type=Content light level metadata\n'
+                     'max_content=1000\nmax_average=400\n')
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('min: 0.0050 cd/m2, max: 4000 cd/m2', MasteringLuminance(0.005, 4000)),
+    ('max: 1000 cd/m2, min: 0.0001 cd/m2', MasteringLuminance(0.0001, 1000)),
+    ('min:0.0001cd/m2 max:1000cd/m2', MasteringLuminance(0.0001, 1000)),
+    ('max: 1000 cd/m2', MasteringLuminance(None, 1000)),
+    ('min: 0.005 cd/m2, max: 1e3 cd/m2', MasteringLuminance(0.005, 1000)),
+    ('', None),
+    ('unknown', None),
+])
+def test_parse_mastering_luminance(text, expected):
+    assert parse_mastering_luminance(text) == expected
+
+
+def test_parse_mastering_primaries_by_name_and_coordinates():
+    assert parse_mastering_primaries('Display P3') == MasteringPrimaries((0.68, 0.32), (0.265, 0.69), (0.15, 0.06),
+                                                                         (0.3127, 0.329), 'Display P3')
+    primaries = parse_mastering_primaries('R: x=0.680000 y=0.320000, G: x=0.265000 y=0.690000, '
+                                          'B: x=0.150000 y=0.060000, White point: x=0.312700 y=0.329000')
+    assert primaries == MasteringPrimaries((0.68, 0.32), (0.265, 0.69), (0.15, 0.06), (0.3127, 0.329))
+    assert parse_mastering_primaries('R: x=0.68 y=0.32') is None
+
+
+@pytest.mark.parametrize('text, expected', [('962 cd/m2', 962), ('962', 962), ('962cd/m2', 962), ('None', None),
+                                            ('1000.5 cd/m2', None), (None, None)])
+def test_parse_light_level(text, expected):
+    assert parse_light_level(text) == expected
+
+
+def test_parse_ffprobe_side_data():
+    metadata = parse_ffmpeg_hdr_metadata(ffprobe_side_data)
+    assert metadata.primaries.red == (0.68, 0.32)
+    assert metadata.primaries.green == (0.265, 0.69)
+    assert metadata.primaries.blue == (0.15, 0.06)
+    assert metadata.white_point == (0.3127, 0.329)
+    assert metadata.luminance == MasteringLuminance(0.005, 4000)
+    assert (metadata.max_cll, metadata.max_fall) == (1000, 400)
+
+
+def test_parse_ffmetadata_display_primaries_in_sei_order():
+    # HEVC SEI lists green, blue, red; CRLF line ends and blanks around the keys are accepted
+    metadata = parse_ffmpeg_hdr_metadata('display_primaries_x=0.265 0.15 0.68\r\n'
+                                         ' display_primaries_y = 0.69 0.06 0.32\r\n'
+                                         'white_point_x=0.3127\r\nwhite_point_y=0.329\r\n'
+                                         'min_luminance=0.005\r\nmax_luminance=1000\r\nMaxFALL=400\r\nMaxCLL=962\r\n')
+    assert metadata.primaries == MasteringPrimaries((0.68, 0.32), (0.265, 0.69), (0.15, 0.06), (0.3127, 0.329))
+    assert metadata.luminance == MasteringLuminance(0.005, 1000)
+    assert (metadata.max_cll, metadata.max_fall) == (962, 400)
+
+
+def test_parse_ffmpeg_keeps_the_white_point_without_primaries():
+    metadata = parse_ffmpeg_hdr_metadata('white_point_x=15635/50000\nwhite_point_y=16450/50000\nred_x=34000/50000\n')
+    assert metadata.primaries is None
+    assert metadata.white_point == (0.3127, 0.329)
+
+
+def test_parse_ffmpeg_skips_malformed_and_unrelated_lines():
+    metadata = parse_ffmpeg_hdr_metadata('TAG:title=min_luminance=5\nmax_luminance=abc\nmin_luminance=1/0\n'
+                                         'display_primaries_x=0.265 0.15\ndisplay_primaries_y=0.69 0.06\n'
+                                         'MaxCLL=\nmax_content=1000\n')
+    assert metadata.primaries is None
+    assert metadata.luminance is None
+    assert metadata.max_cll == 1000
+    assert metadata.max_fall is None
+    assert parse_ffmpeg_hdr_metadata('') == parse_ffmpeg_hdr_metadata('side_data_type=Mastering display metadata')
+
+
+def test_hdr_metadata_dict_and_row_keep_the_white_point_without_primaries():
+    from hdr_plot import hdr_metadata_dict, hdr_metadata_row
+
+    metadata = parse_ffmpeg_hdr_metadata('white_point_x=0.3127\nwhite_point_y=0.329\nMaxCLL=962\n')
+    assert hdr_metadata_dict(metadata) == {'white_point_x': 0.3127, 'white_point_y': 0.329, 'MaxCLL': 962.0}
+    assert hdr_metadata_row(metadata) == [None] * 6 + [0.3127, 0.329, None, None, 962, None]
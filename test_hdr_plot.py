@@ -0,0 +1,36 @@
+import sqlite3
+import sys
+
+from hdr_plot import extract_hdr_metadata_batch, hdr_table_name
+
+# Stands in for ffprobe: fails on fail.mkv, prints a non UTF-8 tag before the side data of latin1.mkv
+stub_ffprobe_script = """
+import os, sys
+name = os.path.basename(sys.argv[-1])
+if name == 'fail.mkv':
+    sys.stderr.write('Invalid data found when processing input')
+    sys.exit(1)
+if name == 'latin1.mkv':
+    sys.stdout.buffer.write(b'TAG:title=Am\\xe9lie\\n')
+sys.stdout.write('side_data_type=Content light level metadata\\nmax_content=1000\\nmax_average=400\\n')
+"""
+
+
+def test_batch_extraction_fails_only_the_broken_files(tmp_path):
+    stub = tmp_path / 'ffprobe_stub.py'
+    stub.write_text(stub_ffprobe_script)
+    library = tmp_path / 'library'
+    library.mkdir()
+    for name in ('ok.mkv', 'fail.mkv', 'latin1.mkv'):
+        (library / name).write_bytes(b'\0' * 16)
+    db_path = str(tmp_path / 'hdr.db')
+
+    extracted, failed_files = extract_hdr_metadata_batch([str(library)], db_path, workers=2,
+                                                         cmd=[sys.executable, str(stub)])
+
+    assert extracted == 2
+    assert failed_files == [str(library / 'fail.mkv')]
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'SELECT file_name, max_cll, max_fall FROM {hdr_table_name} ORDER BY file_name').fetchall()
+    conn.close()
+    assert rows == [('latin1.mkv', 1000, 400), ('ok.mkv', 1000, 400)]
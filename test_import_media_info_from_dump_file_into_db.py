@@ -0,0 +1,110 @@
+import sqlite3
+
+import pytest
+
+import import_media_info_from_dump_file_into_db as dump_import
+from import_media_info_from_dump_file_into_db import import_media_info_into_db
+
+
+def dump_line(title, max_cll=1000):
+    return (f'{title}#02:43:48#78.09 GB#68.21 Mbps#HEVC#65000.00 Kbps#23.976#SMPTE ST 2086#Display P3#'
+            f'min: 0.0050 cd/m2, max: 4000 cd/m2#400 cd/m2#{max_cll} cd/m2')
+
+
+def write_dump_file(directory, volume, titles):
+    (directory / f'{volume}_final.txt').write_text(''.join(dump_line(title) + '\n' for title in titles),
+                                                   encoding='utf-8')
+
+
+def stored_rows(db_file):
+    with sqlite3.connect(db_file) as conn:
+        return conn.execute('SELECT volume, title FROM media_info ORDER BY id').fetchall()
+
+
+def import_dump_files(directory, db_file, **kwargs):
+    return import_media_info_into_db(str(directory), '_final.txt', '#', str(db_file), 'media_info', chunk_size=2,
+                                     workers=1, **kwargs)
+
+
+def test_full_import_reads_every_file_in_chunks(tmp_path):
+    write_dump_file(tmp_path, 'WD8A', ['A', 'B', 'C'])
+    write_dump_file(tmp_path, 'WD2', ['D'])
+    import_dump_files(tmp_path, tmp_path / 'media_info.db')
+    assert stored_rows(tmp_path / 'media_info.db') == [('WD2', 'D'), ('WD8A', 'A'), ('WD8A', 'B'), ('WD8A', 'C')]
+    with sqlite3.connect(tmp_path / 'media_info.db') as conn:
+        assert conn.execute('SELECT duration, file_size, maxcll FROM media_info LIMIT 1').fetchone() == \
+            (9828000, round(78.09 * 1024 ** 3), 1000)
+
+
+def test_file_failing_half_way_leaves_none_of_its_rows(tmp_path, monkeypatch):
+    write_dump_file(tmp_path, 'WD8A', ['A', 'B', 'C'])
+    write_dump_file(tmp_path, 'WD9', ['D'])
+    normalize = dump_import.normalize_media_info_columns
+    calls = []
+
+    def fail_on_second_chunk(df):
+        calls.append(df)
+        if len(calls) == 2:
+            raise ValueError('unreadable chunk')
+        return normalize(df)
+
+    monkeypatch.setattr(dump_import, 'normalize_media_info_columns', fail_on_second_chunk)
+    import_dump_files(tmp_path, tmp_path / 'media_info.db')
+    assert stored_rows(tmp_path / 'media_info.db') == [('WD9', 'D')]
+
+
+def test_interrupted_full_import_keeps_the_previous_import(tmp_path, monkeypatch):
+    write_dump_file(tmp_path, 'WD8A', ['A', 'B'])
+    write_dump_file(tmp_path, 'WD9', ['C'])
+    import_dump_files(tmp_path, tmp_path / 'media_info.db')
+    before = stored_rows(tmp_path / 'media_info.db')
+
+    write_dump_file(tmp_path, 'WD8A', ['X'])
+    state = dump_import.dump_file_state
+
+    def fail_on_second_file(file_path):
+        if file_path.endswith('WD9_final.txt'):
+            raise OSError('volume went away')
+        return state(file_path)
+
+    monkeypatch.setattr(dump_import, 'dump_file_state', fail_on_second_file)
+    with pytest.raises(OSError):
+        import_dump_files(tmp_path, tmp_path / 'media_info.db')
+    assert stored_rows(tmp_path / 'media_info.db') == before
+
+
+def test_unchanged_delta_after_full_import_changes_nothing(tmp_path, capsys):
+    # Repeated titles included, every disc folder has a title_t00.mkv
+    write_dump_file(tmp_path, 'WD8A', ['title_t00.mkv', 'A', 'title_t00.mkv', 'B', 'title_t00.mkv'])
+    write_dump_file(tmp_path, 'WD9', ['A', 'A'])
+    db_file = tmp_path / 'media_info.db'
+    import_dump_files(tmp_path, db_file)
+    before = stored_rows(db_file)
+    with sqlite3.connect(db_file) as conn:
+        # Forget the recorded hashes so the delta import diffs every file instead of skipping it
+        conn.execute('DELETE FROM media_info_import_files')
+    conn.close()
+    capsys.readouterr()
+
+    import_dump_files(tmp_path, db_file, delta=True)
+    assert 'Delta import: 0 inserted, 0 updated, 0 deleted' in capsys.readouterr().out
+    assert stored_rows(db_file) == before
+
+
+def test_delta_import_matches_a_full_import(tmp_path, capsys):
+    write_dump_file(tmp_path, 'WD8A', ['title_t00.mkv', 'A', 'title_t00.mkv', 'B'])
+    db_file = tmp_path / 'media_info.db'
+    import_dump_files(tmp_path, db_file)
+    capsys.readouterr()
+
+    (tmp_path / 'WD8A_final.txt').write_text(''.join(line + '\n' for line in [
+        dump_line('title_t00.mkv'), dump_line('A'), dump_line('title_t00.mkv', max_cll=4000),
+        dump_line('title_t00.mkv')]), encoding='utf-8')
+    import_dump_files(tmp_path, db_file, delta=True)
+    assert 'Delta import: 1 inserted, 1 updated, 1 deleted' in capsys.readouterr().out
+
+    full_db_file = tmp_path / 'full.db'
+    import_dump_files(tmp_path, full_db_file)
+    with sqlite3.connect(db_file) as delta_conn, sqlite3.connect(full_db_file) as full_conn:
+        query = 'SELECT volume, title, maxcll FROM media_info ORDER BY title, maxcll'
+        assert delta_conn.execute(query).fetchall() == full_conn.execute(query).fetchall()
@@ -0,0 +1,133 @@
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import import_media_info_into_db_
+from import_media_info_into_db_ import Base, MediaInfoModel, bulk_save_or_update, prepare_media_info, \
+    relative_volume_path, upgrade_schema
+
+
+def media_info(volume, complete_name, max_fall='400 cd/m2', max_cll='1000 cd/m2', duration=7263104):
+    return {'volume': volume, 'tracks': [
+        {'track_type': 'General', 'complete_name': complete_name, 'duration': duration, 'file_size': 60_000_000_000,
+         'overall_bit_rate': 72_848_391},
+        {'track_type': 'Video', 'format': 'HEVC', 'bit_rate': 68_402_093, 'frame_rate': '23.976',
+         'hdr_format': 'SMPTE ST 2086', 'mastering_display_luminance': 'min: 0.0050 cd/m2, max: 4000 cd/m2',
+         'maximum_frameaverage_light_level': max_fall, 'maximum_content_light_level': max_cll}]}
+
+
+def model(volume, path, **kwargs):
+    return prepare_media_info(path.rsplit('/', 1)[-1], media_info(volume, path, **kwargs), relative_volume_path(path))
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f'sqlite:///{(tmp_path / "media_info.db").as_posix()}')
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def stored_rows(session):
+    return session.query(MediaInfoModel.volume, MediaInfoModel.relative_path, MediaInfoModel.duration,
+                         MediaInfoModel.max_fall, MediaInfoModel.max_cll).order_by(MediaInfoModel.id).all()
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('G:/Movies/Title/title_t00.mkv', 'Movies/Title/title_t00.mkv'),
+    ('G:\\Movies\\Title\\title_t00.mkv', 'Movies/Title/title_t00.mkv'),
+    ('/mnt/g/Movies/title_t00.mkv', 'mnt/g/Movies/title_t00.mkv'),
+    ('title_t00.mkv', 'title_t00.mkv'),
+])
+def test_relative_volume_path(path, expected):
+    assert relative_volume_path(path) == expected
+
+
+def test_upsert_updates_the_row_of_the_same_path(session):
+    bulk_save_or_update(session, [model('WD8A', 'G:/Movies/A/title_t00.mkv')])
+    bulk_save_or_update(session, [model('WD8A', 'G:/Movies/A/title_t00.mkv', duration=1000)])
+    assert stored_rows(session) == [('WD8A', 'Movies/A/title_t00.mkv', 1000, 400, 1000)]
+
+
+def test_upsert_keeps_files_sharing_a_name_in_different_folders(session):
+    bulk_save_or_update(session, [model('WD8A', 'G:/Movies/A/title_t00.mkv'),
+                                  model('WD8A', 'G:/Movies/B/title_t00.mkv'),
+                                  model('WD2', 'G:/Movies/A/title_t00.mkv')])
+    assert [row[:2] for row in stored_rows(session)] == [('WD8A', 'Movies/A/title_t00.mkv'),
+                                                         ('WD8A', 'Movies/B/title_t00.mkv'),
+                                                         ('WD2', 'Movies/A/title_t00.mkv')]
+
+
+def test_upsert_keeps_known_light_levels_when_the_new_value_is_null(session):
+    bulk_save_or_update(session, [model('WD8A', 'G:/Movies/A/title_t00.mkv')])
+    bulk_save_or_update(session, [model('WD8A', 'G:/Movies/A/title_t00.mkv', max_fall=None, max_cll=None,
+                                        duration=1000)])
+    assert stored_rows(session) == [('WD8A', 'Movies/A/title_t00.mkv', 1000, 400, 1000)]
+
+
+def legacy_database(db_file, rows):
+    # media_info as it was before relative_path, unique on (volume, file_name)
+    conn = sqlite3.connect(db_file)
+    conn.execute('CREATE TABLE media_info (id INTEGER PRIMARY KEY AUTOINCREMENT, volume VARCHAR NOT NULL, '
+                 'file_name VARCHAR NOT NULL, full_json TEXT NOT NULL)')
+    with conn:
+        conn.executemany('INSERT INTO media_info (volume, file_name, full_json) VALUES (?, ?, ?)',
+                         [(volume, complete_name.replace('\\', '/').rsplit('/', 1)[-1],
+                           json.dumps(media_info(volume, complete_name))) for volume, complete_name in rows])
+    return conn
+
+
+def test_upgrade_schema_backfills_relative_paths_from_complete_name(tmp_path):
+    db_file = tmp_path / 'media_info.db'
+    with legacy_database(db_file, [('WD8A', 'G:\\Movies\\A\\title_t00.mkv'), ('WD8A', 'G:\\Movies\\B\\b.mkv')]) as conn:
+        conn.execute('CREATE UNIQUE INDEX ux_media_info_volume_file_name ON media_info (volume, file_name)')
+    conn.close()
+
+    engine = create_engine(f'sqlite:///{db_file.as_posix()}')
+    upgrade_schema(engine)
+    session = sessionmaker(bind=engine)()
+    bulk_save_or_update(session, [model('WD8A', 'G:/Movies/C/title_t00.mkv')])
+    assert [row[:2] for row in stored_rows(session)] == [('WD8A', 'Movies/A/title_t00.mkv'),
+                                                         ('WD8A', 'Movies/B/b.mkv'),
+                                                         ('WD8A', 'Movies/C/title_t00.mkv')]
+    session.close()
+    engine.dispose()
+
+
+def test_upgrade_schema_refuses_duplicates_without_deleting_them(tmp_path):
+    db_file = tmp_path / 'media_info.db'
+    legacy_database(db_file, [('WD8A', 'G:\\Movies\\A\\a.mkv'), ('WD8A', 'G:\\Movies\\A\\a.mkv')]).close()
+
+    engine = create_engine(f'sqlite:///{db_file.as_posix()}')
+    with pytest.raises(RuntimeError, match='more than once'):
+        upgrade_schema(engine)
+    engine.dispose()
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM media_info').fetchone() == (2,)
+
+
+def test_prune_of_a_subdirectory_rescan_keeps_the_rest_of_the_volume(tmp_path, monkeypatch):
+    monkeypatch.setattr(import_media_info_into_db_, 'get_volume_label', lambda path: 'WD8A')
+    monkeypatch.setattr(import_media_info_into_db_, 'extract_media_info',
+                        lambda file_path, cache_path=None: media_info(None, str(file_path)))
+    volume_dir = tmp_path / 'vol'
+    for relative_path in ('Movies/A/title_t00.mkv', 'Movies/B/title_t00.mkv', 'TV/B/title_t00.mkv'):
+        (volume_dir / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (volume_dir / relative_path).write_bytes(b'\0')
+    db_path = f'sqlite:///{(tmp_path / "media_info.db").as_posix()}'
+    import_media_info_into_db_.main(str(volume_dir), db_path)
+
+    (volume_dir / 'Movies/B/title_t00.mkv').unlink()
+    deleted_paths = import_media_info_into_db_.main(str(volume_dir / 'Movies'), db_path, incremental=True, prune=True)
+
+    root = relative_volume_path(volume_dir)
+    assert deleted_paths == [f'{root}/Movies/B/title_t00.mkv']
+    with sqlite3.connect(tmp_path / 'media_info.db') as conn:
+        assert conn.execute('SELECT relative_path FROM media_info ORDER BY relative_path').fetchall() == [
+            (f'{root}/Movies/A/title_t00.mkv',), (f'{root}/TV/B/title_t00.mkv',)]
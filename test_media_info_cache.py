@@ -0,0 +1,63 @@
+import sqlite3
+
+from media_info_cache import MediaInfoCache, set_mediainfo_json_source_path, set_pymediainfo_source_path
+
+
+def stored_bytes(cache):
+    return cache.conn.execute('SELECT COALESCE(SUM(size), 0) FROM media_info_cache').fetchone()[0]
+
+
+def counted_bytes(cache):
+    return cache.conn.execute("SELECT value FROM media_info_cache_stats WHERE name = 'total_bytes'").fetchone()[0]
+
+
+def test_running_total_follows_inserts_replacements_and_evictions(tmp_path):
+    cache = MediaInfoCache(str(tmp_path / 'cache.db'), max_bytes=25)
+    cache.put('a', 'JSON', 'x' * 10)
+    cache.put('b', 'JSON', 'x' * 10)
+    cache.put('a', 'JSON', 'x' * 4)
+    assert counted_bytes(cache) == stored_bytes(cache) == 14
+    cache.put('c', 'JSON', 'x' * 12)
+    # a was replaced after b was written, so b is the least recently used entry
+    assert cache.get('b', 'JSON') is None
+    assert cache.evictions == 1
+    assert counted_bytes(cache) == stored_bytes(cache) == 16
+    cache.close()
+
+
+def test_running_total_starts_from_an_existing_cache(tmp_path):
+    cache_path = str(tmp_path / 'cache.db')
+    MediaInfoCache(cache_path).close()
+    with sqlite3.connect(cache_path) as conn:
+        # A cache written before the size triggers existed
+        for trigger in ('ai', 'ad', 'au'):
+            conn.execute(f'DROP TRIGGER media_info_cache_size_{trigger}')
+        conn.execute("DELETE FROM media_info_cache_stats WHERE name = 'total_bytes'")
+        conn.execute("INSERT INTO media_info_cache VALUES ('a', 'JSON', 'xxxxx', 5, 0)")
+    conn.close()
+
+    cache = MediaInfoCache(cache_path)
+    cache.put('b', 'JSON', 'xxx')
+    assert counted_bytes(cache) == stored_bytes(cache) == 8
+    cache.close()
+
+
+def test_pymediainfo_path_fields_name_the_current_file():
+    data = {'tracks': [{'track_type': 'General', 'complete_name': '/mnt/a/Movies/old_name.mkv',
+                        'folder_name': '/mnt/a/Movies', 'file_name': 'old_name', 'file_extension': 'mkv',
+                        'file_name_extension': 'old_name.mkv', 'format': 'Matroska'},
+                       {'track_type': 'Video', 'format': 'HEVC'}]}
+    set_pymediainfo_source_path(data, '/mnt/b/Copy/title_t00.mkv')
+    assert data['tracks'][0] == {'track_type': 'General', 'complete_name': '/mnt/b/Copy/title_t00.mkv',
+                                 'folder_name': '/mnt/b/Copy', 'file_name': 'title_t00', 'file_extension': 'mkv',
+                                 'file_name_extension': 'title_t00.mkv', 'format': 'Matroska'}
+    assert data['tracks'][1] == {'track_type': 'Video', 'format': 'HEVC'}
+
+
+def test_mediainfo_json_ref_names_the_current_file():
+    media_info = {'media': {'@ref': '/mnt/a/Movies/old_name.mkv',
+                            'track': [{'@type': 'General', 'FileNameExtension': 'old_name.mkv', 'FileSize': '1000'}]}}
+    set_mediainfo_json_source_path(media_info, '/mnt/b/Copy/title_t00.mkv')
+    assert media_info['media'] == {'@ref': '/mnt/b/Copy/title_t00.mkv',
+                                   'track': [{'@type': 'General', 'FileNameExtension': 'title_t00.mkv',
+                                              'FileSize': '1000'}]}
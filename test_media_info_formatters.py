@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+import pytest
+
+import globals
+import media_info_formatters
+
+formatters = {'file_size': (globals.format_file_size, media_info_formatters.format_file_size_column),
+              'mbps': (globals.convert_bitrate_to_mbps, media_info_formatters.convert_bitrate_to_mbps_column),
+              'duration': (globals.format_duration, media_info_formatters.format_duration_column)}
+
+# The edges of each formatter's formatting: unit and rounding boundaries, half cents, strings, missing values
+edge_values = {
+    'file_size': [0, 1, 1023, 1024, 1025, 1024 ** 2 - 1, 1024 ** 4, 1024 ** 5 - 1, 1024 ** 5, 2 ** 60, -5, 0.125,
+                  1.005, 2.675, 1023.995, 1023.9951, -0.0, float('nan'), None],
+    'mbps': [0, 1, 5_000, 4_999, 1_000_000, 72_848_391, 72_848_391.9, '68402093', 0.4, None, float('nan')],
+    'duration': [0, 1, 999, 1000, 59_999, 3_600_000, 359_999_999, 360_000_000, 1_440_000_000_000, '7263.104',
+                 '7263.1', '0', '', '0.000', 7263.104, 8667000.0, 0.0, -1, None],
+}
+
+
+def random_values(name, row_count, rng):
+    # Integers over the range of each column as the dump table stores them, plus floats and (where the scalar
+    # function takes them) numeric strings, as SQLite hands back values stored with another type than declared
+    if name == 'file_size':
+        values = np.exp(rng.uniform(0, np.log(2.0 ** 52), row_count)).astype(np.int64)
+    elif name == 'mbps':
+        values = rng.integers(0, 150_000_000, row_count)
+    else:
+        values = rng.integers(0, 6 * 3600 * 1000, row_count)
+    values = values.tolist()
+    for i in rng.choice(row_count, row_count // 10, replace=False).tolist():
+        values[i] = values[i] / 1000 if i % 2 or name == 'file_size' else str(values[i])
+    return values
+
+
+def expected_value(scalar, value):
+    # Missing values give None from the column versions, the scalar functions aren't defined for them
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return scalar(value)
+
+
+@pytest.mark.parametrize('name', formatters)
+def test_column_formatter_equals_scalar_function(name):
+    scalar, column = formatters[name]
+    values = random_values(name, 20_000, np.random.default_rng(0)) + edge_values[name]
+    assert column(values).tolist() == [expected_value(scalar, value) for value in values]
+
+
+@pytest.mark.parametrize('name', formatters)
+def test_column_formatter_equals_scalar_function_on_integer_columns(name):
+    # Integer columns, with or without NULLs, take the numeric fast paths
+    scalar, column = formatters[name]
+    values = [value for value in random_values(name, 20_000, np.random.default_rng(1)) if isinstance(value, int)]
+    values += [0, 1, 1024, 5_000]
+    expected = [scalar(value) for value in values]
+    assert column(values).tolist() == expected
+    assert column(np.array(values, dtype=np.int64)).tolist() == expected
+    assert column(values + [None]).tolist() == expected + [None]
@@ -0,0 +1,109 @@
+import sqlite3
+
+import pytest
+
+from globals import media_info_table_columns, media_info_table_columns_def
+from media_info_search import build_fts_query, count_cache, count_search_results, ensure_fts_index, \
+    search_media_info, search_media_info_keyset
+
+titles = ['Dolby Vision Demo', 'Blade Runner 2049', 'Dune Part Two', 'The Soldier', 'Dune',
+          'Amélie', 'Dolby Atmos Test', 'Heat', 'Dune Messiah', 'Arrival']
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f'CREATE TABLE media_info '
+                 f'({", ".join(f"{column} {column_type}" for column, column_type in media_info_table_columns_def)})')
+    ensure_fts_index(conn)
+    with conn:
+        conn.executemany(f'INSERT INTO media_info ({", ".join(media_info_table_columns)}) '
+                         f'VALUES ({", ".join("?" * len(media_info_table_columns))})',
+                         [(title, 7_263_104, 60_000_000_000, 72_848_391, 'HEVC', 68_402_093, 23.976,
+                           'SMPTE ST 2086', 'Display P3', 'min: 0.0050 cd/m2, max: 4000 cd/m2', 400, 1000)
+                          for title in titles])
+    count_cache.clear()
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('Dolby', '"Dolby"*'),
+    ('dolby vision', '"dolby"* "vision"*'),
+    ('Blade-Runner: 2049', '"Blade"* "Runner"* "2049"*'),
+    ('title_t00', '"title"* "t00"*'),
+    ('"quoted" OR NEAR(x)', '"quoted"* "OR"* "NEAR"* "x"*'),
+    ('Amélie', '"Amélie"*'),
+    ('  ', ''),
+    ('*:-', ''),
+])
+def test_build_fts_query(query, expected):
+    assert build_fts_query(query) == expected
+
+
+def test_fts_search_matches_every_word_as_a_prefix(conn):
+    assert count_search_results(conn, 'dolb') == ('fts', 2)
+    assert count_search_results(conn, 'dolby vis') == ('fts', 1)
+    # remove_diacritics folds é into e
+    assert count_search_results(conn, 'amelie') == ('fts', 1)
+
+
+def test_substring_fallback_when_the_index_has_no_match(conn):
+    assert count_search_results(conn, 'oldier') == ('like', 1)
+    assert count_search_results(conn, 'no such title') == ('like', 0)
+
+
+def test_fts_index_follows_updates_and_deletes(conn):
+    with conn:
+        conn.execute("UPDATE media_info SET title = 'Heat 1995' WHERE title = 'Heat'")
+        conn.execute("DELETE FROM media_info WHERE title = 'Arrival'")
+    assert count_search_results(conn, '1995') == ('fts', 1)
+    assert count_search_results(conn, 'arrival') == ('like', 0)
+
+
+def test_ensure_fts_index_rebuilds_only_when_stale(conn):
+    assert ensure_fts_index(conn) is False
+    conn.execute('DROP TRIGGER media_info_fts_ai')
+    assert ensure_fts_index(conn) is True
+    assert count_search_results(conn, 'dune') == ('fts', 3)
+
+
+def keyset_titles(conn, query, items_per_page, after=None, before=None):
+    rows, next_cursor, prev_cursor, total_rows = search_media_info_keyset(conn, query, items_per_page, after, before)
+    return [row[0] for row in rows], next_cursor, prev_cursor, total_rows
+
+
+@pytest.mark.parametrize('query', ['HEVC', 'oldier'])
+def test_keyset_pages_walk_forward_and_back(conn, query):
+    # 'HEVC' matches every row through the index, 'oldier' goes through the LIKE fallback
+    expected = [title for title in titles if query == 'HEVC' or query in title]
+    page, next_cursor, prev_cursor, total_rows = keyset_titles(conn, query, 3)
+    assert prev_cursor is None and total_rows == len(expected)
+    forward = page
+    while next_cursor is not None:
+        page, next_cursor, prev_cursor, _ = keyset_titles(conn, query, 3, after=next_cursor)
+        forward = forward + page
+    assert forward == expected
+
+    # Back from the last page to the first one
+    backward = page
+    while prev_cursor is not None:
+        page, _, prev_cursor, _ = keyset_titles(conn, query, 3, before=prev_cursor)
+        backward = page + backward
+    assert backward == expected
+
+
+def test_keyset_page_before_the_second_page_is_the_first(conn):
+    first, next_cursor, _, _ = keyset_titles(conn, 'HEVC', 4)
+    second, _, prev_cursor, _ = keyset_titles(conn, 'HEVC', 4, after=next_cursor)
+    assert second == titles[4:8]
+    page, next_from_first, prev_from_first, _ = keyset_titles(conn, 'HEVC', 4, before=prev_cursor)
+    assert page == first
+    assert prev_from_first is None
+    assert next_from_first == next_cursor
+
+
+def test_offset_pages_cover_every_match_once(conn):
+    pages = [search_media_info(conn, 'HEVC', page, 4) for page in (1, 2, 3)]
+    assert {total_pages for _, total_pages in pages} == {3}
+    assert sorted(row[0] for rows, _ in pages for row in rows) == sorted(titles)
@@ -0,0 +1,34 @@
+from media_tracks import MediaTracks
+
+media_info = {'media': {'@ref': 'Title_4K.mkv', 'track': [
+    {'@type': 'General', 'Duration': '7263.104', 'FileSize': '68402093', 'OverallBitRate': '75341234'},
+    {'@type': 'Video', 'Format': 'HEVC', 'BitRate': '68402093', 'HDR_Format': 'SMPTE ST 2086'},
+    {'@type': 'Audio', 'Format': 'MLP FBA', 'Channels': '8', 'Language': 'en'},
+    {'@type': 'Audio', 'Format': 'AC-3', 'Channels': '6', 'Language': 'fr'},
+    {'@type': 'Text', 'Format': 'PGS', 'Language': 'en'},
+]}}
+
+
+def test_from_mediainfo_json_builds_all_tracks_by_default():
+    tracks = MediaTracks.from_mediainfo_json(media_info)
+    assert tracks.general.file_size == '68402093'
+    assert tracks.video.format == 'HEVC'
+    assert tracks.audio_summary() == 'MLP FBA 8ch en, AC-3 6ch fr'
+    assert tracks.subtitle_languages() == 'en'
+
+
+def test_from_mediainfo_json_builds_only_the_requested_track_types():
+    tracks = MediaTracks.from_mediainfo_json(media_info, track_types={'General', 'Video'})
+    assert tracks.general.overall_bit_rate == '75341234'
+    assert tracks.video.hdr_format == 'SMPTE ST 2086'
+    assert tracks.audio == [] and tracks.text == []
+
+
+def test_from_pymediainfo_skips_unrequested_track_types():
+    data = {'tracks': [{'track_type': 'General', 'duration': 7263104},
+                       {'track_type': 'Audio', 'format': 'AC-3', 'channel_s': 6},
+                       {'track_type': 'Video', 'format': 'HEVC'}]}
+    tracks = MediaTracks.from_pymediainfo(data, track_types={'Video', 'Audio'})
+    assert tracks.general is None
+    assert tracks.video.format == 'HEVC'
+    assert tracks.audio_summary() == 'AC-3 6ch'
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import locale
+import shutil
+import subprocess
+import sys
+
+import mkv_info
+from media_info_cache import MediaInfoCache
+
+stub_mediainfo_script = """
+import json, os, sys
+file_path = sys.argv[-1]
+with open(file_path + '.runs', 'a') as runs:
+    runs.write('run\\n')
+track = {'@type': 'General', 'FileSize': str(os.path.getsize(file_path))}
+print(json.dumps({'media': {'@ref': file_path, 'track': [track]}}))
+"""
+
+
+def read_dump(dump_path):
+    with open(dump_path) as dump_file:
+        return [json.loads(line) for line in dump_file]
+
+
+def test_async_dump_serves_repeats_and_copies_from_the_cache(tmp_path):
+    stub_path = tmp_path / 'stub_mediainfo.py'
+    stub_path.write_text(stub_mediainfo_script)
+    cmd = [sys.executable, str(stub_path)]
+    (tmp_path / 'F').mkdir()
+    paths = [tmp_path / 'F' / f'Title_{i}_4K.mkv' for i in range(4)]
+    for i, path in enumerate(paths):
+        path.write_bytes(bytes([i]) * (1000 + i))
+    cache = MediaInfoCache(str(tmp_path / 'cache.db'))
+
+    assert asyncio.run(mkv_info.dump_media_info_async(paths, str(tmp_path / 'first.txt'), cache, 2, cmd)) == (4, [])
+    assert cache.misses == 4
+
+    # The same titles copied to another drive hash to the same cache entries
+    (tmp_path / 'G').mkdir()
+    copies = [tmp_path / 'G' / path.name for path in paths]
+    for path, copy in zip(paths, copies):
+        shutil.copyfile(path, copy)
+    assert asyncio.run(mkv_info.dump_media_info_async(copies, str(tmp_path / 'copies.txt'), cache, 2, cmd)) == (4, [])
+    assert cache.hits == 4
+    assert not any(copy.with_name(copy.name + '.runs').exists() for copy in copies)
+    assert [media_info['media']['@ref'] for media_info in read_dump(tmp_path / 'copies.txt')] == \
+        [str(copy) for copy in copies]
+    assert [media_info['media']['track'] for media_info in read_dump(tmp_path / 'copies.txt')] == \
+        [media_info['media']['track'] for media_info in read_dump(tmp_path / 'first.txt')]
+    cache.close()
+
+
+def test_sync_run_decodes_utf8_whatever_the_locale(tmp_path, monkeypatch):
+    # The default text mode encoding of a Windows console locale, also where Python runs in UTF-8 mode
+    monkeypatch.setattr(subprocess, '_text_encoding', lambda: 'cp1252', raising=False)
+    monkeypatch.setattr(locale, 'getpreferredencoding', lambda do_setlocale=True: 'cp1252')
+    stub_path = tmp_path / 'stub_mediainfo.py'
+    stub_path.write_text("import sys\nsys.stdout.buffer.write('{\"title\": \"Am\u00e9lie \u6771\u4eac\"}'"
+                         ".encode('utf-8'))\n")
+    output = mkv_info.run_mediainfo(str(tmp_path / 'Amelie.mkv'), [sys.executable, str(stub_path)])
+    assert json.loads(output) == {'title': 'Am\u00e9lie \u6771\u4eac'}
@@ -0,0 +1,32 @@
+from semantic_query import QueryEmbeddingCache, reciprocal_rank_fusion, rrf_k
+
+
+def test_embedding_cache_keys_on_the_exact_query_for_cased_models():
+    cache = QueryEmbeddingCache(2)
+    cache.put('HDR10', [1.0])
+    assert cache.get('HDR10') == [1.0]
+    assert cache.get('hdr10') is None
+    assert cache.get(' HDR10') is None
+    assert cache.stats() == {'entries': 1, 'max_entries': 2, 'hits': 1, 'misses': 2}
+
+
+def test_embedding_cache_shares_entries_when_the_tokenizer_lowercases():
+    cache = QueryEmbeddingCache(2, lowercase=True)
+    cache.put('Dolby Vision', [1.0])
+    assert cache.get('dolby vision') == [1.0]
+
+
+def test_embedding_cache_evicts_the_least_recently_used_query():
+    cache = QueryEmbeddingCache(2)
+    cache.put('a', [1.0])
+    cache.put('b', [2.0])
+    cache.get('a')
+    cache.put('c', [3.0])
+    assert cache.get('b') is None
+    assert cache.get('a') == [1.0] and cache.get('c') == [3.0]
+
+
+def test_reciprocal_rank_fusion_keeps_the_positions_of_the_full_ranking():
+    # 'x' repeats in the second ranking, it counts once and 'y' keeps its third place
+    fused = dict(reciprocal_rank_fusion(['x', 'z'], ['x', 'x', 'y']))
+    assert fused == {'x': 2 / (rrf_k + 1), 'z': 1 / (rrf_k + 2), 'y': 1 / (rrf_k + 3)}